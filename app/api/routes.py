@@ -1,144 +1,419 @@
-import uuid
 import os
-from typing import Optional, Dict, Any, List
+import uuid
+import asyncio
+from contextlib import contextmanager
+from typing import Optional, Dict, Any, List, Tuple
 
-from fastapi import APIRouter, UploadFile, File, Form, HTTPException, Request
-from fastapi.responses import HTMLResponse, JSONResponse, FileResponse
+from fastapi import APIRouter, UploadFile, File, Form, HTTPException, Query, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import (HTMLResponse, JSONResponse, ORJSONResponse, FileResponse, StreamingResponse,
+                               Response)
 from fastapi.templating import Jinja2Templates
 
-from app.services import parser, detector, aggregate, report, cache
-from app.models.schemas import AnalysisResult, ManualEpisode, PatchRequest
-from app.utils.io import read_file_bytes, ensure_dirs
-from app.utils.checksum import file_checksum
-from app.utils.text import safe_json_dump
+from app.services import detector, aggregate, report, pipeline, jobs, uploads, store, batch, drafts
+from app.models.schemas import AnalysisResult, ManualEpisode, PatchRequest, Summary
+from app.services.pipeline import STORE, SCENE_CACHE
+from app.services.episodes import EpisodeTable
+from app.utils import metrics
+from app.settings import settings
 
 TEMPLATES = Jinja2Templates(directory="app/templates")
+# start/end эпизода — позиции в тексте сцены; совпадение в цитате начинается через QUOTE_CONTEXT
+TEMPLATES.env.globals["QUOTE_CONTEXT"] = detector.QUOTE_CONTEXT
 router = APIRouter()
 
-DATA_DIR = "data"
-UPLOADS = os.path.join(DATA_DIR, "uploads")
-ANALYSES = os.path.join(DATA_DIR, "analyses")
-REPORTS = os.path.join(DATA_DIR, "reports")
-CACHE = os.path.join(DATA_DIR, "cache")
-ensure_dirs([UPLOADS, ANALYSES, REPORTS, CACHE])
-
 @router.post("/upload", response_class=HTMLResponse)
-async def upload(request: Request, file: UploadFile = File(...)):
-    file_id = str(uuid.uuid4())
+async def upload(request: Request, file: UploadFile = File(...), previous_file_id: Optional[str] = Form(None)):
     ext = os.path.splitext(file.filename)[1].lower()
     if ext not in [".pdf", ".docx"]:
         raise HTTPException(400, "Поддерживаются только .pdf и .docx")
+    # previous_file_id — прежний черновик этого сценария: его решения переносятся на неизменённые сцены
+    if previous_file_id and not STORE.has_analysis(previous_file_id):
+        raise HTTPException(400, "Нет анализа предыдущей версии")
+    # тело формы уже ограничено main.BodyLimit; здесь — точный размер самого файла
+    max_bytes = settings.upload_max_mb * 1024 * 1024
+    try:
+        tmp, sha, size = await uploads.receive(file, max_bytes)
+    except uploads.UploadTooLarge:
+        raise HTTPException(413, f"Файл больше {settings.upload_max_mb} МБ")
+    file_id, duplicate = uploads.commit(tmp, sha, size, ext)
+    if previous_file_id and previous_file_id != file_id:
+        STORE.link_version(file_id, previous_file_id)
 
-    dst = os.path.join(UPLOADS, f"{file_id}{ext}")
-    content = await file.read()
-    with open(dst, "wb") as f:
-        f.write(content)
+    analysis, pages = None, None
+    message = "Файл загружен. Запустите анализ."
+    if duplicate:
+        message = "Такой файл уже загружался — используется прежняя загрузка."
+        analysis, pages = results_page(file_id, 1)
+        if analysis is not None:
+            message = "Такой файл уже проанализирован — показан готовый результат."
 
     return TEMPLATES.TemplateResponse("results.html", {
         "request": request,
         "file_id": file_id,
         "filename": file.filename,
-        "analysis": None,
-        "summary": None,
-        "message": "Файл загружен. Запустите анализ."
+        "analysis": analysis.model_dump() if analysis else None,
+        "summary": analysis.summary if analysis else None,
+        "page": pages,
+        "message": message
     })
 
-@router.post("/analyze", response_class=HTMLResponse)
-async def analyze(request: Request, file_id: str = Form(...)):
-    # Найдём файл
-    upload = None
-    for name in os.listdir(UPLOADS):
-        if name.startswith(file_id):
-            upload = os.path.join(UPLOADS, name)
-            break
+@router.post("/batch")
+async def batch_analyze(files: List[UploadFile] = File(...)):
+    # Несколько файлов и/или ZIP-архивы; ответ — NDJSON: строка на документ, затем рейтинг серии
+    for f in files:
+        if os.path.splitext(f.filename)[1].lower() not in (".pdf", ".docx", ".zip"):
+            raise HTTPException(400, f"{f.filename}: поддерживаются .pdf, .docx и .zip")
+    max_bytes = settings.upload_max_mb * 1024 * 1024
+    try:
+        received = await uploads.receive_batch(files, max_bytes, settings.batch_max_files)
+    except uploads.UploadTooLarge:
+        raise HTTPException(413, f"Файл больше {settings.upload_max_mb} МБ")
+    except uploads.TooManyFiles:
+        raise HTTPException(413, f"В пакете больше {settings.batch_max_files} документов")
+    except uploads.BadArchive:
+        raise HTTPException(400, "Повреждённый ZIP-архив")
+    if not received:
+        raise HTTPException(400, "В пакете нет документов .pdf/.docx")
+
+    items = []
+    for name, tmp, sha, size in received:
+        file_id, duplicate = uploads.commit(tmp, sha, size, os.path.splitext(name)[1].lower())
+        items.append(batch.BatchItem(name, file_id, pipeline.find_upload(file_id), duplicate))
+    return StreamingResponse(batch.run_batch(items), media_type="application/x-ndjson",
+                             headers={"X-Accel-Buffering": "no"})
+
+@router.post("/analyze", response_class=JSONResponse, status_code=202)
+async def analyze(file_id: str = Form(...), profile: bool = Form(False)):
+    # Анализ идёт в фоне; прогресс — /api/jobs/{job_id}/events (SSE)
+    upload = pipeline.find_upload(file_id)
     if not upload:
         raise HTTPException(404, "Файл не найден")
+    try:
+        job = jobs.MANAGER.submit(file_id, upload, profile and settings.profiling_enabled)
+    except jobs.QueueFull:
+        raise HTTPException(503, "Очередь анализа переполнена, повторите позже", headers={"Retry-After": "30"})
+    return JSONResponse({
+        "job_id": job.id,
+        "file_id": file_id,
+        "status": job.status,
+        "status_url": f"/api/jobs/{job.id}",
+        "events_url": f"/api/jobs/{job.id}/events",
+        "results_url": f"/api/results/{file_id}",
+        "diff_url": f"/api/diff/{file_id}" if STORE.previous_version(file_id) else None,
+    }, status_code=202)
 
-    # Парсинг и сегментация
-    doc = parser.load_document(upload)
-    scenes = parser.segment_scenes(doc)
-
-    # Инкрементальная обработка по checksum сцен
-    prior_state = cache.load_cache(CACHE, file_id)
-    episodes_by_scene = detector.process_scenes(scenes, prior_state=prior_state)
+@router.get("/jobs/{job_id}", response_class=JSONResponse)
+def job_status(job_id: str):
+    job = jobs.MANAGER.get(job_id)
+    state = job.to_dict() if job else jobs.load_job_state(job_id)
+    if state is None:
+        raise HTTPException(404, "Задача не найдена")
+    return JSONResponse(state)
 
-    # Агрегация
-    analysis = aggregate.build_analysis(file_id, upload, scenes, episodes_by_scene)
-    aggregate.apply_manual_adjustments(analysis)  # если были FP/FN/редакции
-    aggregate.compute_summary_and_rating(analysis)  # финальные метрики и рейтинг
+@router.get("/jobs/{job_id}/events")
+async def job_events(job_id: str):
+    job = jobs.MANAGER.get(job_id)
+    if job is not None:
+        events = jobs.stream_events(job)
+    elif jobs.load_job_state(job_id) is not None:
+        events = jobs.poll_events(job_id)
+    else:
+        raise HTTPException(404, "Задача не найдена")
+    return StreamingResponse(events, media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
-    # Сохранение результатов и кеш
-    cache.save_cache(CACHE, file_id, episodes_by_scene)
-    out_path = os.path.join(ANALYSES, f"{file_id}.json")
-    safe_json_dump(analysis.model_dump(), out_path)
+def results_page(file_id: str, page: int):
+    # Страница результатов — только её сцены и их эпизоды: большой сценарий целиком не грузим
+    size = max(1, settings.results_page_scenes)
+    analysis, total = STORE.load_analysis_page(file_id, (page - 1) * size, size)
+    return analysis, {"number": page, "pages": max(1, -(-total // size)), "scenes": total}
 
+@router.get("/results/{file_id}", response_class=HTMLResponse)
+def results(request: Request, file_id: str, page: int = Query(1, ge=1)):
+    analysis, pages = results_page(file_id, page)
+    if analysis is None:
+        raise HTTPException(404, "Нет анализа")
     return TEMPLATES.TemplateResponse("results.html", {
         "request": request,
         "file_id": file_id,
-        "filename": os.path.basename(upload),
+        "filename": analysis.filename,
         "analysis": analysis.model_dump(),
-        "summary": analysis.summary
+        "summary": analysis.summary,
+        "page": pages
     })
 
-@router.post("/patch", response_class=JSONResponse)
-async def patch(req: PatchRequest):
-    file_id = req.file_id
-    analysis_path = os.path.join(ANALYSES, f"{file_id}.json")
-    if not os.path.exists(analysis_path):
-        raise HTTPException(404, "Анализ для файла не найден")
+@router.get("/diff/{file_id}", response_class=ORJSONResponse)
+def draft_diff(file_id: str):
+    # Что изменилось для рейтинга относительно предыдущей версии (по текущим ревизиям обеих)
+    current = load_or_404(file_id)
+    previous_id = STORE.previous_version(file_id)
+    previous = STORE.load_analysis(previous_id) if previous_id else None
+    if previous is None:
+        raise HTTPException(404, "Нет анализа предыдущей версии")
+    alignment = drafts.align_scenes(previous.scenes, current.scenes, settings.draft_match_threshold)
+    return ORJSONResponse(drafts.diff(drafts.Draft(previous, alignment), current))
 
-    # Применяем правки
-    analysis = AnalysisResult.model_validate_json(open(analysis_path, "r", encoding="utf-8").read())
+@router.get("/search", response_class=ORJSONResponse)
+def search(rule: List[str] = Query([]), category: Optional[str] = None, severity: Optional[str] = None,
+           age_rating: Optional[str] = None, because: Optional[str] = None,
+           after: Optional[str] = None, limit: int = Query(50, ge=1, le=500), scenes: bool = False):
+    # Поиск по каталогу через обратный индекс (store.postings); фильтры объединяются по «и».
+    # rule — rule_id эпизода (violence:severe:...), because — категория, давшая итоговый рейтинг
+    terms = [f"rule:{r}" for r in rule]
+    if severity and not category:
+        raise HTTPException(400, "severity задаётся вместе с category")
+    if category:
+        terms.append(f"severity:{category}:{severity}" if severity else f"category:{category}")
+    if age_rating:
+        terms.append(f"age:{age_rating}")
+    if because:
+        terms.append(f"driver:{because}")
+    if not terms:
+        raise HTTPException(400, "Нужен хотя бы один фильтр: rule, category, age_rating, because")
+    total, items = STORE.search(terms, after, limit, scenes)
+    next_after = items[-1]["file_id"] if len(items) == limit else None
+    return ORJSONResponse({"total": total, "items": items, "next_after": next_after})
 
-    changed_scene_ids = aggregate.apply_patch(analysis, req)
-    # Переоценка только изменённых сцен
-    scenes = analysis.scenes
-    updated_episodes = detector.process_specific_scenes(scenes, changed_scene_ids)
+# --- JSON API чтения ---------------------------------------------------------
+# Анализы, сцены и эпизоды страницами по курсору, с фильтрами и проекцией полей (fields —
+# какие отдать, omit — какие убрать; у встроенных в анализ списков — с префиксом:
+# omit=scenes.text). Ответы сериализует orjson, сжимает gzip (main.JSONGZip).
 
-    # Объединяем новую оценку
-    aggregate.merge_scene_episodes(analysis, updated_episodes)
-    aggregate.apply_manual_adjustments(analysis)
-    aggregate.compute_summary_and_rating(analysis)
+def projection(fields: Optional[str], omit: Optional[str], allowed: Dict[str, str], prefix: str = "") -> List[str]:
+    def names(value: Optional[str]) -> List[str]:
+        out = []
+        for name in (value or "").split(","):
+            name = name.strip()
+            if prefix:
+                if not name.startswith(prefix):
+                    continue
+                name = name[len(prefix):]
+            if name:
+                out.append(name)
+        return out
+    wanted, dropped = names(fields) or list(allowed), set(names(omit))
+    unknown = (set(wanted) | dropped) - set(allowed)
+    if unknown:
+        raise HTTPException(400, f"Неизвестные поля: {', '.join(sorted(prefix + f for f in unknown))}")
+    return [f for f in wanted if f not in dropped]
 
-    safe_json_dump(analysis.model_dump(), analysis_path)
-    return JSONResponse({"status": "ok", "changed_scenes": changed_scene_ids, "summary": analysis.summary})
+def parse_cursor(after: Optional[str]) -> Optional[Tuple[int, int]]:
+    # курсор — "ревизия.позиция"; к другой ревизии не подходит
+    if not after:
+        return None
+    try:
+        revision, pos = after.split(".", 1)
+        return int(revision), int(pos)
+    except ValueError:
+        raise HTTPException(400, "Неверный курсор")
 
-@router.post("/mark-fp", response_class=JSONResponse)
-async def mark_fp(file_id: str = Form(...), episode_id: str = Form(...)):
-    path = os.path.join(ANALYSES, f"{file_id}.json")
-    if not os.path.exists(path):
+def page(revision: Optional[int], rows: List[Tuple[int, Dict[str, Any]]], cursor: Optional[Tuple[int, int]],
+         limit: int) -> Dict[str, Any]:
+    if revision is None:
         raise HTTPException(404, "Нет анализа")
-    analysis = AnalysisResult.model_validate_json(open(path, "r", encoding="utf-8").read())
-    aggregate.mark_false_positive(analysis, episode_id)
-    aggregate.compute_summary_and_rating(analysis)
-    safe_json_dump(analysis.model_dump(), path)
-    return JSONResponse({"status": "ok", "summary": analysis.summary})
+    if cursor and cursor[0] != revision:
+        raise HTTPException(409, f"Анализ уже изменён (текущая ревизия {revision}) — листайте с начала")
+    items = [item for _, item in rows[:limit]]
+    next_after = f"{revision}.{rows[limit - 1][0]}" if len(rows) > limit else None
+    return {"revision": revision, "items": items, "next_after": next_after}
 
-@router.post("/add-episode", response_class=JSONResponse)
-async def add_episode(req: ManualEpisode):
-    path = os.path.join(ANALYSES, f"{req.file_id}.json")
-    if not os.path.exists(path):
+def scenes_page(file_id: str, fields: List[str], after: Optional[str], limit: int) -> Dict[str, Any]:
+    cursor = parse_cursor(after)
+    revision, rows = STORE.page_scenes(file_id, fields, cursor[1] if cursor else -1, limit + 1)
+    return page(revision, rows, cursor, limit)
+
+def episodes_page(file_id: str, fields: List[str], after: Optional[str], limit: int, **filters) -> Dict[str, Any]:
+    if any(s not in aggregate.SEV_ORDER for s in filters.get("severities") or []):
+        raise HTTPException(400, f"severity — одно из {', '.join(aggregate.SEV_ORDER)}")
+    cursor = parse_cursor(after)
+    revision, rows = STORE.page_episodes(file_id, fields, cursor[1] if cursor else 0, limit + 1, **filters)
+    return page(revision, rows, cursor, limit)
+
+@router.get("/analyses", response_class=ORJSONResponse)
+def list_analyses(after: Optional[str] = None, limit: int = Query(50, ge=1, le=500)):
+    items = STORE.list_analyses(after, limit)
+    return ORJSONResponse({"items": items, "next_after": items[-1]["file_id"] if len(items) == limit else None})
+
+@router.get("/analyses/{file_id}", response_class=ORJSONResponse)
+def get_analysis(file_id: str, embed: List[str] = Query([]), fields: Optional[str] = None,
+                 omit: Optional[str] = None, limit: int = Query(100, ge=1, le=1000)):
+    # embed=scenes / embed=episodes — первые страницы списков прямо в ответе (один запрос на экран)
+    embed = [e for value in embed for e in value.split(",") if e]
+    if set(embed) - {"scenes", "episodes"}:
+        raise HTTPException(400, "embed — scenes и/или episodes")
+    head = STORE.analysis_head(file_id)
+    if head is None:
+        raise HTTPException(404, "Нет анализа")
+    if "scenes" in embed:
+        head["scenes"] = scenes_page(file_id, projection(fields, omit, store.SCENE_FIELDS, "scenes."), None, limit)
+    if "episodes" in embed:
+        head["episodes"] = episodes_page(file_id, projection(fields, omit, store.EPISODE_FIELDS, "episodes."),
+                                         None, limit)
+    return ORJSONResponse(head)
+
+@router.get("/analyses/{file_id}/scenes", response_class=ORJSONResponse)
+def list_scenes(file_id: str, fields: Optional[str] = None, omit: Optional[str] = None,
+                after: Optional[str] = None, limit: int = Query(100, ge=1, le=1000)):
+    return ORJSONResponse(scenes_page(file_id, projection(fields, omit, store.SCENE_FIELDS), after, limit))
+
+@router.get("/analyses/{file_id}/episodes", response_class=ORJSONResponse)
+def list_episodes(file_id: str, category: List[str] = Query([]), severity: List[str] = Query([]),
+                  scene_id: List[str] = Query([]), is_fp: Optional[bool] = None,
+                  fields: Optional[str] = None, omit: Optional[str] = None,
+                  after: Optional[str] = None, limit: int = Query(100, ge=1, le=1000)):
+    return ORJSONResponse(episodes_page(file_id, projection(fields, omit, store.EPISODE_FIELDS), after, limit,
+                                        categories=category, severities=severity, scene_ids=scene_id,
+                                        is_fp=is_fp))
+
+def load_or_404(file_id: str) -> AnalysisResult:
+    analysis = STORE.load_analysis(file_id)
+    if analysis is None:
+        raise HTTPException(404, "Нет анализа")
+    return analysis
+
+@contextmanager
+def editing(file_id: str, revision: Optional[int]):
+    # Точечная правка анализа в хранилище; revision — ожидаемая ревизия (None — без проверки)
+    try:
+        with STORE.edit(file_id, revision) as tx:
+            yield tx
+    except store.NotFound:
         raise HTTPException(404, "Нет анализа")
-    analysis = AnalysisResult.model_validate_json(open(path, "r", encoding="utf-8").read())
-    aggregate.add_manual_episode(analysis, req)
-    aggregate.compute_summary_and_rating(analysis)
-    safe_json_dump(analysis.model_dump(), path)
-    return JSONResponse({"status": "ok", "summary": analysis.summary})
+    except store.RevisionConflict as ex:
+        raise HTTPException(409, f"Анализ уже изменён (текущая ревизия {ex.current})")
+
+def summary_state(tx: store.Edit) -> aggregate.SummaryState:
+    data = tx.summary_state()
+    if data is None:  # анализ сохранён до появления счётчиков — собираем один раз
+        return aggregate.SummaryState.from_episodes(tx.episodes(), tx.scene_count())
+    return aggregate.SummaryState.from_dict(data)
+
+def save_summary(tx: store.Edit, state: aggregate.SummaryState) -> Summary:
+    if settings.summary_verify and not aggregate.verify_summary(state, tx.episodes()):
+        state = aggregate.SummaryState.from_episodes(tx.episodes(), tx.scene_count())
+    summary = state.summary()
+    tx.set_summary(summary, state.to_dict())
+    return summary
+
+@router.post("/patch", response_class=JSONResponse)
+def patch(req: PatchRequest, request: Request):
+    timings = metrics.Timings("patch")
+    with profiling(request, "patch") as prof:
+        # Читаем и переоцениваем только правленые сцены
+        edits = {e["scene_id"]: e["new_text"] for e in req.edits}
+        with timings.stage("load"):
+            revision, scenes = STORE.load_scenes(req.file_id, list(edits))
+        if revision is None:
+            raise HTTPException(404, "Анализ для файла не найден")
+        for s in scenes:
+            s.text = edits[s.id]
+        changed_scene_ids = [s.id for s in scenes]
+        with timings.stage("detect"):
+            hits = detector.process_specific_scenes(scenes, changed_scene_ids, scene_cache=SCENE_CACHE)
+            updated = {sid: EpisodeTable.from_hits({sid: scene_hits}) for sid, scene_hits in hits.items()}
+        timings.count("scenes", len(scenes))
+        timings.count("episodes", sum(len(t) for t in updated.values()))
+
+        # пересчёт шёл по прочитанной ревизии — параллельная правка даст 409, а не потерю изменений
+        expected = req.revision if req.revision is not None else revision
+        with timings.stage("persist"), editing(req.file_id, expected) as tx:
+            state = summary_state(tx)
+            for s in scenes:
+                for e in tx.scene_episodes(s.id):
+                    state.remove(e)
+                state.add_table(updated[s.id])
+                tx.update_scene_text(s.id, s.text)
+                tx.replace_scene_episodes(s.id, updated[s.id])
+            summary = save_summary(tx, state)
+    STORE.record_timings(req.file_id, "patch", timings.to_dict())
+    return JSONResponse({"status": "ok", "changed_scenes": changed_scene_ids,
+                         "summary": summary.model_dump(), "revision": tx.revision},
+                        headers=profile_headers(prof))
+
+@router.post("/mark-fp", response_class=JSONResponse)
+def mark_fp(file_id: str = Form(...), episode_id: str = Form(...), revision: Optional[int] = Form(None)):
+    with editing(file_id, revision) as tx:
+        e = tx.episode(episode_id)
+        if e is None:
+            raise HTTPException(404, "Эпизод не найден")
+        state = summary_state(tx)
+        state.set_fp(e)
+        tx.set_fp(episode_id)
+        summary = save_summary(tx, state)
+    return JSONResponse({"status": "ok", "summary": summary.model_dump(), "revision": tx.revision})
+
+@router.post("/add-episode", response_class=JSONResponse)
+def add_episode(req: ManualEpisode):
+    with editing(req.file_id, req.revision) as tx:
+        e = aggregate.manual_episode(req)
+        state = summary_state(tx)
+        state.add(e)
+        tx.add_episode(e)
+        summary = save_summary(tx, state)
+    return JSONResponse({"status": "ok", "summary": summary.model_dump(), "revision": tx.revision})
+
+def not_modified(request: Request, etag: str) -> bool:
+    tags = [t.strip().removeprefix("W/") for t in request.headers.get("if-none-match", "").split(",")]
+    return etag in tags or "*" in tags
 
 @router.get("/report/html/{file_id}", response_class=FileResponse)
-def report_html(file_id: str):
-    analysis_path = os.path.join(ANALYSES, f"{file_id}.json")
-    if not os.path.exists(analysis_path):
+def report_html(file_id: str, request: Request):
+    # Артефакт по ключу ревизии: пока анализ не правили, файл отдаётся без загрузки и рендера
+    key = report.current_key(file_id)
+    if key is None:
         raise HTTPException(404, "Нет анализа")
-    analysis = AnalysisResult.model_validate_json(open(analysis_path, "r", encoding="utf-8").read())
-    html_path = report.render_html(analysis)
-    return FileResponse(html_path, media_type="text/html", filename=os.path.basename(html_path))
+    etag = f'"{key}"'
+    if not_modified(request, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    html_path = report.artifact_path(key, "html")
+    prof = None
+    if not os.path.exists(html_path):
+        timings = metrics.Timings("report_html")
+        with profiling(request, "report_html") as prof:
+            with timings.stage("load"):
+                analysis = load_or_404(file_id)
+            with timings.stage("render_html"):
+                html_path = report.render_html(analysis)
+        timings.count("bytes_written", os.path.getsize(html_path))
+        STORE.record_timings(file_id, "report_html", timings.to_dict())
+        etag = f'"{os.path.splitext(os.path.basename(html_path))[0]}"'
+    return FileResponse(html_path, media_type="text/html", filename=f"{file_id}.html",
+                        headers={"ETag": etag, **profile_headers(prof)})
 
 @router.get("/report/pdf/{file_id}", response_class=FileResponse)
-def report_pdf(file_id: str):
-    analysis_path = os.path.join(ANALYSES, f"{file_id}.json")
-    if not os.path.exists(analysis_path):
+async def report_pdf(file_id: str, request: Request):
+    # PDF рендерится в фоне (report.submit_pdf), запрос только ждёт готовый файл
+    key = await run_in_threadpool(report.current_key, file_id)
+    if key is None:
         raise HTTPException(404, "Нет анализа")
-    analysis = AnalysisResult.model_validate_json(open(analysis_path, "r", encoding="utf-8").read())
-    pdf_path = report.render_pdf(analysis)
-    return FileResponse(pdf_path, media_type="application/pdf", filename=os.path.basename(pdf_path))
+    if not_modified(request, f'"{key}"'):
+        return Response(status_code=304, headers={"ETag": f'"{key}"'})
+    enabled = settings.profiling_enabled and request.headers.get("x-profile") == "1"
+    profile = f"report_pdf-{uuid.uuid4().hex[:12]}" if enabled else None
+    fut = await run_in_threadpool(report.submit_pdf, file_id, profile)
+    if fut is None:
+        raise HTTPException(404, "Нет анализа")
+    try:
+        key = await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(fut)), settings.report_pdf_wait_sec)
+    except asyncio.TimeoutError:
+        return JSONResponse({"status": "rendering", "file_id": file_id}, status_code=202,
+                            headers={"Retry-After": "5"})
+    path = os.path.join(pipeline.PROFILES, f"{profile}.prof") if profile else None
+    return FileResponse(report.artifact_path(key, "pdf"), media_type="application/pdf", filename=f"{file_id}.pdf",
+                        headers={"ETag": f'"{key}"', **profile_headers(path if path and os.path.exists(path) else None)})
+
+def profiling(request: Request, op: str):
+    # Профиль одного запроса по заголовку X-Profile: 1 (только при RATING_PROFILING_ENABLED)
+    enabled = settings.profiling_enabled and request.headers.get("x-profile") == "1"
+    return metrics.profiled(enabled, pipeline.PROFILES, f"{op}-{uuid.uuid4().hex[:12]}")
+
+def profile_headers(path: Optional[str]) -> Dict[str, str]:
+    return {"X-Profile": f"/api/profiles/{os.path.basename(path)}"} if path else {}
+
+@router.get("/profiles/{name}", response_class=FileResponse)
+def profile_file(name: str):
+    path = os.path.join(pipeline.PROFILES, os.path.basename(name))
+    if not settings.profiling_enabled or not name.endswith(".prof") or not os.path.exists(path):
+        raise HTTPException(404, "Профиль не найден")
+    return FileResponse(path, media_type="application/octet-stream", filename=os.path.basename(path))
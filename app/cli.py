@@ -0,0 +1,159 @@
+"""Пакетная переоценка каталога сценариев без HTTP.
+
+Запуск из корня репозитория:
+    python -m app.cli DIR [--out results.jsonl] [--workers N] [--rule-stats 20]
+
+Документы (.pdf/.docx) раздаются по пулу процессов; каждый процесс разбирает
+документ, режет на сцены и прогоняет детекцию у себя. Результат — строка JSONL на
+документ, пишется сразу. Повторный запуск пропускает документы, для которых в
+--out уже есть успешный результат с тем же checksum и той же версией правил.
+--rule-stats N — учёт времени и совпадений по каждому правилу, в конце топ-N самых дорогих.
+"""
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from typing import Any, Dict, Iterator, Optional, Set, Tuple
+
+from app.services import parser, detector, aggregate
+from app.services.episodes import EpisodeTable
+from app.services.rules import RuleStats
+from app.utils.checksum import file_checksum
+from app.utils.io import docx_page_count
+from app.settings import settings
+
+EXTENSIONS = (".pdf", ".docx")
+
+def iter_documents(root: str) -> Iterator[str]:
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for name in sorted(filenames):
+            if os.path.splitext(name)[1].lower() in EXTENSIONS and not name.startswith(("~$", ".")):
+                yield os.path.join(dirpath, name)
+
+def load_done(out: str) -> Set[Tuple[str, str]]:
+    # (checksum, rules_version) успешно обработанных документов; оборванную строку пропускаем
+    done: Set[Tuple[str, str]] = set()
+    if not os.path.exists(out):
+        return done
+    with open(out, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                rec = json.loads(line)
+            except ValueError:
+                continue
+            if rec.get("status") == "done":
+                done.add((rec["checksum"], rec["rules_version"]))
+    return done
+
+def _init_worker(rule_stats: bool = False):
+    # документ целиком обрабатывается в одном процессе — вложенные пулы не нужны
+    settings.detect_mode = "inline"
+    settings.pdf_workers = 1
+    if rule_stats:
+        detector.enable_rule_stats()
+
+def analyze_document(path: str, checksum: str) -> Dict[str, Any]:
+    t0 = time.perf_counter()
+    timeouts_before = dict(detector.RULE_TIMEOUTS.values)
+    # сцены потоком, детекция окнами — в памяти не весь документ, а окно сцен и счётчики сводки
+    stream = parser.SceneStream(path)
+    scenes = iter(stream)
+    state = aggregate.SummaryState()
+    episodes = 0
+    while True:
+        chunk = list(itertools.islice(scenes, max(1, settings.stream_window_scenes)))
+        if not chunk:
+            break
+        table = EpisodeTable.from_hits(detector.process_scenes(chunk))
+        state.add_table(table)
+        state.total_scenes += len(chunk)
+        episodes += len(table)
+    summary = state.summary()
+    pages = stream.page_count if stream.type == "pdf" else docx_page_count(path)
+    # guarded-правила, пропущенные по таймауту на этом документе
+    timeouts = {key[0]: n - timeouts_before.get(key, 0) for key, n in detector.RULE_TIMEOUTS.values.items()
+                if n != timeouts_before.get(key, 0)}
+    return {
+        "path": path, "checksum": checksum, "rules_version": detector.COMPILED_RULES.fingerprint,
+        "status": "done", "pages": pages, "scenes": state.total_scenes, "episodes": episodes,
+        "age_rating": summary.age_rating, "summary": summary.model_dump(),
+        "seconds": round(time.perf_counter() - t0, 3),
+        "rule_timeouts": timeouts,
+        "_rule_stats": detector.drain_rule_stats(),
+    }
+
+def run(root: str, out: str, workers: int, rule_stats: Optional[RuleStats] = None) -> Dict[str, Any]:
+    rules_version = detector.COMPILED_RULES.fingerprint
+    done = load_done(out)
+    stats = {"done": 0, "failed": 0, "skipped": 0, "pages": 0, "scenes": 0}
+    ctx = multiprocessing.get_context(settings.detect_start_method)
+    started = time.perf_counter()
+    with open(out, "a", encoding="utf-8") as sink, \
+            ProcessPoolExecutor(max_workers=workers, mp_context=ctx, initializer=_init_worker,
+                                initargs=(rule_stats is not None,)) as pool:
+        inflight = {}
+
+        def collect(futures):
+            for fut in futures:
+                path, checksum = inflight.pop(fut)
+                try:
+                    rec = fut.result()
+                except Exception as ex:
+                    rec = {"path": path, "checksum": checksum, "rules_version": rules_version,
+                           "status": "error", "error": f"{type(ex).__name__}: {ex}"}
+                    stats["failed"] += 1
+                else:
+                    partial = rec.pop("_rule_stats")
+                    if rule_stats is not None and partial:
+                        rule_stats.merge(partial)
+                    stats["done"] += 1
+                    stats["pages"] += rec["pages"] or 0
+                    stats["scenes"] += rec["scenes"]
+                sink.write(json.dumps(rec, ensure_ascii=False) + "\n")
+                sink.flush()  # прерванный прогон продолжится с этого места
+                print(f"[{rec['status']}] {path}" + (f" {rec['age_rating']}" if rec["status"] == "done" else
+                                                      f": {rec['error']}"), file=sys.stderr)
+
+        for path in iter_documents(root):
+            checksum = file_checksum(path)
+            if (checksum, rules_version) in done:
+                stats["skipped"] += 1
+                continue
+            done.add((checksum, rules_version))  # копии одного файла в каталоге считаем один раз
+            # держим в работе не больше 2×workers документов — каталог может быть огромным
+            if len(inflight) >= 2 * workers:
+                finished, _ = wait(inflight, return_when=FIRST_COMPLETED)
+                collect(finished)
+            inflight[pool.submit(analyze_document, path, checksum)] = (path, checksum)
+        collect(wait(inflight).done)
+    stats["seconds"] = round(time.perf_counter() - started, 3)
+    return stats
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Пакетная оценка каталога сценариев (.pdf/.docx)")
+    ap.add_argument("root", help="каталог со сценариями (обходится рекурсивно)")
+    ap.add_argument("--out", default="results.jsonl", help="JSONL с результатами; дописывается")
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    ap.add_argument("--rule-stats", type=int, default=0, metavar="N",
+                    help="учёт по правилам; вывести N самых дорогих (замедляет детекцию)")
+    args = ap.parse_args(argv)
+
+    rule_stats = RuleStats() if args.rule_stats else None
+    stats = run(args.root, args.out, max(1, args.workers), rule_stats)
+    secs = max(stats["seconds"], 1e-9)
+    print(f"готово: {stats['done']}, ошибок: {stats['failed']}, пропущено (уже оценены): {stats['skipped']}")
+    print(f"время: {stats['seconds']:.1f} с; страниц: {stats['pages']} ({stats['pages'] / secs:.1f} стр/с); "
+          f"сцен: {stats['scenes']} ({stats['scenes'] / secs:.1f} сцен/с); "
+          f"документов/с: {stats['done'] / secs:.2f}")
+    if rule_stats is not None:
+        print(f"{'правило':60s} {'мс':>10s} {'совп.':>8s} {'таймауты':>9s}")
+        for key, seconds, matches, timeouts in rule_stats.top(args.rule_stats):
+            print(f"{key[:60]:60s} {seconds * 1000:10.1f} {matches:8d} {timeouts:9d}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,239 @@
+"""Проверка config/rules.yaml перед выкладкой.
+
+Статически: паттерн не компилируется, совпадает с пустой строкой, содержит конструкции
+с катастрофическим бэктрекингом (такие правила в проде исполняются с таймаутом и
+пропускаются, если не уложились), не попадает в быстрый объединённый матчер, дубли.
+Динамически: каждый паттерн (и booster/anti_fp) прогоняется тем же движком, что в
+детекторе, по эталонному корпусу и по «враждебным» строкам из его же символов —
+в отдельном процессе с жёстким лимитом, так что зависший паттерн не вешает проверку.
+
+Запуск из корня репозитория:
+    python -m app.lint_rules [--rules config/rules.yaml] [--corpus DIR] [--strict]
+
+Без --corpus корпус генерируется bench/screenplay.py; в образе (только app и config)
+bench нет — там --corpus обязателен. Код выхода 1 — есть ошибки (с --strict — и
+предупреждения), 2 — ошибка аргументов.
+"""
+import argparse
+import importlib.util
+import multiprocessing
+import os
+import re
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+from app.services.rules import FLAGS, BACKREF_RE, compile_pattern, is_combinable
+from app.utils.io import read_yaml
+from app.utils.literals import pattern_risks, sre_parse
+from app.utils.text import normalize_text, deobfuscate_obscene, latin_to_cyr
+from app.settings import settings
+
+ADVERSARIAL_LEN = 5000
+
+class Finding(NamedTuple):
+    level: str  # error / warning
+    key: str
+    message: str
+
+class PatternRef(NamedTuple):
+    key: str
+    kind: str  # pattern — finditer, как правила; check — search, как boosters/anti_fp
+    pattern: str
+
+def iter_patterns(rules: Dict[str, Any]) -> Iterator[PatternRef]:
+    for cat, cfg in (rules.get("categories") or {}).items():
+        cfg = cfg or {}
+        for level, pats in (cfg.get("patterns") or {}).items():
+            for p in pats or []:
+                yield PatternRef(f"{cat}:{level}:{p}", "pattern", p)
+        for level, pats in (cfg.get("boosters") or {}).items():
+            for p in pats or []:
+                yield PatternRef(f"{cat}:booster:{level}:{p}", "check", p)
+        for p in cfg.get("anti_fp") or []:
+            yield PatternRef(f"{cat}:anti_fp:{p}", "check", p)
+
+def static_checks(refs: List[PatternRef]) -> List[Finding]:
+    out: List[Finding] = []
+    dup = Counter(r.key for r in refs)
+    for ref in refs:
+        try:
+            compiled, guarded = compile_pattern(ref.pattern)
+        except Exception as ex:  # re.error / regex.error
+            out.append(Finding("error", ref.key, f"не компилируется: {ex}"))
+            continue
+        empty = compiled.search("") is not None
+        if empty:
+            out.append(Finding("error", ref.key, "совпадает с пустой строкой — эпизод на каждой позиции"))
+        risks = pattern_risks(ref.pattern, FLAGS)
+        if risks:
+            out.append(Finding("warning", ref.key,
+                               f"риск бэктрекинга ({', '.join(risks)}); в детекторе — с таймаутом "
+                               f"{settings.detect_rule_timeout_ms} мс на сцену"))
+        if ref.kind == "pattern" and not (guarded or empty) and not is_combinable(ref.pattern, compiled):
+            why = "обратная ссылка" if BACKREF_RE.search(ref.pattern) else "заглавные буквы/спецсимволы регистра"
+            out.append(Finding("warning", ref.key, f"не попадает в объединённый матчер ({why}) — сканируется отдельно"))
+        if dup[ref.key] > 1:
+            out.append(Finding("warning", ref.key, f"повторяется {dup[ref.key]} раз"))
+            dup[ref.key] = 1
+    return out
+
+def adversarial(pattern: str) -> List[str]:
+    # Длинные повторы символов самого паттерна без завершающего совпадения — типичный
+    # вход, на котором вложенные квантификаторы уходят в экспоненту
+    try:
+        parsed = sre_parse.parse(pattern, FLAGS)
+    except re.error:
+        return []
+    chars: List[str] = []
+
+    def walk(node):
+        if isinstance(node, (sre_parse.SubPattern, list)):
+            for item in node:
+                walk(item)
+        elif isinstance(node, tuple):
+            if len(node) == 2 and node[0] is sre_parse.LITERAL:
+                chars.append(chr(node[1]))
+            else:
+                for x in node:
+                    walk(x)
+
+    walk(parsed)
+    uniq = list(dict.fromkeys(chars)) or ["а"]
+    out = [c * ADVERSARIAL_LEN + "!" for c in uniq[:4]]
+    out.append(("".join(uniq) * (ADVERSARIAL_LEN // len(uniq)))[:ADVERSARIAL_LEN] + "!")
+    out.append(" " * ADVERSARIAL_LEN + "!")
+    return out
+
+def load_corpus(path: Optional[str], pages: int) -> List[str]:
+    # -> нормализованные тексты (как их видит детектор): сцены/куски ~4 КБ
+    raw: List[str] = []
+    if path:
+        from app.services import parser
+        for dirpath, _, names in os.walk(path):
+            for name in sorted(names):
+                full = os.path.join(dirpath, name)
+                ext = os.path.splitext(name)[1].lower()
+                if ext in (".pdf", ".docx"):
+                    raw.append(parser.load_document(full)["text"])
+                elif ext == ".txt":
+                    with open(full, "r", encoding="utf-8", errors="replace") as f:
+                        raw.append(f.read())
+    else:
+        from bench.screenplay import generate
+        raw = ["\n".join("\n".join(lines) for lines in generate(pages, seed=3))]
+    texts: List[str] = []
+    for text in raw:
+        for i in range(0, len(text), 4096):
+            norm = normalize_text(text[i:i + 4096])
+            texts += [norm, deobfuscate_obscene(latin_to_cyr(norm))]
+    return texts
+
+_CORPUS: List[str] = []
+
+def _init_worker(corpus: List[str]):
+    global _CORPUS
+    _CORPUS = corpus
+    settings.detect_rule_timeout_ms = 0  # здесь меряем без таймаутов — их заменяет лимит процесса
+
+def _bench(ref: PatternRef) -> Tuple[float, int, float]:
+    # -> (секунды на корпус, совпадения, секунды на худшей враждебной строке)
+    compiled, _ = compile_pattern(ref.pattern)
+    matches = 0
+    t0 = time.perf_counter()
+    for text in _CORPUS:
+        if ref.kind == "pattern":
+            matches += sum(1 for _ in compiled.finditer(text))
+        elif compiled.search(text):
+            matches += 1
+    corpus_time = time.perf_counter() - t0
+    worst = 0.0
+    for text in adversarial(ref.pattern):
+        t0 = time.perf_counter()
+        for _ in compiled.finditer(text):
+            pass
+        worst = max(worst, time.perf_counter() - t0)
+    return corpus_time, matches, worst
+
+def _new_pool(corpus: List[str]) -> ProcessPoolExecutor:
+    return ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn"),
+                               initializer=_init_worker, initargs=(corpus,))
+
+def _kill(pool: ProcessPoolExecutor):
+    for proc in list((pool._processes or {}).values()):
+        proc.terminate()
+    pool.shutdown(wait=False, cancel_futures=True)
+
+def dynamic_checks(refs: List[PatternRef], corpus: List[str], hang_sec: float,
+                   max_ms_per_mb: float, max_adversarial_ms: float) -> Tuple[List[Finding], List[tuple]]:
+    findings: List[Finding] = []
+    rows: List[tuple] = []
+    mb = max(sum(len(t) for t in corpus) / 1_000_000, 1e-9)
+    pool = _new_pool(corpus)
+    try:
+        for ref in refs:
+            try:
+                compile_pattern(ref.pattern)
+            except Exception:
+                continue  # уже в статических ошибках
+            try:
+                corpus_time, matches, worst = pool.submit(_bench, ref).result(timeout=hang_sec)
+            except FutureTimeout:
+                findings.append(Finding("error", ref.key, f"зависает: нет результата за {hang_sec:.0f} с "
+                                                          f"(корпус или враждебная строка)"))
+                rows.append((ref.key, None, None, None))
+                _kill(pool)
+                pool = _new_pool(corpus)
+                continue
+            ms_per_mb = corpus_time * 1000 / mb
+            rows.append((ref.key, ms_per_mb, matches, worst * 1000))
+            if ms_per_mb > max_ms_per_mb:
+                findings.append(Finding("warning", ref.key, f"медленный: {ms_per_mb:.0f} мс/МБ корпуса"))
+            if worst * 1000 > max_adversarial_ms:
+                findings.append(Finding("error" if worst * 1000 > settings.detect_rule_timeout_ms else "warning",
+                                        ref.key, f"враждебный ввод {ADVERSARIAL_LEN} симв.: {worst * 1000:.0f} мс"))
+    finally:
+        _kill(pool)
+    return findings, rows
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Линтер и бенчмарк правил детекции")
+    ap.add_argument("--rules", default="config/rules.yaml")
+    ap.add_argument("--corpus", help="каталог .pdf/.docx/.txt; по умолчанию — синтетический сценарий (нужен bench)")
+    ap.add_argument("--pages", type=int, default=120, help="размер синтетического корпуса, страниц")
+    ap.add_argument("--hang-sec", type=float, default=5.0, help="паттерн, не закончивший за столько, — ошибка")
+    ap.add_argument("--max-ms-per-mb", type=float, default=200.0)
+    ap.add_argument("--max-adversarial-ms", type=float, default=50.0)
+    ap.add_argument("--top", type=int, default=15, help="сколько самых дорогих паттернов показать")
+    ap.add_argument("--strict", action="store_true", help="предупреждения тоже дают код выхода 1")
+    args = ap.parse_args(argv)
+
+    if not args.corpus and importlib.util.find_spec("bench") is None:
+        ap.error("пакета bench нет (например, в образе) — укажите эталонный корпус: --corpus DIR")
+    refs = list(iter_patterns(read_yaml(args.rules)))
+    corpus = load_corpus(args.corpus, args.pages)
+    findings = static_checks(refs)
+    dyn, rows = dynamic_checks(refs, corpus, args.hang_sec, args.max_ms_per_mb, args.max_adversarial_ms)
+    findings += dyn
+
+    print(f"паттернов: {len(refs)}, корпус: {sum(len(t) for t in corpus) / 1000:.0f} тыс. символов")
+    # зависшие паттерны — первыми: они хуже любого измеренного
+    rows.sort(key=lambda r: float("inf") if r[1] is None else r[1], reverse=True)
+    print(f"{'паттерн':60s} {'мс/МБ':>9s} {'совп.':>7s} {'враж., мс':>10s}")
+    for key, ms_per_mb, matches, worst in rows[:args.top]:
+        if ms_per_mb is None:
+            print(f"{key[:60]:60s} {'завис':>9s}")
+        else:
+            print(f"{key[:60]:60s} {ms_per_mb:9.1f} {matches:7d} {worst:10.2f}")
+    for f in sorted(findings, key=lambda f: (f.level != "error", f.key)):
+        print(f"{f.level.upper():8s} {f.key}: {f.message}")
+    errors = sum(1 for f in findings if f.level == "error")
+    warnings = len(findings) - errors
+    print(f"ошибок: {errors}, предупреждений: {warnings}")
+    if errors or (args.strict and warnings):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
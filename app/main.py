@@ -1,11 +1,70 @@
-from fastapi import FastAPI, Request
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, JSONResponse, PlainTextResponse
 from fastapi.templating import Jinja2Templates
+from starlette.middleware.gzip import GZipMiddleware
 
 from app.api.routes import router as api_router
+from app.services import detector, jobs, pipeline
+from app.utils import metrics
+from app.settings import settings
+
+class JSONGZip:
+    # gzip только для JSON API чтения: GZipMiddleware буферизует поток, а SSE прогресса и
+    # NDJSON пакета должны уходить сразу; отчёты отдаются готовыми файлами
+    PREFIXES = ("/api/analyses", "/api/search", "/api/diff")
+
+    def __init__(self, app, minimum_size: int, compresslevel: int):
+        self.app = app
+        self.gzip = GZipMiddleware(app, minimum_size=minimum_size, compresslevel=compresslevel)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"].startswith(self.PREFIXES):
+            await self.gzip(scope, receive, send)
+        else:
+            await self.app(scope, receive, send)
+
+class BodyLimit:
+    # Лимит тела загрузок ниже разбора формы: Starlette читает и спулит весь multipart до вызова
+    # обработчика, поэтому Content-Length и байты receive() считаются здесь. HTTPException из
+    # receive FastAPI пробрасывает как есть, и обработчик исключений отвечает 413.
+    MULTIPART_OVERHEAD = 64 * 1024
+
+    def __init__(self, app, limits):
+        self.app = app
+        self.limits = limits  # путь -> (байт тела, текст ошибки)
+
+    async def __call__(self, scope, receive, send):
+        limit = self.limits.get(scope["path"]) if scope["type"] == "http" else None
+        if limit is None:
+            await self.app(scope, receive, send)
+            return
+        max_bytes, detail = limit
+        max_bytes += self.MULTIPART_OVERHEAD
+        if int(dict(scope["headers"]).get(b"content-length") or 0) > max_bytes:
+            await JSONResponse({"detail": detail}, 413)(scope, receive, send)
+            return
+        received = 0
+
+        async def limited():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > max_bytes:
+                    raise HTTPException(413, detail)
+            return message
+
+        await self.app(scope, limited, send)
 
 app = FastAPI(title="RU Age Rating Analyzer", version="1.0.0")
+app.add_middleware(JSONGZip, minimum_size=settings.gzip_min_bytes, compresslevel=settings.gzip_level)
+_UPLOAD_MAX = settings.upload_max_mb * 1024 * 1024
+app.add_middleware(BodyLimit, limits={
+    "/api/upload": (_UPLOAD_MAX, f"Файл больше {settings.upload_max_mb} МБ"),
+    "/api/batch": (_UPLOAD_MAX * settings.batch_max_files,
+                   f"Пакет больше {settings.upload_max_mb * settings.batch_max_files} МБ"),
+})
 
 app.mount("/static", StaticFiles(directory="app/static"), name="static")
 templates = Jinja2Templates(directory="app/templates")
@@ -14,4 +73,18 @@ templates = Jinja2Templates(directory="app/templates")
 def index(request: Request):
     return templates.TemplateResponse("index.html", {"request": request})
 
+@app.get("/metrics", response_class=PlainTextResponse)
+def prometheus_metrics():
+    return PlainTextResponse(metrics.REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+@app.on_event("startup")
+async def startup():
+    pipeline.migrate()  # перенос JSON-анализов и старых загрузок в хранилище
+    await jobs.MANAGER.start()
+
+@app.on_event("shutdown")
+async def shutdown():
+    await jobs.MANAGER.stop()
+    detector.shutdown_pool()
+
 app.include_router(api_router, prefix="/api")
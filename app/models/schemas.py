@@ -44,6 +44,8 @@ class AnalysisResult(BaseModel):
     scenes: List[Scene]
     episodes: List[Episode]
     summary: Optional[Summary] = None
+    revision: int = 0  # номер правки в хранилище (оптимистичная блокировка)
+    timings: Dict[str, Any] = Field(default_factory=dict)  # последние замеры по операциям (utils.metrics)
 
 class ManualEpisode(BaseModel):
     file_id: str
@@ -54,10 +56,12 @@ class ManualEpisode(BaseModel):
     reason: str
     start: int = 0
     end: int = 0
+    revision: Optional[int] = None  # ожидаемая ревизия анализа
 
 class PatchRequest(BaseModel):
     file_id: str
     edits: List[Dict[str, Any]]  # [{"scene_id": "S1", "new_text": "..."}]
+    revision: Optional[int] = None  # ожидаемая ревизия анализа
 
 # orjson helpers
 def orjson_dumps(v, *, default):
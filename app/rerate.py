@@ -0,0 +1,224 @@
+"""Переоценка сохранённых анализов после правки config/rules.yaml или config/age_mapping.yaml.
+
+Запуск из корня репозитория:
+    python -m app.rerate [--report rerate.json] [--workers N] [--dry-run]
+
+Каждый анализ хранит версии правил, с которыми получен (rules_state: отпечаток каждой
+категории и соответствия возрастам). Сравнение с текущими даёт, что переоценивать:
+категории с изменившимися правилами детектируются заново по сохранённым текстам сцен
+(документы не разбираются) в пуле процессов, по анализу на задачу; находки удалённых
+категорий убираются; если изменилось только соответствие возрастам — пересчитываются
+одни итоги. Отметки FP переносятся на находки того же правила в том же месте сцены (в том
+числе с анализов движка до v3, где rule_id оканчивался представлением :norm/:deobf);
+отметки, которым не нашлось находки, считаются в отчёте (fp_dropped). Ручные эпизоды
+остаются. Анализ, изменённый во время переоценки, пропускается (conflict) — повторный
+запуск его доберёт. Отчёт — JSON со списком сценариев, у которых сменился рейтинг.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from typing import Any, Dict, List, NamedTuple, Optional, Set, Tuple
+
+from app.models.schemas import Episode
+from app.services import detector, aggregate, pipeline
+from app.services.episodes import EpisodeTable, FP
+from app.services.rules import CompiledRules, compile_pattern, subset_rules
+from app.services.store import Edit, Store, RevisionConflict, NotFound
+from app.settings import settings
+from app.utils.text import NormalizedText
+
+class Plan(NamedTuple):
+    replace: Optional[Set[str]]  # категории, чьи находки заменяются; None — все
+    detect: List[str]  # категории для повторной детекции
+    reason: str  # rules — изменились правила, age_map — только соответствие возрастам, legacy — версий нет
+
+def plan(state: Optional[Dict[str, Any]], current: Dict[str, Any]) -> Optional[Plan]:
+    # None — анализ получен с текущими правилами
+    cats = current["categories"]
+    if not state or "categories" not in state:
+        return Plan(None, sorted(cats), "legacy")
+    old = state["categories"]
+    changed = {c for c, fp in cats.items() if old.get(c) != fp}
+    replace = changed | (set(old) - set(cats))
+    if replace:
+        return Plan(replace, sorted(changed), "rules")
+    if state.get("age_map") != current["age_map"]:
+        return Plan(set(), [], "age_map")
+    return None
+
+# --- воркеры ---------------------------------------------------------------
+
+_SUBSETS: Dict[Tuple[str, ...], CompiledRules] = {}
+
+def _init_worker():
+    # анализ целиком детектируется в одном процессе — вложенные пулы не нужны
+    settings.detect_mode = "inline"
+
+def detect_scenes(categories: Tuple[str, ...], scenes: List[Tuple[str, str]]) -> Tuple[Dict[str, List[Any]], int]:
+    # -> (находки по сценам, число срывов guarded-правил по таймауту)
+    rules = _SUBSETS.get(categories)
+    if rules is None:
+        rules = _SUBSETS[categories] = subset_rules(detector.COMPILED_RULES, categories)
+    hits: Dict[str, List[Any]] = {}
+    skipped = 0
+    for scene_id, text in scenes:
+        timeouts: List[str] = []
+        hits[scene_id] = detector.detect_text(text, rules, timeouts)
+        skipped += len(timeouts)
+    return hits, skipped
+
+# --- запись ----------------------------------------------------------------
+
+VIEWS = ("norm", "deobf")
+
+def fp_mark(tx: Edit, e: Episode, views: Dict[str, NormalizedText]) -> Tuple[str, int, int]:
+    # -> (rule_id, start, end) отметки FP в формате движка v3. Раньше rule_id оканчивался
+    # представлением (:norm/:deobf), а до v2 и смещения были в нём, а не в тексте сцены:
+    # такие узнаём по тому, что паттерн правила совпадает в представлении ровно на этом отрезке
+    for tag in VIEWS:
+        if not e.rule_id.endswith(f":{tag}"):
+            continue
+        rule_id, start, end = e.rule_id[:-len(tag) - 1], e.start, e.end
+        text = tx.scene_text(e.scene_id)
+        if text is None or rule_id.count(":") < 2:
+            return rule_id, start, end
+        view = views.get(e.scene_id)
+        if view is None:
+            view = views[e.scene_id] = NormalizedText(text)
+        hay = getattr(view, tag)
+        try:
+            m = compile_pattern(rule_id.split(":", 2)[2])[0].match(hay, start) if end <= len(hay) else None
+        except Exception:  # паттерн уже не компилируется — смещения оставляем как есть
+            m = None
+        if m is not None and m.end() == end:
+            start, end = view.original_span(tag, start, end)
+        return rule_id, start, end
+    return e.rule_id, e.start, e.end
+
+def apply(store: Store, file_id: str, revision: int, p: Plan, hits: Optional[Dict[str, List[Any]]],
+          current: Dict[str, Any]) -> Tuple[str, int]:
+    # -> (новый возрастной рейтинг, число отметок FP без находки);
+    # RevisionConflict — анализ правили, пока шла детекция
+    dropped = 0
+    with store.edit(file_id, expected_revision=revision) as tx:
+        if p.replace is None or p.replace:
+            # (сцена, правило) -> [отрезок, перенесена ли]; находки norm и deobf теперь
+            # склеены, поэтому отметка переносится на находку, пересекающую её отрезок
+            views: Dict[str, NormalizedText] = {}
+            marks: Dict[Tuple[str, str], List[List[Any]]] = {}
+            for e in tx.episodes():
+                if e.is_fp and not e.is_manual and (p.replace is None or e.category in p.replace):
+                    rule_id, start, end = fp_mark(tx, e, views)
+                    marks.setdefault((e.scene_id, rule_id), []).append([start, end, False])
+            table = EpisodeTable.from_hits(hits or {})
+            for i, row in enumerate(table.rows()):
+                for m in marks.get((row[1], row[4]), ()):
+                    if (m[0] < row[6] and row[5] < m[1]) or (m[0], m[1]) == (row[5], row[6]):
+                        table.flags[i] |= FP
+                        m[2] = True
+            dropped = sum(1 for ms in marks.values() for m in ms if not m[2])
+            tx.replace_detected(p.replace, table)
+        state = aggregate.SummaryState.from_episodes(tx.episodes(), tx.scene_count())
+        summary = state.summary()
+        tx.set_summary(summary, state.to_dict())
+        tx.set_rules_state(current)
+    return summary.age_rating, dropped
+
+def run(store: Store, workers: int, dry_run: bool = False) -> Dict[str, Any]:
+    current = pipeline.rules_state()
+    stats = {"analyses": 0, "up_to_date": 0, "rules": 0, "age_map": 0, "legacy": 0,
+             "conflicts": 0, "failed": 0, "rule_timeouts": 0, "fp_dropped": 0}
+    records: List[Dict[str, Any]] = []
+    ctx = multiprocessing.get_context(settings.detect_start_method)
+    started = time.perf_counter()
+
+    def finish(head: Dict[str, Any], p: Plan, hits: Optional[Dict[str, List[Any]]], revision: int):
+        rec = {"file_id": head["file_id"], "filename": head["filename"], "reason": p.reason,
+               "categories": sorted(p.replace) if p.replace is not None else None,
+               "before": head["age_rating"], "after": head["age_rating"], "status": "done"}
+        try:
+            rec["after"], rec["fp_dropped"] = apply(store, head["file_id"], revision, p, hits, current)
+            stats["fp_dropped"] += rec["fp_dropped"]
+            if rec["fp_dropped"]:
+                print(f"[fp dropped: {rec['fp_dropped']}] {rec['file_id']} {rec['filename']}", file=sys.stderr)
+        except RevisionConflict:
+            rec["status"] = "conflict"
+            stats["conflicts"] += 1
+        except NotFound:
+            rec["status"] = "removed"
+        records.append(rec)
+        if rec["status"] == "done" and rec["after"] != rec["before"]:
+            print(f"[{rec['before']} -> {rec['after']}] {rec['file_id']} {rec['filename']}", file=sys.stderr)
+
+    with ProcessPoolExecutor(max_workers=workers, mp_context=ctx, initializer=_init_worker) as pool:
+        inflight = {}
+
+        def collect(futures):
+            for fut in futures:
+                head, p, revision = inflight.pop(fut)
+                try:
+                    hits, skipped = fut.result()
+                except Exception as ex:
+                    stats["failed"] += 1
+                    records.append({"file_id": head["file_id"], "filename": head["filename"], "reason": p.reason,
+                                    "status": "error", "error": f"{type(ex).__name__}: {ex}"})
+                    continue
+                stats["rule_timeouts"] += skipped
+                finish(head, p, hits, revision)
+
+        for head in store.rating_heads():
+            stats["analyses"] += 1
+            p = plan(head["rules_state"], current)
+            if p is None:
+                stats["up_to_date"] += 1
+                continue
+            stats[p.reason] += 1
+            if dry_run:
+                records.append({"file_id": head["file_id"], "filename": head["filename"], "reason": p.reason,
+                                "categories": sorted(p.replace) if p.replace is not None else None,
+                                "status": "planned"})
+                continue
+            if not p.detect:
+                # только итоги (или только удаление находок) — без пула
+                finish(head, p, None, head["revision"])
+                continue
+            revision, scenes = store.scene_texts(head["file_id"])
+            if revision is None:
+                continue
+            # в работе не больше 2×workers анализов — тексты сцен держим только для них
+            if len(inflight) >= 2 * workers:
+                finished, _ = wait(inflight, return_when=FIRST_COMPLETED)
+                collect(finished)
+            inflight[pool.submit(detect_scenes, tuple(p.detect), scenes)] = (head, p, revision)
+        collect(wait(inflight).done)
+
+    stats["seconds"] = round(time.perf_counter() - started, 3)
+    stats["rating_changed"] = sum(1 for r in records if r["status"] == "done" and r["after"] != r["before"])
+    return {"stats": stats, "rules_state": current,
+            "changed": [r for r in records if r["status"] == "done" and r["after"] != r["before"]],
+            "records": records}
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Переоценка сохранённых анализов после правки правил")
+    ap.add_argument("--report", default="rerate.json", help="JSON-отчёт о переоценке")
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    ap.add_argument("--dry-run", action="store_true", help="только показать, что будет переоценено")
+    args = ap.parse_args(argv)
+
+    report = run(pipeline.STORE, max(1, args.workers), args.dry_run)
+    with open(args.report, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    stats = report["stats"]
+    print(f"анализов: {stats['analyses']}, актуальны: {stats['up_to_date']}; переоценено по правилам: "
+          f"{stats['rules']}, по возрастам: {stats['age_map']}, без версий: {stats['legacy']}"
+          + (" (dry run)" if args.dry_run else ""))
+    print(f"рейтинг изменился: {stats['rating_changed']}, конфликтов: {stats['conflicts']}, "
+          f"ошибок: {stats['failed']}, отметок FP без находки: {stats['fp_dropped']}; "
+          f"время: {stats['seconds']:.1f} с; отчёт: {args.report}")
+
+if __name__ == "__main__":
+    main()
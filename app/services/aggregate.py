@@ -1,29 +1,56 @@
 import os
+import json
 import uuid
-from typing import Dict, List, Any
-import yaml
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Dict, List, Any, Iterable, Optional
 from app.models.schemas import AnalysisResult, Scene, Episode, Summary, SummaryCategory, ManualEpisode, PatchRequest
-from app.utils.checksum import file_checksum
-from app.utils.io import read_yaml
-
-AGE_MAP = read_yaml("config/age_mapping.yaml")
-SEV_ORDER = ["None", "Mild", "Moderate", "Severe"]
-
-def build_analysis(file_id: str, filename_path: str, scenes: List[Scene], episodes_by_scene: Dict[str, List[Episode]]) -> AnalysisResult:
-    checksum = file_checksum(filename_path)
-    episodes: List[Episode] = []
-    for sid, eps in episodes_by_scene.items():
-        episodes.extend(eps)
-    return AnalysisResult(
+from app.services.episodes import EpisodeTable, SEVERITIES
+from app.utils.checksum import file_checksum, text_checksum
+from app.services import snapshot
+
+AGE_MAP = snapshot.load().age_map
+# версия соответствия возрастам — по ней переоценка (app.rerate) узнаёт, что итоги устарели
+AGE_MAP_FINGERPRINT = text_checksum(json.dumps(AGE_MAP, sort_keys=True, ensure_ascii=False))[:16]
+SEV_ORDER = SEVERITIES
+SEV_RANK = {s: i for i, s in enumerate(SEV_ORDER)}
+
+@dataclass
+class Analysis:
+    # Результат анализа внутри сервиса: эпизоды — столбцами (EpisodeTable).
+    # AnalysisResult с pydantic-эпизодами собирается только для ответа API (to_result).
+    file_id: str
+    filename: str
+    checksum: str
+    scenes: List[Scene]
+    episodes: EpisodeTable
+    summary: Optional[Summary] = None
+    revision: int = 0
+    timings: Dict[str, Any] = field(default_factory=dict)
+    # версии правил по категориям и соответствия возрастам, с которыми получен результат
+    rules_state: Dict[str, Any] = field(default_factory=dict)
+
+    def to_result(self) -> AnalysisResult:
+        return AnalysisResult(file_id=self.file_id, filename=self.filename, checksum=self.checksum,
+                              scenes=self.scenes, episodes=self.episodes.to_episodes(), summary=self.summary,
+                              revision=self.revision, timings=self.timings)
+
+    @classmethod
+    def from_result(cls, r: AnalysisResult) -> "Analysis":
+        return cls(r.file_id, r.filename, r.checksum, r.scenes, EpisodeTable.from_episodes(r.episodes),
+                   r.summary, r.revision, r.timings)
+
+def build_analysis(file_id: str, filename_path: str, scenes: List[Scene], hits_by_scene: Dict[str, List[Any]]) -> Analysis:
+    # hits_by_scene — detector.Hit по сценам
+    return Analysis(
         file_id=file_id,
         filename=os.path.basename(filename_path),
-        checksum=checksum,
+        checksum=file_checksum(filename_path),
         scenes=scenes,
-        episodes=episodes,
-        summary=None
+        episodes=EpisodeTable.from_hits(hits_by_scene),
     )
 
-def apply_manual_adjustments(analysis: AnalysisResult):
+def apply_manual_adjustments(analysis: Analysis):
     # помеченные is_fp — исключаем из расчёта; manual episodes — включаются
     pass  # episodes уже содержат is_fp/is_manual; фильтруем при подсчёте
 
@@ -32,18 +59,137 @@ def severity_for_category(episodes: List[Episode], category: str) -> str:
     for e in episodes:
         if e.category != category or e.is_fp:
             continue
-        if SEV_ORDER.index(e.severity) > SEV_ORDER.index(sev):
+        if SEV_RANK[e.severity] > SEV_RANK[sev]:
             sev = e.severity
     return sev
 
-def compute_summary_and_rating(analysis: AnalysisResult):
-    cats = sorted(set(e.category for e in analysis.episodes))
+class CategoryCounters:
+    # total — все эпизоды категории (и FP: категория остаётся в сводке с нулями),
+    # остальное — только учитываемые: число эпизодов, попадания по сценам, гистограмма строгости
+    __slots__ = ("total", "episodes", "scenes", "severities")
+
+    def __init__(self):
+        self.total = 0
+        self.episodes = 0
+        self.scenes: Counter = Counter()
+        self.severities = [0] * len(SEV_ORDER)
+
+    def severity(self) -> str:
+        for i in range(len(SEV_ORDER) - 1, 0, -1):
+            if self.severities[i]:
+                return SEV_ORDER[i]
+        return "None"
+
+class SummaryState:
+    # Сводка на счётчиках: добавление/удаление/FP эпизода — O(1), summary() — O(категорий).
+    # compute_summary — полный пересчёт по эпизодам, остаётся для сверки.
+
+    def __init__(self, total_scenes: int = 0):
+        self.total_scenes = total_scenes
+        self.categories: Dict[str, CategoryCounters] = {}
+
+    @classmethod
+    def from_episodes(cls, episodes: Iterable[Episode], total_scenes: int) -> "SummaryState":
+        state = cls(total_scenes)
+        for e in episodes:
+            state.add(e)
+        return state
+
+    @classmethod
+    def from_table(cls, table: EpisodeTable, total_scenes: int) -> "SummaryState":
+        state = cls(total_scenes)
+        state.add_table(table)
+        return state
+
+    def add(self, e: Episode, sign: int = 1):
+        self._count(e.category, e.scene_id, SEV_RANK[e.severity], e.is_fp, sign)
+
+    def remove(self, e: Episode):
+        self.add(e, -1)
+
+    def add_table(self, table: EpisodeTable, sign: int = 1):
+        for category, scene_id, rank, is_fp in table.counted():
+            self._count(category, scene_id, rank, is_fp, sign)
+
+    def _count(self, category: str, scene_id: str, rank: int, is_fp: bool, sign: int):
+        c = self.categories.get(category)
+        if c is None:
+            c = self.categories[category] = CategoryCounters()
+        c.total += sign
+        if not is_fp:
+            c.episodes += sign
+            c.severities[rank] += sign
+            c.scenes[scene_id] += sign
+            if c.scenes[scene_id] <= 0:
+                del c.scenes[scene_id]
+        if c.total <= 0:
+            del self.categories[category]
+
+    def set_fp(self, e: Episode, is_fp: bool = True):
+        # e — эпизод в текущем (учтённом) состоянии; флаг меняется на месте
+        if e.is_fp == is_fp:
+            return
+        self.remove(e)
+        e.is_fp = is_fp
+        self.add(e)
+
+    def summary(self) -> Summary:
+        per_cat: List[SummaryCategory] = []
+        max_sev = "None"
+        max_cat = None
+        for name in sorted(self.categories):
+            c = self.categories[name]
+            sev = c.severity()
+            per_cat.append(SummaryCategory(
+                category=name,
+                count_episodes=c.episodes,
+                percent_scenes=round((len(c.scenes) / max(1, self.total_scenes)) * 100, 2),
+                overall_severity=sev
+            ))
+            if SEV_RANK[sev] > SEV_RANK[max_sev]:
+                max_sev = sev
+                max_cat = name
+        return Summary(
+            total_scenes=self.total_scenes,
+            categories=per_cat,
+            max_severity=max_sev,
+            age_rating=map_age_rating(max_cat, max_sev)
+        )
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "total_scenes": self.total_scenes,
+            "categories": {
+                name: {"total": c.total, "episodes": c.episodes,
+                       "scenes": dict(c.scenes), "severities": c.severities}
+                for name, c in self.categories.items()
+            },
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "SummaryState":
+        state = cls(data["total_scenes"])
+        for name, d in data["categories"].items():
+            c = state.categories[name] = CategoryCounters()
+            c.total = d["total"]
+            c.episodes = d["episodes"]
+            c.scenes = Counter(d["scenes"])
+            c.severities = list(d["severities"])
+        return state
+
+def compute_summary_and_rating(analysis: Analysis) -> SummaryState:
+    state = SummaryState.from_table(analysis.episodes, len(analysis.scenes))
+    analysis.summary = state.summary()
+    return state
+
+def compute_summary(episodes: List[Episode], total_scenes: int) -> Summary:
+    # Полный пересчёт: сверка инкрементальной сводки (settings.summary_verify)
+    cats = sorted(set(e.category for e in episodes))
     per_cat: List[SummaryCategory] = []
-    total_scenes = len(analysis.scenes)
     for c in cats:
-        eps = [e for e in analysis.episodes if e.category == c and not e.is_fp]
+        eps = [e for e in episodes if e.category == c and not e.is_fp]
         scenes_hit = len(set(e.scene_id for e in eps))
-        sev = severity_for_category(analysis.episodes, c)
+        sev = severity_for_category(episodes, c)
         per_cat.append(SummaryCategory(
             category=c,
             count_episodes=len(eps),
@@ -54,23 +200,59 @@ def compute_summary_and_rating(analysis: AnalysisResult):
     max_sev = "None"
     max_cat = None
     for sc in per_cat:
-        if SEV_ORDER.index(sc.overall_severity) > SEV_ORDER.index(max_sev):
+        if SEV_RANK[sc.overall_severity] > SEV_RANK[max_sev]:
             max_sev = sc.overall_severity
             max_cat = sc.category
     age = map_age_rating(max_cat, max_sev)
-    analysis.summary = Summary(
+    return Summary(
         total_scenes=total_scenes,
         categories=per_cat,
         max_severity=max_sev,
         age_rating=age
     )
 
+def verify_summary(state: SummaryState, episodes: List[Episode]) -> bool:
+    return state.summary() == compute_summary(episodes, state.total_scenes)
+
 def map_age_rating(category: str, severity: str) -> str:
     if not category:
         return AGE_MAP["default"].get("None", "0+")
     ovr = AGE_MAP.get("overrides", {}).get(category, {})
     return ovr.get(severity, AGE_MAP["default"].get(severity, "0+"))
 
+def age_rank(age: str) -> int:
+    # "16+" -> 16
+    try:
+        return int(age.rstrip("+"))
+    except ValueError:
+        return 0
+
+def series_summary(summaries: List[Summary]) -> Dict[str, Any]:
+    # Рейтинг сериала/сезона: по каждой категории — сумма эпизодов и максимальная строгость
+    # по сериям; итоговый возрастной рейтинг — самый строгий из рейтингов серий
+    per_cat: Dict[str, Dict[str, Any]] = {}
+    age = map_age_rating(None, "None")
+    max_sev = "None"
+    for summ in summaries:
+        if age_rank(summ.age_rating) > age_rank(age):
+            age = summ.age_rating
+        if SEV_RANK[summ.max_severity] > SEV_RANK[max_sev]:
+            max_sev = summ.max_severity
+        for c in summ.categories:
+            d = per_cat.setdefault(c.category, {"category": c.category, "count_episodes": 0,
+                                                "documents": 0, "overall_severity": "None"})
+            d["count_episodes"] += c.count_episodes
+            d["documents"] += 1 if c.count_episodes else 0
+            if SEV_RANK[c.overall_severity] > SEV_RANK[d["overall_severity"]]:
+                d["overall_severity"] = c.overall_severity
+    return {
+        "documents": len(summaries),
+        "total_scenes": sum(summ.total_scenes for summ in summaries),
+        "categories": [per_cat[k] for k in sorted(per_cat)],
+        "max_severity": max_sev,
+        "age_rating": age,
+    }
+
 def apply_patch(analysis: AnalysisResult, req: PatchRequest) -> List[str]:
     changed = []
     scindex = {s.id: s for s in analysis.scenes}
@@ -82,31 +264,49 @@ def apply_patch(analysis: AnalysisResult, req: PatchRequest) -> List[str]:
             changed.append(sid)
     return changed
 
-def merge_scene_episodes(analysis: AnalysisResult, updated: Dict[str, List[Episode]]):
+def merge_scene_episodes(analysis: AnalysisResult, updated: Dict[str, List[Episode]],
+                         state: Optional[SummaryState] = None):
     # Удаляем старые эпизоды для изменённых сцен и добавляем новые
-    keep = [e for e in analysis.episodes if e.scene_id not in updated]
+    keep = []
+    for e in analysis.episodes:
+        if e.scene_id not in updated:
+            keep.append(e)
+        elif state is not None:
+            state.remove(e)
     for sid, eps in updated.items():
         keep.extend(eps)
+        if state is not None:
+            for e in eps:
+                state.add(e)
     analysis.episodes = keep
 
-def mark_false_positive(analysis: AnalysisResult, episode_id: str):
+def mark_false_positive(analysis: AnalysisResult, episode_id: str, state: Optional[SummaryState] = None):
     for e in analysis.episodes:
         if e.id == episode_id:
-            e.is_fp = True
-
-def add_manual_episode(analysis: AnalysisResult, req: ManualEpisode):
-    analysis.episodes.append(
-        Episode(
-            id=str(uuid.uuid4())[:8],
-            scene_id=req.scene_id,
-            category=req.category,
-            severity=req.severity,
-            rule_id="manual",
-            start=req.start,
-            end=req.end,
-            quote=req.quote,
-            reason=req.reason,
-            is_manual=True,
-            is_fp=False
-        )
+            if state is not None:
+                state.set_fp(e)
+            else:
+                e.is_fp = True
+
+def manual_episode(req: ManualEpisode) -> Episode:
+    return Episode(
+        id=uuid.uuid4().hex,
+        scene_id=req.scene_id,
+        category=req.category,
+        severity=req.severity,
+        rule_id="manual",
+        start=req.start,
+        end=req.end,
+        quote=req.quote,
+        reason=req.reason,
+        is_manual=True,
+        is_fp=False
     )
+
+def add_manual_episode(analysis: AnalysisResult, req: ManualEpisode,
+                       state: Optional[SummaryState] = None) -> Episode:
+    e = manual_episode(req)
+    analysis.episodes.append(e)
+    if state is not None:
+        state.add(e)
+    return e
@@ -0,0 +1,68 @@
+import json
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterator, List, NamedTuple
+
+from app.services import pipeline, aggregate
+from app.services.pipeline import STORE
+from app.utils import metrics
+from app.settings import settings
+
+# Пакетный анализ (сезон целиком): парсинг следующих документов идёт в отдельном
+# потоке, пока текущий проходит детекцию в общем пуле процессов detector —
+# конвейер parse(i+1) || detect(i). Результаты отдаются NDJSON по мере готовности.
+
+class BatchItem(NamedTuple):
+    filename: str  # исходное имя (в т.ч. путь внутри ZIP)
+    file_id: str
+    upload: str
+    duplicate: bool
+
+def ndjson(obj: Dict[str, Any]) -> str:
+    return json.dumps(obj, ensure_ascii=False) + "\n"
+
+def _document(i: int, item: BatchItem, **extra) -> Dict[str, Any]:
+    return {"type": "document", "index": i, "filename": item.filename, "file_id": item.file_id, **extra}
+
+def run_batch(items: List[BatchItem]) -> Iterator[str]:
+    summaries = []
+    failed = 0
+    prefetch = max(1, settings.batch_prefetch)
+    ex = ThreadPoolExecutor(max_workers=1, thread_name_prefix="batch-parse")
+    try:
+        pending = deque()
+        queue = iter(enumerate(items))
+
+        def feed():
+            # уже проанализированные дубликаты не парсим
+            for i, item in queue:
+                cached = STORE.load_summary(item.file_id) if item.duplicate else None
+                timings = metrics.Timings("analyze")
+                parsed = None if cached else ex.submit(pipeline.parse_upload, item.upload, None, timings)
+                pending.append((i, item, cached, parsed, timings))
+                if len(pending) >= prefetch:
+                    return
+
+        feed()
+        while pending:
+            i, item, summary, parsed, timings = pending.popleft()
+            feed()
+            try:
+                if summary is None:
+                    scenes = parsed.result()
+                    summary = pipeline.analyze_scenes(item.file_id, item.upload, scenes, None, timings).summary
+                    STORE.record_timings(item.file_id, "analyze", timings.to_dict())
+                    cached = False
+                else:
+                    cached = True
+            except Exception as err:  # сбой одного документа не прерывает пакет
+                failed += 1
+                yield ndjson(_document(i, item, status="error", error=f"{type(err).__name__}: {err}"))
+                continue
+            summaries.append(summary)
+            yield ndjson(_document(i, item, status="done", cached=cached,
+                                   age_rating=summary.age_rating, summary=summary.model_dump()))
+    finally:
+        # клиент отключился — недоразобранные документы не ждём
+        ex.shutdown(wait=False, cancel_futures=True)
+    yield ndjson({"type": "series", "failed": failed, **aggregate.series_summary(summaries)})
@@ -1,7 +1,9 @@
 import os
 import json
-from typing import Dict, Any, Optional
-from app.models.schemas import Episode
+import time
+import threading
+from typing import Dict, Any, Optional, List, Iterable, Tuple
+from app.utils.db import connect, init_db
 
 def cache_path(base: str, file_id: str) -> str:
     return os.path.join(base, f"{file_id}.cache.json")
@@ -13,13 +15,109 @@ def load_cache(base: str, file_id: str) -> Optional[Dict[str, Any]]:
     with open(p, "r", encoding="utf-8") as f:
         return json.load(f)
 
-def save_cache(base: str, file_id: str, episodes_by_scene: Dict[str, Any]):
+def save_cache(base: str, file_id: str, hits_by_scene: Dict[str, List[Any]], checksums: Dict[str, str]) -> int:
+    # checksums — detector.checksum_scene по тексту сцены и версии правил; hits — detector.Hit
+    # списками, без id и scene_id (их выдаёт EpisodeTable); -> записано байт
     p = cache_path(base, file_id)
     payload = {}
-    for sid, eps in episodes_by_scene.items():
+    for sid, hits in hits_by_scene.items():
         payload[sid] = {
-            "checksum": str(abs(hash("".join([e.quote for e in eps])))),  # дешёвый checksum по эпизодам
-            "episodes": [e.model_dump() for e in eps]
+            "checksum": checksums[sid],
+            "hits": [list(h) for h in hits]
         }
-    with open(p, "w", encoding="utf-8") as f:
-        json.dump(payload, f, ensure_ascii=False, indent=2)
+    data = json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    with open(p, "wb") as f:
+        f.write(data)
+    return len(data)
+
+class CacheWriter:
+    # save_cache по частям — для потокового анализа: сцены дописываются в JSON-объект
+    # окнами, файл подменяется по close (abort — прежний файл остаётся)
+
+    def __init__(self, base: str, file_id: str):
+        self.path = cache_path(base, file_id)
+        self.tmp = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        self.f = open(self.tmp, "wb")
+        self.f.write(b"{")
+        self.written = 1
+
+    def add(self, hits_by_scene: Dict[str, List[Any]], checksums: Dict[str, str]):
+        parts = []
+        for sid, hits in hits_by_scene.items():
+            entry = {"checksum": checksums[sid], "hits": [list(h) for h in hits]}
+            parts.append(json.dumps(sid, ensure_ascii=False) + ":" +
+                         json.dumps(entry, ensure_ascii=False, separators=(",", ":")))
+        if not parts:
+            return
+        data = (("," if self.written > 1 else "") + ",".join(parts)).encode("utf-8")
+        self.f.write(data)
+        self.written += len(data)
+
+    def close(self) -> int:
+        # -> записано байт
+        self.f.write(b"}")
+        self.f.close()
+        os.replace(self.tmp, self.path)
+        return self.written + 1
+
+    def abort(self):
+        self.f.close()
+        try:
+            os.remove(self.tmp)
+        except OSError:
+            pass
+
+class SceneCache:
+    # Общий для всех файлов кеш результатов детекции по сценам: ключ — стабильный
+    # дайджест текста сцены и версии правил, значение — список Hit без scene_id/id.
+    # Хранится в SQLite, переживает рестарты и общий для воркеров uvicorn; вытеснение LRU.
+
+    def __init__(self, path: str, max_entries: int = 200_000):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        init_db(path, """
+            CREATE TABLE IF NOT EXISTS scene_cache (
+                key TEXT PRIMARY KEY, payload TEXT NOT NULL, used_at REAL NOT NULL);
+            CREATE INDEX IF NOT EXISTS scene_cache_used ON scene_cache(used_at);
+        """)
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, List[list]]:
+        keys = list(dict.fromkeys(keys))
+        found: Dict[str, List[list]] = {}
+        with connect(self.path) as con:
+            for i in range(0, len(keys), 500):  # лимит параметров SQLite
+                chunk = keys[i:i+500]
+                marks = ",".join("?" * len(chunk))
+                for key, payload in con.execute(
+                        f"SELECT key, payload FROM scene_cache WHERE key IN ({marks})", chunk):
+                    found[key] = json.loads(payload)
+                if found:
+                    con.execute(f"UPDATE scene_cache SET used_at = ? WHERE key IN ({marks})",
+                                [time.time(), *chunk])
+        with self._lock:
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return found
+
+    def put_many(self, items: Iterable[Tuple[str, List[Any]]]):
+        now = time.time()
+        rows = [(key, json.dumps(hits, ensure_ascii=False), now) for key, hits in items]
+        if not rows:
+            return
+        with connect(self.path) as con:
+            con.executemany("INSERT OR REPLACE INTO scene_cache(key, payload, used_at) VALUES (?, ?, ?)", rows)
+            (count,) = con.execute("SELECT COUNT(*) FROM scene_cache").fetchone()
+            if count > self.max_entries:
+                con.execute(
+                    "DELETE FROM scene_cache WHERE key IN ("
+                    " SELECT key FROM scene_cache ORDER BY used_at LIMIT ?)",
+                    (count - self.max_entries,)
+                )
+
+    def stats(self) -> Dict[str, int]:
+        with connect(self.path) as con:
+            (size,) = con.execute("SELECT COUNT(*) FROM scene_cache").fetchone()
+        return {"hits": self.hits, "misses": self.misses, "entries": size}
@@ -1,101 +1,241 @@
 import os
-import re
-import uuid
-import yaml
-from concurrent.futures import ThreadPoolExecutor
-from typing import Dict, List, Any, Optional
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Any, Optional, NamedTuple, Tuple
 from app.models.schemas import Scene, Episode
-from app.utils.text import normalize_text, deobfuscate_obscene, latin_to_cyr
-from app.utils.io import read_yaml
+from app.utils.text import NormalizedText
+from app.services.rules import CompiledRules, RuleStats, compile_rules, scan_category, any_match, fold_case
+from app.services.cache import SceneCache
+from app.services import snapshot
+from app.services.episodes import EpisodeTable
+from app.utils.checksum import text_checksum
+from app.utils import metrics
+from app.settings import settings
 
-CONFIG_PATH = "config/rules.yaml"
+CONFIG_PATH = snapshot.RULES_PATH
 
-RULES = read_yaml(CONFIG_PATH)
+# скомпилированные правила берутся из снимка data/cache (собирается при первом запуске)
+COMPILED_RULES = snapshot.load().rules
+RULES = COMPILED_RULES.raw
 
 SEVERITY_ORDER = ["None", "Mild", "Moderate", "Severe"]
+QUOTE_CONTEXT = 30  # символов исходного текста по обе стороны совпадения в цитате
 
-def detect_in_scene(scene: Scene, rules: Dict[str, Any]) -> List[Episode]:
-    text = scene.text
-    norm = normalize_text(text)
-    norm_deobf = deobfuscate_obscene(latin_to_cyr(norm))
-
-    episodes: List[Episode] = []
-    for cat, cfg in rules["categories"].items():
-        cat_max = "None"
-        cat_hits: List[Episode] = []
-
-        def add_hit(sev: str, rule: str, span, quote, reason):
-            cat_hits.append(Episode(
-                id=str(uuid.uuid4())[:8],
-                scene_id=scene.id,
-                category=cat,
-                severity=sev,
-                rule_id=rule,
-                start=span[0], end=span[1],
-                quote=quote, reason=reason
-            ))
-
-        # patterns by severity
-        for sev in ["severe", "moderate", "mild"]:
-            pats = cfg.get("patterns", {}).get(sev, [])
-            for p in pats:
-                # ищем и в нормальном, и в деобфусцированном тексте
-                for hay, tag in [(norm, "norm"), (norm_deobf, "deobf")]:
-                    for m in re.finditer(p, hay, flags=re.IGNORECASE):
-                        s, e = m.span()
-                        quote = text[max(0, s-30):min(len(text), e+30)]
-                        add_hit(sev.capitalize(), f"{cat}:{sev}:{p}:{tag}", (s, e), quote, f"match:{p}")
+RULE_TIMEOUTS = metrics.REGISTRY.counter("rating_rule_timeouts_total",
+                                         "Guarded rules skipped after exceeding the per-scene time budget", ["rule"])
+# учёт времени/совпадений по правилам (enable_rule_stats); в каждом процессе свой
+RULE_STATS: Optional[RuleStats] = None
+
+def enable_rule_stats() -> RuleStats:
+    global RULE_STATS
+    RULE_STATS = RULE_STATS or RuleStats()
+    return RULE_STATS
+
+def drain_rule_stats() -> Optional[Dict[str, Dict[str, float]]]:
+    # Накопленное с прошлого вызова — чтобы воркер пула мог отдать учёт вместе с результатом
+    global RULE_STATS
+    if RULE_STATS is None:
+        return None
+    data, RULE_STATS = RULE_STATS.to_dict(), RuleStats()
+    return data
+
+class Hit(NamedTuple):
+    # Компактный результат детекции — без pydantic, дёшево передаётся между процессами
+    category: str
+    severity: str
+    rule_id: str
+    start: int
+    end: int
+    quote: str
+    reason: str
+
+def detect_text(text: str, rules: CompiledRules, timeouts: Optional[List[str]] = None) -> List[Hit]:
+    # timeouts — сюда попадают ключи guarded-правил, не уложившихся в бюджет (их совпадения пропущены)
+    budget = settings.detect_rule_timeout_ms / 1000 if settings.detect_rule_timeout_ms > 0 else None
+    stats = RULE_STATS
+    # нормализованные представления и карты позиций — одни на все категории
+    view = NormalizedText(text)
+    norm, norm_deobf = view.norm, view.deobf
+    folded = (fold_case(norm), fold_case(norm_deobf))
+    # один проход префильтра по литералам на haystack вместо прогона каждого правила
+    seen = (rules.scan_literals(folded[0]), rules.scan_literals(folded[1]))
+
+    hits: List[Hit] = []
+    for cat in rules.categories:
+        cat_hits: List[list] = []
+
+        # ищем и в нормальном, и в деобфусцированном тексте — по одному проходу объединённого матчера
+        hays = [(scan_category(cat, norm, folded[0], seen[0], budget, timeouts, stats), "norm"),
+                (scan_category(cat, norm_deobf, folded[1], seen[1], budget, timeouts, stats), "deobf")]
+        for i, rule in enumerate(cat.rules):
+            # позиции совпадений — в исходном тексте сцены; одно и то же место, найденное
+            # в обоих представлениях, даёт один эпизод
+            spans = [view.original_span(tag, s, e) for found, tag in hays for s, e in found[i]]
+            for s, e in merge_spans(spans):
+                quote = text[max(0, s-QUOTE_CONTEXT):min(len(text), e+QUOTE_CONTEXT)]
+                cat_hits.append([cat.name, rule.severity, rule.key, s, e, quote, f"match:{rule.pattern}"])
+
+        if not cat_hits:
+            continue
 
         # boosters
-        boosters = cfg.get("boosters", {})
-        for bsev, pats in boosters.items():
-            for p in pats:
-                if re.search(p, norm, flags=re.IGNORECASE) or re.search(p, norm_deobf, flags=re.IGNORECASE):
-                    # повысить каждый hit до не ниже bsev
-                    for h in cat_hits:
-                        h.severity = max_severity(h.severity, bsev.capitalize())
+        for bsev, regexes in cat.boosters:
+            if any_match(regexes, norm, norm_deobf, timeout=budget, timeouts=timeouts,
+                         key=f"{cat.name}:booster_{bsev.lower()}"):
+                # повысить каждый hit до не ниже bsev
+                for h in cat_hits:
+                    h[1] = max_severity(h[1], bsev)
 
         # анти‑FP (простая эвристика)
-        for anti in cfg.get("anti_fp", []) or []:
-            if re.search(anti, norm, flags=re.IGNORECASE):
-                for h in cat_hits:
-                    h.severity = "None"
+        if any_match(cat.anti_fp, norm, timeout=budget, timeouts=timeouts, key=f"{cat.name}:anti_fp"):
+            for h in cat_hits:
+                h[1] = "None"
 
         # итог по категории — берём все hits (для статистики)
-        episodes.extend(cat_hits)
-
-    return episodes
-
-def process_scenes(scenes: List[Scene], prior_state: Optional[Dict[str, Any]] = None) -> Dict[str, List[Episode]]:
-    # Инкрементально: если checksum одинаковый — берём прежние эпизоды
-    out: Dict[str, List[Episode]] = {}
-    with ThreadPoolExecutor(max_workers=4) as pool:
-        futures = {}
-        for sc in scenes:
-            ch = checksum_scene(sc)
-            if prior_state and prior_state.get(sc.id, {}).get("checksum") == ch:
-                out[sc.id] = [Episode(**e) for e in prior_state[sc.id]["episodes"]]
-            else:
-                futures[pool.submit(detect_in_scene, sc, RULES)] = sc
-        for fut, sc in futures.items():
-            out[sc.id] = fut.result()
-            out[sc.id] = [e for e in out[sc.id]]  # normalize
-        # Обновим cache payload
-        for sc in scenes:
-            if sc.id not in out:
-                out[sc.id] = []
+        hits.extend(Hit(*h) for h in cat_hits)
+
+    return hits
+
+def merge_spans(spans: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    # Пересекающиеся отрезки -> их объединение; в пределах одного представления finditer
+    # совпадений не пересекает, так что склеиваются находки norm и deobf
+    if len(spans) < 2:
+        return spans
+    spans = sorted(spans)
+    out = [spans[0]]
+    for s, e in spans[1:]:
+        ps, pe = out[-1]
+        if s < pe or s == ps:
+            out[-1] = (ps, max(pe, e))
+        else:
+            out.append((s, e))
     return out
 
-def process_specific_scenes(scenes: List[Scene], scene_ids: List[str]) -> Dict[str, List[Episode]]:
+def to_episodes(scene_id: str, hits: List[Hit]) -> List[Episode]:
+    return EpisodeTable.from_hits({scene_id: hits}).to_episodes()
+
+def detect_in_scene(scene: Scene, rules: CompiledRules) -> List[Episode]:
+    return to_episodes(scene.id, detect_text(scene.text, rules))
+
+# --- пул процессов ---------------------------------------------------------
+# Детекция — чистый Python и регэкспы, потоки упираются в GIL. Воркеры пула один раз
+# компилируют правила в initializer и получают пачки (scene_id, text), а возвращают Hit.
+
+_WORKER_RULES: Optional[CompiledRules] = None
+_POOL: Optional[ProcessPoolExecutor] = None
+_POOL_KEY = None
+_POOL_LOCK = threading.Lock()
+
+def _init_worker(raw_rules: Dict[str, Any]):
+    global _WORKER_RULES
+    _WORKER_RULES = COMPILED_RULES if raw_rules == RULES else compile_rules(raw_rules)
+
+def _detect_one(text: str, rules: CompiledRules) -> Tuple[List[Hit], List[str]]:
+    timeouts: List[str] = []
+    return detect_text(text, rules, timeouts), timeouts
+
+def _detect_batch(batch: List[Tuple[str, str]]) -> List[Tuple[List[Hit], List[str]]]:
+    return [_detect_one(text, _WORKER_RULES) for _, text in batch]
+
+def pool_workers() -> int:
+    return settings.detect_workers or os.cpu_count() or 1
+
+def get_pool(rules: CompiledRules) -> ProcessPoolExecutor:
+    global _POOL, _POOL_KEY
+    key = (id(rules), pool_workers())
+    with _POOL_LOCK:
+        if _POOL is None or _POOL_KEY != key:
+            if _POOL is not None:
+                _POOL.shutdown(wait=False, cancel_futures=True)
+            _POOL = ProcessPoolExecutor(
+                max_workers=key[1],
+                mp_context=multiprocessing.get_context(settings.detect_start_method),
+                initializer=_init_worker, initargs=(rules.raw,)
+            )
+            _POOL_KEY = key
+        return _POOL
+
+def shutdown_pool():
+    global _POOL, _POOL_KEY
+    with _POOL_LOCK:
+        if _POOL is not None:
+            _POOL.shutdown(wait=True)
+        _POOL, _POOL_KEY = None, None
+
+def detect_many(scenes: List[Scene], rules: CompiledRules,
+                timeouts: Optional[Dict[str, List[str]]] = None) -> List[List[Hit]]:
+    # Результат в порядке входных сцен при любом режиме исполнения;
+    # timeouts — scene_id -> правила, пропущенные по бюджету времени
+    use_pool = (settings.detect_mode == "process" and pool_workers() > 1
+                and len(scenes) >= settings.detect_min_pool_scenes)
+    if not use_pool:
+        results = [_detect_one(sc.text, rules) for sc in scenes]
+    else:
+        size = max(1, settings.detect_chunk_size)
+        batches = [[(sc.id, sc.text) for sc in scenes[i:i+size]] for i in range(0, len(scenes), size)]
+        results = []
+        for res in get_pool(rules).map(_detect_batch, batches):
+            results.extend(res)
+    out: List[List[Hit]] = []
+    for sc, (hits, skipped) in zip(scenes, results):
+        out.append(hits)
+        for key in skipped:
+            RULE_TIMEOUTS.inc(rule=key)
+        if skipped and timeouts is not None:
+            timeouts[sc.id] = skipped
+    return out
+
+def process_scenes(scenes: List[Scene], prior_state: Optional[Dict[str, Any]] = None,
+                   rules: Optional[CompiledRules] = None,
+                   scene_cache: Optional[SceneCache] = None) -> Dict[str, List[Hit]]:
+    rules = rules or COMPILED_RULES
+    # Инкрементально: если checksum одинаковый — берём прежние находки
+    cached: Dict[str, List[Hit]] = {}
+    todo: List[Scene] = []
+    for sc in scenes:
+        prior = (prior_state or {}).get(sc.id) or {}
+        if prior.get("checksum") == checksum_scene(sc, rules) and "hits" in prior:
+            cached[sc.id] = [Hit(*h) for h in prior["hits"]]
+        else:
+            todo.append(sc)
+    fresh = detect_cached(todo, rules, scene_cache)
+    out: Dict[str, List[Hit]] = {}
+    for sc in scenes:
+        out[sc.id] = cached[sc.id] if sc.id in cached else fresh[sc.id]
+    return out
+
+def process_specific_scenes(scenes: List[Scene], scene_ids: List[str],
+                            rules: Optional[CompiledRules] = None,
+                            scene_cache: Optional[SceneCache] = None) -> Dict[str, List[Hit]]:
     lookup = {s.id: s for s in scenes}
-    out: Dict[str, List[Episode]] = {}
-    for sid in scene_ids:
-        sc = lookup[sid]
-        out[sid] = detect_in_scene(sc, RULES)
+    return detect_cached([lookup[sid] for sid in scene_ids], rules or COMPILED_RULES, scene_cache)
+
+def detect_cached(scenes: List[Scene], rules: CompiledRules,
+                  scene_cache: Optional[SceneCache] = None) -> Dict[str, List[Hit]]:
+    # Общий кеш сцен: одинаковый текст при той же версии правил не детектируем повторно,
+    # в каком бы файле он ни встретился
+    keys = {sc.id: checksum_scene(sc, rules) for sc in scenes}
+    known = scene_cache.get_many(keys.values()) if scene_cache else {}
+    todo = [sc for sc in scenes if keys[sc.id] not in known]
+    timeouts: Dict[str, List[str]] = {}
+    computed = dict(zip((sc.id for sc in todo), detect_many(todo, rules, timeouts)))
+    if scene_cache:
+        # неполный результат (правило сорвалось по таймауту) не кешируем
+        scene_cache.put_many((keys[sid], hits) for sid, hits in computed.items() if sid not in timeouts)
+    out: Dict[str, List[Hit]] = {}
+    for sc in scenes:
+        hits = computed.get(sc.id)
+        out[sc.id] = hits if hits is not None else [Hit(*h) for h in known[keys[sc.id]]]
     return out
 
-def checksum_scene(scene: Scene) -> str:
-    return str(abs(hash(scene.text)))
+def checksum_scene(scene: Scene, rules: Optional[CompiledRules] = None) -> str:
+    # Стабильный между процессами дайджест (hash() солится на каждый запуск)
+    fp = (rules or COMPILED_RULES).fingerprint
+    return text_checksum(f"{fp}\n{scene.text}")
+
+def scene_checksums(scenes: List[Scene], rules: Optional[CompiledRules] = None) -> Dict[str, str]:
+    return {sc.id: checksum_scene(sc, rules) for sc in scenes}
 
 def max_severity(a: str, b: str) -> str:
     return a if SEVERITY_ORDER.index(a) >= SEVERITY_ORDER.index(b) else b
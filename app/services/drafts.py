@@ -0,0 +1,176 @@
+import re
+import difflib
+from collections import Counter
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+from app.models.schemas import AnalysisResult, Scene
+from app.services.episodes import EpisodeTable, FP, MANUAL, new_ids
+from app.utils.checksum import text_checksum
+
+# Черновики одного сценария: новая загрузка связывается с предыдущей версией (Store.link_version).
+# Сцены выравниваются по хешу текста: difflib по последовательности хешей даёт совпавшие блоки,
+# переставленные сцены находятся по тому же хешу среди остальных, изменённые — по похожести
+# набора слов внутри заменённых блоков. Неизменённые сцены берут находки, отметки FP и ручные
+# эпизоды прежней версии; изменённые и новые детектируются заново.
+
+SAME, CHANGED = "same", "changed"
+WORD_RE = re.compile(r"\w+")
+MAX_BLOCK_PAIRS = 250_000  # больше пар в заменённом блоке — похожие сцены не ищем
+
+class SceneMatch(NamedTuple):
+    old_id: str
+    status: str  # same — текст совпал, changed — похожая сцена
+    similarity: float
+
+class Alignment(NamedTuple):
+    matches: Dict[str, SceneMatch]  # id сцены новой версии -> пара в прежней
+    added: List[str]  # сцены новой версии без пары
+    removed: List[str]  # сцены прежней версии без пары
+
+class Draft(NamedTuple):
+    previous: AnalysisResult
+    alignment: Alignment
+
+def words(text: str) -> frozenset:
+    return frozenset(WORD_RE.findall(text.lower()))
+
+def similarity(a: frozenset, b: frozenset) -> float:
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+def align_scenes(old: List[Scene], new: List[Scene], threshold: float) -> Alignment:
+    old_h = [text_checksum(s.text) for s in old]
+    new_h = [text_checksum(s.text) for s in new]
+    matches: Dict[str, SceneMatch] = {}
+    blocks: List[Tuple[List[int], List[int]]] = []
+    for tag, i1, i2, j1, j2 in difflib.SequenceMatcher(None, old_h, new_h, autojunk=False).get_opcodes():
+        if tag == "equal":
+            for k in range(i2 - i1):
+                matches[new[j1 + k].id] = SceneMatch(old[i1 + k].id, SAME, 1.0)
+        else:
+            blocks.append((list(range(i1, i2)), list(range(j1, j2))))
+
+    # переставленные сцены: тот же текст вне своего блока
+    free: Dict[str, List[int]] = {}
+    for olds, _ in blocks:
+        for i in olds:
+            free.setdefault(old_h[i], []).append(i)
+    used = set()
+    for _, news in blocks:
+        for j in news:
+            same = free.get(new_h[j])
+            if same:
+                i = same.pop(0)
+                used.add(i)
+                matches[new[j].id] = SceneMatch(old[i].id, SAME, 1.0)
+
+    # изменённые: лучшие по словам пары внутри заменённого блока, жадно
+    for olds, news in blocks:
+        olds = [i for i in olds if i not in used]
+        news = [j for j in news if new[j].id not in matches]
+        if not olds or not news or len(olds) * len(news) > MAX_BLOCK_PAIRS:
+            continue
+        old_w = {i: words(old[i].text) for i in olds}
+        pairs = []
+        for j in news:
+            w = words(new[j].text)
+            for i in olds:
+                sim = similarity(old_w[i], w)
+                if sim >= threshold:
+                    pairs.append((sim, i, j))
+        pairs.sort(key=lambda p: (-p[0], abs(p[1] - p[2])))
+        taken_new = set()
+        for sim, i, j in pairs:
+            if i in used or j in taken_new:
+                continue
+            used.add(i)
+            taken_new.add(j)
+            matches[new[j].id] = SceneMatch(old[i].id, CHANGED, round(sim, 4))
+
+    paired_old = {m.old_id for m in matches.values()}
+    return Alignment(matches,
+                     [s.id for s in new if s.id not in matches],
+                     [s.id for s in old if s.id not in paired_old])
+
+def prior_state(alignment: Alignment, previous_cache: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    # Кеш прежней версии (cache.load_cache) под id сцен новой; checksum проверит detector.process_scenes
+    if not previous_cache:
+        return {}
+    return {sid: previous_cache[m.old_id] for sid, m in alignment.matches.items()
+            if m.status == SAME and m.old_id in previous_cache}
+
+def carry_decisions(table: EpisodeTable, draft: Draft) -> Tuple[int, int]:
+    # FP-отметки и ручные эпизоды неизменённых сцен -> в таблицу новой версии; -> (fp, manual)
+    same = {m.old_id: sid for sid, m in draft.alignment.matches.items() if m.status == SAME}
+    fp_keys = {(same[e.scene_id], e.category, e.rule_id, e.start, e.end)
+               for e in draft.previous.episodes if e.is_fp and not e.is_manual and e.scene_id in same}
+    fp = 0
+    if fp_keys:
+        for i, row in enumerate(table.rows()):
+            if (row[1], row[2], row[4], row[5], row[6]) in fp_keys:
+                table.flags[i] |= FP
+                fp += 1
+    manual = [e for e in draft.previous.episodes if e.is_manual and e.scene_id in same]
+    for id, e in zip(new_ids(len(manual)), manual):
+        table.append(id, same[e.scene_id], e.category, e.severity, e.rule_id, e.start, e.end, e.quote, e.reason,
+                     MANUAL | (FP if e.is_fp else 0))
+    return fp, len(manual)
+
+def _findings(analysis: AnalysisResult) -> Dict[str, Counter]:
+    # Учитываемые находки по сценам; ключ — категория, строгость, правило и сам совпавший текст
+    # (цитата с контекстом меняется от соседних правок и для сравнения не годится)
+    texts = {s.id: s.text for s in analysis.scenes}
+    out: Dict[str, Counter] = {}
+    for e in analysis.episodes:
+        if not e.is_fp:
+            text = texts.get(e.scene_id, "")[e.start:e.end] or e.quote
+            out.setdefault(e.scene_id, Counter())[(e.category, e.severity, e.rule_id, text)] += 1
+    return out
+
+def _listed(found: Counter) -> List[Dict[str, Any]]:
+    return [{"category": c, "severity": sev, "rule_id": r, "text": t, "count": n}
+            for (c, sev, r, t), n in sorted(found.items())]
+
+def diff(draft: Draft, current: AnalysisResult) -> Dict[str, Any]:
+    # Изменения, влияющие на рейтинг: итог, категории и находки по сценам
+    previous, alignment = draft.previous, draft.alignment
+    before, after = _findings(previous), _findings(current)
+    changes = []
+    for s in current.scenes:
+        m = alignment.matches.get(s.id)
+        old = before.get(m.old_id, Counter()) if m else Counter()
+        new = after.get(s.id, Counter())
+        added, removed = new - old, old - new
+        if added or removed:
+            changes.append({"scene_id": s.id, "previous_scene_id": m.old_id if m else None,
+                            "status": m.status if m else "added",
+                            "added": _listed(added), "removed": _listed(removed)})
+    for sid in alignment.removed:
+        if before.get(sid):
+            changes.append({"scene_id": None, "previous_scene_id": sid, "status": "removed",
+                            "added": [], "removed": _listed(before[sid])})
+
+    cats_before = {c.category: c for c in previous.summary.categories} if previous.summary else {}
+    cats_after = {c.category: c for c in current.summary.categories} if current.summary else {}
+    categories = []
+    for name in sorted(set(cats_before) | set(cats_after)):
+        b, a = cats_before.get(name), cats_after.get(name)
+        pair = [{"count_episodes": c.count_episodes, "overall_severity": c.overall_severity} if c else None
+                for c in (b, a)]
+        if pair[0] != pair[1]:
+            categories.append({"category": name, "before": pair[0], "after": pair[1]})
+
+    statuses = Counter(m.status for m in alignment.matches.values())
+    return {
+        "file_id": current.file_id,
+        "previous_file_id": previous.file_id,
+        "age_rating": {"before": previous.summary.age_rating if previous.summary else None,
+                       "after": current.summary.age_rating if current.summary else None},
+        "max_severity": {"before": previous.summary.max_severity if previous.summary else None,
+                         "after": current.summary.max_severity if current.summary else None},
+        "scenes": {"same": statuses[SAME], "changed": statuses[CHANGED],
+                   "added": len(alignment.added), "removed": len(alignment.removed)},
+        "categories": categories,
+        "changes": changes,
+    }
@@ -0,0 +1,112 @@
+import os
+from array import array
+from typing import Any, Dict, Iterable, Iterator, List, Tuple
+from app.models.schemas import Episode
+
+# Эпизоды анализа «столбцами»: строки категорий/строгостей/правил интернированы в коды,
+# смещения и флаги — в array. Словарь кодов у каждой таблицы свой: сцена, категория и reason
+# ручных эпизодов — текст пользователя, и общий на процесс словарь рос бы с каждой загрузкой. Так результат детекции идёт detector -> aggregate -> store
+# без десятков тысяч pydantic-объектов; Episode собираются только на границе API.
+
+SEVERITIES = ["None", "Mild", "Moderate", "Severe"]
+SEV_CODE = {s: i for i, s in enumerate(SEVERITIES)}
+MANUAL, FP = 1, 2  # биты flags
+
+# порядок полей row() — как у Episode и store.EPISODE_COLS
+COLUMNS = ["id", "scene_id", "category", "severity", "rule_id", "start", "end",
+           "quote", "reason", "is_manual", "is_fp"]
+
+class Vocab:
+    # Интернирование строк одной таблицы: коды не сохраняются и между таблицами не передаются
+
+    def __init__(self):
+        self.names: List[str] = []
+        self.codes: Dict[str, int] = {}
+
+    def code(self, name: str) -> int:
+        c = self.codes.get(name)
+        if c is None:
+            self.names.append(name)
+            c = self.codes[name] = len(self.names) - 1
+        return c
+
+def new_ids(n: int) -> List[str]:
+    # 128 случайных бит (32 hex-символа, как uuid4().hex) на эпизод одним вызовом urandom:
+    # на десятках тысяч эпизодов анализа короткие id уже совпадают
+    raw = os.urandom(16 * n).hex()
+    return [raw[i:i+32] for i in range(0, 32 * n, 32)]
+
+class EpisodeTable:
+    __slots__ = ("vocab", "ids", "scene", "category", "severity", "rule", "reason", "start", "end", "quote", "flags")
+
+    def __init__(self):
+        self.vocab = Vocab()
+        self.ids: List[str] = []
+        self.scene = array("I")
+        self.category = array("I")
+        self.severity = array("B")
+        self.rule = array("I")
+        self.reason = array("I")
+        self.start = array("L")
+        self.end = array("L")
+        self.quote: List[str] = []
+        self.flags = array("B")
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def append(self, id: str, scene_id: str, category: str, severity: str, rule_id: str,
+               start: int, end: int, quote: str, reason: str, flags: int = 0):
+        code = self.vocab.code
+        self.ids.append(id)
+        self.scene.append(code(scene_id))
+        self.category.append(code(category))
+        self.severity.append(SEV_CODE[severity])
+        self.rule.append(code(rule_id))
+        self.reason.append(code(reason))
+        self.start.append(start)
+        self.end.append(end)
+        self.quote.append(quote)
+        self.flags.append(flags)
+
+    def extend_hits(self, scene_id: str, hits: List[Any]):
+        # hits — detector.Hit (category, severity, rule_id, start, end, quote, reason)
+        for id, h in zip(new_ids(len(hits)), hits):
+            self.append(id, scene_id, *h)
+
+    @classmethod
+    def from_hits(cls, hits_by_scene: Dict[str, List[Any]]) -> "EpisodeTable":
+        table = cls()
+        for scene_id, hits in hits_by_scene.items():
+            table.extend_hits(scene_id, hits)
+        return table
+
+    @classmethod
+    def from_episodes(cls, episodes: Iterable[Episode]) -> "EpisodeTable":
+        table = cls()
+        for e in episodes:
+            table.append(e.id, e.scene_id, e.category, e.severity, e.rule_id, e.start, e.end, e.quote, e.reason,
+                         (MANUAL if e.is_manual else 0) | (FP if e.is_fp else 0))
+        return table
+
+    def row(self, i: int) -> Tuple:
+        names, flags = self.vocab.names, self.flags[i]
+        return (self.ids[i], names[self.scene[i]], names[self.category[i]], SEVERITIES[self.severity[i]],
+                names[self.rule[i]], self.start[i], self.end[i], self.quote[i], names[self.reason[i]],
+                bool(flags & MANUAL), bool(flags & FP))
+
+    def rows(self) -> Iterator[Tuple]:
+        for i in range(len(self.ids)):
+            yield self.row(i)
+
+    def episode(self, i: int) -> Episode:
+        return Episode(**dict(zip(COLUMNS, self.row(i))))
+
+    def to_episodes(self) -> List[Episode]:
+        return [self.episode(i) for i in range(len(self.ids))]
+
+    def counted(self) -> Iterator[Tuple[str, str, int, bool]]:
+        # (категория, сцена, ранг строгости, is_fp) — всё, что нужно aggregate.SummaryState
+        names = self.vocab.names
+        for cat, scene, sev, flags in zip(self.category, self.scene, self.severity, self.flags):
+            yield names[cat], names[scene], sev, bool(flags & FP)
@@ -0,0 +1,196 @@
+import os
+import json
+import time
+import uuid
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional
+
+from app.services import pipeline, report
+from app.utils import metrics
+from app.utils.text import safe_json_dump
+from app.settings import settings
+
+TERMINAL = ("done", "error")
+KEEP_FINISHED_SEC = 3600  # завершённые задачи держим в памяти час, дальше — только файл состояния
+
+class QueueFull(Exception):
+    pass
+
+class Job:
+    # Состояние фоновой задачи анализа. Прогресс приходит из рабочего потока и
+    # переносится в event loop через call_soon_threadsafe — там его читают SSE-подписчики.
+
+    def __init__(self, file_id: str, upload: str, profile: bool = False):
+        self.id = uuid.uuid4().hex[:12]
+        self.file_id = file_id
+        self.upload = upload
+        self.profile = profile
+        self.profile_path: Optional[str] = None
+        self.status = "queued"
+        self.stage: Optional[str] = None
+        self.progress: Dict[str, Any] = {}
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.finished_at: Optional[float] = None
+        self.events: List[Dict[str, Any]] = []
+        self.subscribers: List[asyncio.Queue] = []
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "job_id": self.id, "file_id": self.file_id, "status": self.status,
+            "stage": self.stage, "progress": self.progress, "error": self.error,
+            "created_at": self.created_at, "finished_at": self.finished_at,
+            "profile": os.path.basename(self.profile_path) if self.profile_path else None,
+        }
+
+    def publish(self, event: Dict[str, Any]):
+        # только из event loop
+        self.events.append(event)
+        for q in self.subscribers:
+            q.put_nowait(event)
+
+def job_path(job_id: str) -> str:
+    return os.path.join(pipeline.JOBS, f"{job_id}.json")
+
+def load_job_state(job_id: str) -> Optional[Dict[str, Any]]:
+    # Задачи других воркеров uvicorn видны только через файл состояния
+    p = job_path(job_id)
+    if not os.path.exists(p):
+        return None
+    with open(p, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+class JobManager:
+    # Ограниченная очередь + фиксированное число исполнителей: всплеск загрузок
+    # ждёт в очереди или получает быстрый отказ, а не таймаут посреди анализа.
+
+    def __init__(self, workers: int, queue_depth: int,
+                 runner: Callable[..., Any] = pipeline.run_analysis):
+        self.workers = max(1, workers)
+        self.queue_depth = max(1, queue_depth)
+        self.runner = runner
+        self.jobs: Dict[str, Job] = {}
+        self.queue: Optional[asyncio.Queue] = None
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.executor: Optional[ThreadPoolExecutor] = None
+        self.tasks: List[asyncio.Task] = []
+
+    async def start(self):
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize=self.queue_depth)
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="analysis")
+        self.tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for t in self.tasks:
+            t.cancel()
+        self.tasks = []
+        if self.executor:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def submit(self, file_id: str, upload: str, profile: bool = False) -> Job:
+        self._prune()
+        job = Job(file_id, upload, profile)
+        try:
+            self.queue.put_nowait(job)
+        except asyncio.QueueFull:
+            raise QueueFull()
+        self.jobs[job.id] = job
+        self._update(job, "queued", None, {"position": self.queue.qsize()})
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        return self.jobs.get(job_id)
+
+    def _prune(self):
+        now = time.time()
+        for jid in [j.id for j in self.jobs.values() if j.finished_at and now - j.finished_at > KEEP_FINISHED_SEC]:
+            del self.jobs[jid]
+
+    async def _worker(self):
+        while True:
+            job = await self.queue.get()
+            try:
+                self._update(job, "running", "start", {})
+                await self.loop.run_in_executor(self.executor, self._run, job)
+                self._update(job, "done", "done", {})
+                report.prerender_pdf(job.file_id)
+            except Exception as ex:  # ошибка анализа не должна ронять воркер
+                job.error = f"{type(ex).__name__}: {ex}"
+                self._update(job, "error", job.stage, {})
+            finally:
+                self.queue.task_done()
+
+    def _run(self, job: Job):
+        def progress(stage: str, data: Dict[str, Any]):
+            self.loop.call_soon_threadsafe(self._update, job, "running", stage, data)
+        with metrics.profiled(job.profile, pipeline.PROFILES, f"job-{job.id}") as path:
+            job.profile_path = path
+            self.runner(job.file_id, job.upload, progress)
+
+    def _update(self, job: Job, status: str, stage: Optional[str], data: Dict[str, Any]):
+        job.status = status
+        job.stage = stage
+        job.progress = data
+        if status in TERMINAL:
+            job.finished_at = time.time()
+        event = {"status": status, "stage": stage, **data}
+        if job.error:
+            event["error"] = job.error
+        job.publish(event)
+        # смены стадий пишем на диск (прогресс внутри стадии — только в памяти)
+        if len(job.events) < 2 or job.events[-2].get("stage") != stage or status in TERMINAL:
+            safe_json_dump(job.to_dict(), job_path(job.id))
+
+def sse(event: Dict[str, Any]) -> str:
+    return f"data: {json.dumps(event, ensure_ascii=False)}\n\n"
+
+async def stream_events(job: Job, keepalive: float = 15.0) -> AsyncIterator[str]:
+    # Сначала уже накопленные события, затем живые — до завершения задачи
+    q: asyncio.Queue = asyncio.Queue()
+    backlog = list(job.events)
+    job.subscribers.append(q)
+    try:
+        for event in backlog:
+            yield sse(event)
+        if job.status in TERMINAL:
+            return
+        while True:
+            try:
+                event = await asyncio.wait_for(q.get(), timeout=keepalive)
+            except asyncio.TimeoutError:
+                yield ": keepalive\n\n"
+                continue
+            yield sse(event)
+            if event["status"] in TERMINAL:
+                return
+    finally:
+        job.subscribers.remove(q)
+
+async def poll_events(job_id: str, interval: float = 1.0) -> AsyncIterator[str]:
+    # Задача выполняется в другом воркере uvicorn: отдаём смены стадий из файла состояния
+    last = None
+    while True:
+        state = load_job_state(job_id)
+        if state is None:
+            return
+        event = {"status": state["status"], "stage": state["stage"], **(state.get("progress") or {})}
+        if state.get("error"):
+            event["error"] = state["error"]
+        if event != last:
+            yield sse(event)
+            last = event
+        if state["status"] in TERMINAL:
+            return
+        await asyncio.sleep(interval)
+
+MANAGER = JobManager(settings.job_workers, settings.job_queue_depth)
+
+def _collect_metrics() -> List[str]:
+    queued = MANAGER.queue.qsize() if MANAGER.queue else 0
+    running = sum(1 for j in MANAGER.jobs.values() if j.status == "running")
+    return ["# HELP rating_jobs Analysis jobs by state", "# TYPE rating_jobs gauge",
+            f'rating_jobs{{state="queued"}} {queued}', f'rating_jobs{{state="running"}} {running}']
+
+metrics.REGISTRY.collectors.append(_collect_metrics)
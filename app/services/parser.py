@@ -1,77 +1,197 @@
 import os
 import re
-from typing import List, Dict, Any
-from docx import Document as DocxDocument
-from pdfminer.high_level import extract_pages
-from pdfminer.layout import LTTextContainer
+from bisect import bisect_right
+from typing import List, Dict, Any, Callable, Iterator, Optional, Tuple
 from app.models.schemas import Scene
-from app.utils.io import read_text_from_pdf, read_text_from_docx
+from app.utils.io import read_text_from_docx, iter_docx_text, iter_pdf_pages, join_pages, PAGE_SEPARATOR
 from app.utils.checksum import text_checksum
+from app.settings import settings
 
-SCENE_SPLIT_REGEX = re.compile(r"(^|\n)(?:СЦЕНА\s+\d+|INT\.|EXT\.|ИНТ\.|НАТ\.|EXT\/INT\.|INT\/EXT\.)", re.IGNORECASE)
+SCENE_HEADER_RE = re.compile(r"^[ \t]*(?:СЦЕНА\s+\d+|INT\.|EXT\.|ИНТ\.|НАТ\.|EXT/INT\.|INT/EXT\.)",
+                             re.IGNORECASE | re.MULTILINE)
+# «СЦЕНА» в конце текста, за которой пока одни пробельные символы: \s+ заголовка захватывает
+# и переводы строк, так что номер может прийти со следующей страницей
+PENDING_HEADER_RE = re.compile(r"^[ \t]*СЦЕНА\s*\Z", re.IGNORECASE | re.MULTILINE)
+PARAGRAPH_BREAK_RE = re.compile(r"\n{2,}")
+NON_SPACE_RE = re.compile(r"\S")
+DASH_DIALOGUE_RE = re.compile(r"^([A-ZА-ЯЁ][A-ZА-ЯЁ]+)\s*[:\-—]\s*(.+)$")
+TWO_UPPER_RE = re.compile(r"[A-ZА-ЯЁ][^A-ZА-ЯЁ]*[A-ZА-ЯЁ]")
 
-def load_document(path: str) -> Dict[str, Any]:
+def load_document(path: str, on_page: Optional[Callable[[int], None]] = None) -> Dict[str, Any]:
+    # on_page(n) вызывается после каждой разобранной страницы PDF — для прогресса задач
     ext = os.path.splitext(path)[1].lower()
     if ext == ".docx":
         return {"type": "docx", "path": path, "text": read_text_from_docx(path)}
     elif ext == ".pdf":
-        return {"type": "pdf", "path": path, "pages": list(extract_pages(path))}
+        pages = iter_pdf_pages(path, settings.pdf_workers, settings.pdf_chunk_pages, settings.pdf_parallel_min_pages)
+        if on_page:
+            pages = _report_pages(pages, on_page)
+        text, page_spans = join_pages(pages)
+        return {"type": "pdf", "path": path, "text": text, "page_spans": page_spans}
     else:
         raise ValueError("Unsupported format")
 
+def _report_pages(pages: Iterator[str], on_page: Callable[[int], None]) -> Iterator[str]:
+    for n, page in enumerate(pages, 1):
+        yield page
+        on_page(n)
+
 def segment_scenes(doc: Dict[str, Any]) -> List[Scene]:
+    # Один проход по тексту: сцена — отрезок [start, end) исходного текста без краевых
+    # пробелов, так что scene.text == doc["text"][offset_start:offset_end]
+    text = doc["text"]
+    pages = PageIndex(doc["page_spans"]) if doc["type"] == "pdf" else None
     scenes: List[Scene] = []
-    if doc["type"] == "docx":
-        text = doc["text"]
-        blocks = smart_scene_blocks(text)
-        offset = 0
-        for idx, block in enumerate(blocks):
-            start = text.find(block, offset)
-            end = start + len(block)
-            offset = end
-            scene_id = f"S{idx+1}"
-            dialogues = extract_dialogues(block)
-            scenes.append(Scene(
-                id=scene_id, index=idx, text=block.strip(),
-                offset_start=start, offset_end=end,
-                dialogues=dialogues
-            ))
-    else:  # pdf
-        text, page_spans = read_text_from_pdf(doc["path"], return_spans=True)
-        blocks = smart_scene_blocks(text)
-        for idx, block in enumerate(blocks):
-            start = text.find(block)
-            end = start + len(block)
-            pages = page_range_for_span(page_spans, start, end)
-            dialogues = extract_dialogues(block)
-            scenes.append(Scene(
-                id=f"S{idx+1}", index=idx, text=block.strip(),
-                offset_start=start, offset_end=end,
-                page_start=pages[0] if pages else None, page_end=pages[-1] if pages else None,
-                dialogues=dialogues
-            ))
+    for start, end in scene_spans(text):
+        idx = len(scenes)
+        block = text[start:end]
+        page_start, page_end = pages.page_range(start, end) if pages else (None, None)
+        scenes.append(Scene(
+            id=f"S{idx+1}", index=idx, text=block,
+            offset_start=start, offset_end=end,
+            page_start=page_start, page_end=page_end,
+            dialogues=extract_dialogues(block)
+        ))
     return scenes
 
-def smart_scene_blocks(text: str) -> List[str]:
-    # Разбиваем по заголовкам сцен или по крупным абзацам
-    if SCENE_SPLIT_REGEX.search(text):
-        parts = re.split(SCENE_SPLIT_REGEX, text)
-        blocks = []
-        buf = ""
-        for p in parts:
-            if p is None:
+def scene_spans(text: str) -> Iterator[Tuple[int, int]]:
+    # Границы сцен — начала строк с заголовком сцены; текст до первого заголовка — отдельная
+    # сцена. Без заголовков делим по пустым строкам.
+    bounds = [m.start() for m in SCENE_HEADER_RE.finditer(text)]
+    if bounds:
+        cuts = zip([0] + bounds, bounds + [len(text)])
+    else:
+        cuts = paragraph_cuts(text, 0, len(text))
+    for start, end in cuts:
+        span = trim_span(text, start, end)
+        if span:
+            yield span
+
+def paragraph_cuts(text: str, start: int, end: int) -> Iterator[Tuple[int, int]]:
+    for m in PARAGRAPH_BREAK_RE.finditer(text, start, end):
+        yield start, m.start()
+        start = m.end()
+    yield start, end
+
+def trim_span(text: str, start: int, end: int) -> Optional[Tuple[int, int]]:
+    # [start, end) без краевых пробелов; None — в отрезке одни пробелы
+    m = NON_SPACE_RE.search(text, start, end)
+    if m is None:
+        return None
+    start = m.start()
+    while text[end - 1].isspace():
+        end -= 1
+    return start, end
+
+class SceneStream:
+    # Потоковая сегментация: страницы PDF (текст DOCX — кусками) по одной идут в
+    # буфер, готовые сцены отдаются сразу. Сцена готова, когда за ней найден следующий
+    # заголовок; в памяти — только текст незавершённой сцены. Сцены, смещения и страницы —
+    # те же, что у segment_scenes по склеенному тексту. Исключение: документ без заголовков
+    # (или с вводной частью до первого заголовка) длиннее window_chars делится по пустым
+    # строкам по мере чтения, не дожидаясь конца — иначе пришлось бы держать его целиком.
+
+    def __init__(self, path: str, on_page: Optional[Callable[[int], None]] = None,
+                 window_chars: Optional[int] = None):
+        self.path = path
+        self.on_page = on_page
+        self.window_chars = window_chars or settings.stream_window_chars
+        self.type = os.path.splitext(path)[1].lower().lstrip(".")
+        if self.type not in ("pdf", "docx"):
+            raise ValueError("Unsupported format")
+        self.pages = PageIndex([]) if self.type == "pdf" else None
+        self.page_count = 0
+        self.buf = ""  # текст с начала незавершённой сцены
+        self.base = 0  # смещение buf[0] в склеенном тексте документа
+        self.scan_from = 0  # с какого места buf искать заголовки (начало строки, где он ещё может начаться)
+        self.headers = False  # встретился ли заголовок сцены
+        self.count = 0
+
+    def _pieces(self) -> Iterator[str]:
+        if self.type == "docx":
+            yield from iter_docx_text(self.path)
+            return
+        pages = iter_pdf_pages(self.path, settings.pdf_workers, settings.pdf_chunk_pages,
+                               settings.pdf_parallel_min_pages)
+        yield from _report_pages(pages, self.on_page) if self.on_page else pages
+
+    def __iter__(self) -> Iterator[Scene]:
+        for piece in self._pieces():
+            yield from self.feed(piece)
+        yield from self.close()
+
+    def feed(self, piece: str) -> Iterator[Scene]:
+        # страницы PDF — как join_pages: разделитель только между непустыми; куски DOCX
+        # (io.iter_docx_text) склеиваются как есть
+        if self.pages is not None:
+            if piece and (self.base or self.buf):
+                self.buf += PAGE_SEPARATOR
+            start = self.base + len(self.buf)
+            self.pages.add(self.page_count, start, start + len(piece))
+            self.page_count += 1
+        self.buf += piece
+        scan_from = self.scan_from
+        bounds = [m.start() for m in SCENE_HEADER_RE.finditer(self.buf, scan_from)]
+        if bounds:
+            # buf[0] — начало незавершённой сцены (или вводной части до первого заголовка)
+            self.headers = True
+            yield from self._take(list(zip([0] + bounds, bounds)), bounds[-1])
+            scan_from = 0
+        elif not self.headers and len(self.buf) > self.window_chars:
+            # последний абзац может продолжиться следующей страницей — его оставляем
+            breaks = [m for m in PARAGRAPH_BREAK_RE.finditer(self.buf) if m.end() < len(self.buf)]
+            if breaks:
+                yield from self._take(list(paragraph_cuts(self.buf, 0, breaks[-1].start())), breaks[-1].end())
+                scan_from = 0
+        # заголовок в недочитанной последней строке (или «СЦЕНА» без номера в конце текста)
+        # найдётся при следующем проходе
+        pending = PENDING_HEADER_RE.search(self.buf, scan_from)
+        self.scan_from = pending.start() if pending else self.buf.rfind("\n") + 1
+
+    def close(self) -> Iterator[Scene]:
+        cuts = [(0, len(self.buf))] if self.headers else list(paragraph_cuts(self.buf, 0, len(self.buf)))
+        yield from self._take(cuts, len(self.buf))
+
+    def _take(self, cuts: List[Tuple[int, int]], rest: int) -> Iterator[Scene]:
+        # отрезки buf -> сцены; buf[:rest] больше не нужен
+        text, base = self.buf, self.base
+        self.buf, self.base = text[rest:], base + rest
+        for start, end in cuts:
+            span = trim_span(text, start, end)
+            if span is None:
                 continue
-            if re.match(r"^(?:СЦЕНА\s+\d+|INT\.|EXT\.|ИНТ\.|НАТ\.|EXT\/INT\.|INT\/EXT\.)", p.strip(), re.IGNORECASE):
-                if buf.strip():
-                    blocks.append(buf.strip())
-                buf = p
-            else:
-                buf += p
-        if buf.strip():
-            blocks.append(buf.strip())
-        return [b for b in blocks if len(b.strip()) > 0]
-    # fallback: по двойным переводам
-    return [b for b in re.split(r"\n{2,}", text) if len(b.strip()) > 0]
+            start, end = span
+            block = text[start:end]
+            page_start, page_end = self.pages.page_range(base + start, base + end) if self.pages else (None, None)
+            idx = self.count
+            self.count += 1
+            yield Scene(id=f"S{idx+1}", index=idx, text=block,
+                        offset_start=base + start, offset_end=base + end,
+                        page_start=page_start, page_end=page_end,
+                        dialogues=extract_dialogues(block))
+
+class PageIndex:
+    # Номера страниц (с 1) по смещению в тексте: бинарный поиск по началам непустых страниц.
+    # Смещение в разделителе между страницами относится к предыдущей странице.
+
+    def __init__(self, page_spans: List[Tuple[int, int, int]]):
+        spans = [(pidx, pstart) for pidx, pstart, pend in page_spans if pend > pstart]
+        self.numbers = [pidx + 1 for pidx, _ in spans]
+        self.starts = [pstart for _, pstart in spans]
+
+    def add(self, pidx: int, start: int, end: int):
+        # следующая страница (SceneStream узнаёт страницы по одной)
+        if end > start:
+            self.numbers.append(pidx + 1)
+            self.starts.append(start)
+
+    def page_at(self, offset: int) -> Optional[int]:
+        if not self.starts:
+            return None
+        return self.numbers[max(bisect_right(self.starts, offset) - 1, 0)]
+
+    def page_range(self, start: int, end: int) -> Tuple[Optional[int], Optional[int]]:
+        return self.page_at(start), self.page_at(max(end - 1, start))
 
 def extract_dialogues(block: str):
     dialogues = []
@@ -84,20 +204,12 @@ def extract_dialogues(block: str):
             i += 2
         else:
             # диалог с тире
-            m = re.match(r"^([A-ZА-ЯЁ][A-ZА-ЯЁ]+)\s*[:\-—]\s*(.+)$", line)
+            m = DASH_DIALOGUE_RE.match(line)
             if m:
                 dialogues.append({"character": m.group(1), "text": m.group(2)})
             i += 1
     return dialogues
 
 def is_upper_name(s: str) -> bool:
-    s2 = re.sub(r"[^A-ZА-ЯЁ]", "", s)
-    return len(s2) > 1 and s2 == s2.upper() and len(s.split()) <= 4
-
-def page_range_for_span(page_spans, start, end):
-    pages = set()
-    for pidx, pstart, pend in page_spans:
-        if pend < start: continue
-        if pstart > end: break
-        pages.add(pidx + 1)
-    return sorted(list(pages))
+    # не длиннее 4 слов и хотя бы две заглавные буквы; длину проверяем первой — она дешевле
+    return len(s.split()) <= 4 and TWO_UPPER_RE.search(s) is not None
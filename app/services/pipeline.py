@@ -0,0 +1,181 @@
+import os
+import itertools
+from typing import Any, Callable, Dict, List, Optional
+
+from app.services import parser, detector, aggregate, cache, drafts
+from app.services.store import Store
+from app.services.episodes import EpisodeTable
+from app.models.schemas import Scene
+from app.utils.io import ensure_dirs
+from app.utils.checksum import file_checksum
+from app.utils import metrics
+from app.settings import settings
+
+DATA_DIR = "data"
+UPLOADS = os.path.join(DATA_DIR, "uploads")
+ANALYSES = os.path.join(DATA_DIR, "analyses")
+REPORTS = os.path.join(DATA_DIR, "reports")
+CACHE = os.path.join(DATA_DIR, "cache")
+JOBS = os.path.join(DATA_DIR, "jobs")
+PROFILES = os.path.join(DATA_DIR, "profiles")
+ensure_dirs([UPLOADS, ANALYSES, REPORTS, CACHE, JOBS])
+STORE = Store(os.path.join(DATA_DIR, "store.sqlite3"))
+SCENE_CACHE = cache.SceneCache(os.path.join(CACHE, "scenes.sqlite3"), settings.scene_cache_max_entries) \
+    if settings.scene_cache_enabled else None
+
+def _collect_metrics() -> List[str]:
+    if SCENE_CACHE is None:
+        return []
+    return ["# HELP rating_scene_cache_lookups_total Scene cache lookups by result",
+            "# TYPE rating_scene_cache_lookups_total counter",
+            f'rating_scene_cache_lookups_total{{result="hit"}} {SCENE_CACHE.hits}',
+            f'rating_scene_cache_lookups_total{{result="miss"}} {SCENE_CACHE.misses}']
+
+metrics.REGISTRY.collectors.append(_collect_metrics)
+
+# progress(stage, data) — колбэк прогресса; вызывается из потока, где идёт анализ
+Progress = Callable[[str, Dict[str, Any]], None]
+
+def _noop(stage: str, data: Dict[str, Any]):
+    pass
+
+def find_upload(file_id: str) -> Optional[str]:
+    row = STORE.get_upload(file_id)
+    return row["path"] if row and os.path.exists(row["path"]) else None
+
+def migrate():
+    # Данные, сохранённые до появления индексированного хранилища
+    STORE.migrate_uploads(UPLOADS, file_checksum)
+    STORE.migrate_json(ANALYSES)
+
+def run_analysis(file_id: str, upload: str, progress: Optional[Progress] = None) -> aggregate.Analysis:
+    # parse → segment → detect → aggregate → persist
+    progress = progress or _noop
+    timings = metrics.Timings("analyze")
+    if is_draft(file_id):
+        # выравнивание с прежней версией сценария требует всех сцен сразу
+        scenes = parse_upload(upload, progress, timings)
+        analysis = analyze_scenes(file_id, upload, scenes, progress, timings)
+    else:
+        analysis = stream_analysis(file_id, upload, progress, timings)
+    analysis.timings["analyze"] = timings.to_dict()
+    STORE.record_timings(file_id, "analyze", analysis.timings["analyze"])
+    return analysis
+
+def stream_analysis(file_id: str, upload: str, progress: Optional[Progress] = None,
+                    timings: Optional[metrics.Timings] = None) -> aggregate.Analysis:
+    # Документ потоком: страницы -> сцены (parser.SceneStream) -> детекция, сводка и запись
+    # окнами по stream_window_scenes. В памяти — окно сцен и счётчики сводки, а не весь
+    # документ; возвращается Analysis без сцен и эпизодов — они уже в хранилище
+    progress = progress or _noop
+    timings = timings or metrics.Timings("analyze")
+    # без общего кеша сцен прежние находки берём из файлового кеша этой загрузки
+    prior_state = cache.load_cache(CACHE, file_id) if SCENE_CACHE is None else None
+    scenes = iter(parser.SceneStream(upload, on_page=lambda n: progress("parse", {"pages": n})))
+    state = aggregate.SummaryState()
+    window = max(1, settings.stream_window_scenes)
+    writer = cache.CacheWriter(CACHE, file_id)
+    progress("parse", {"pages": 0})
+    try:
+        with STORE.stage(file_id) as staged:
+            while True:
+                with timings.stage("parse"):
+                    chunk = list(itertools.islice(scenes, window))
+                if not chunk:
+                    break
+                with timings.stage("detect"):
+                    hits_by_scene = detector.process_scenes(chunk, prior_state=prior_state, scene_cache=SCENE_CACHE)
+                with timings.stage("aggregate"):
+                    table = EpisodeTable.from_hits(hits_by_scene)
+                    state.add_table(table)
+                    state.total_scenes += len(chunk)
+                with timings.stage("persist"):
+                    staged.add(chunk, table)
+                    writer.add(hits_by_scene, detector.scene_checksums(chunk))
+                timings.count("episodes", len(table))
+                progress("detect", {"done": state.total_scenes})
+            timings.count("scenes", state.total_scenes)
+            progress("persist", {})
+            with timings.stage("persist"):
+                analysis = aggregate.Analysis(file_id, os.path.basename(upload), file_checksum(upload), [],
+                                              EpisodeTable(), state.summary(), rules_state=rules_state())
+                timings.count("bytes_written", writer.close())
+                staged.commit(analysis, state.to_dict())
+    except BaseException:
+        writer.abort()
+        raise
+    return analysis
+
+def parse_upload(upload: str, progress: Optional[Progress] = None,
+                 timings: Optional[metrics.Timings] = None) -> List[Scene]:
+    # Парсинг и сегментация
+    progress = progress or _noop
+    timings = timings or metrics.Timings("analyze")
+    progress("parse", {"pages": 0})
+    with timings.stage("parse"):
+        doc = parser.load_document(upload, on_page=lambda n: progress("parse", {"pages": n}))
+    with timings.stage("segment"):
+        scenes = parser.segment_scenes(doc)
+    timings.count("scenes", len(scenes))
+    progress("segment", {"scenes": len(scenes)})
+    return scenes
+
+def is_draft(file_id: str) -> bool:
+    # первая обработка загрузки, связанной с предыдущей версией сценария
+    return STORE.previous_version(file_id) is not None and not STORE.has_analysis(file_id)
+
+def load_draft(file_id: str, scenes: List[Scene]) -> Optional[drafts.Draft]:
+    # Первая обработка черновика: выравнивание сцен с предыдущей версией
+    if not is_draft(file_id):
+        return None
+    previous = STORE.load_analysis(STORE.previous_version(file_id))
+    if previous is None:
+        return None
+    return drafts.Draft(previous, drafts.align_scenes(previous.scenes, scenes, settings.draft_match_threshold))
+
+def rules_state() -> Dict[str, Any]:
+    # С какими правилами получен анализ: app.rerate переоценит только устаревшее
+    return {"categories": detector.COMPILED_RULES.category_fingerprints, "age_map": aggregate.AGE_MAP_FINGERPRINT}
+
+def analyze_scenes(file_id: str, upload: str, scenes: List[Scene], progress: Optional[Progress] = None,
+                   timings: Optional[metrics.Timings] = None) -> aggregate.Analysis:
+    progress = progress or _noop
+    timings = timings or metrics.Timings("analyze")
+    # Инкрементальная обработка по checksum сцен; пачками — чтобы отдавать прогресс
+    prior_state = cache.load_cache(CACHE, file_id)
+    with timings.stage("align"):
+        draft = load_draft(file_id, scenes)
+    if draft is not None:
+        # неизменённые сцены прежней версии не детектируем заново
+        prior_state = {**drafts.prior_state(draft.alignment, cache.load_cache(CACHE, draft.previous.file_id)),
+                       **(prior_state or {})}
+        timings.count("draft_same_scenes", sum(m.status == drafts.SAME for m in draft.alignment.matches.values()))
+    hits_by_scene: Dict[str, List[detector.Hit]] = {}
+    step = max(1, settings.job_progress_scenes)
+    progress("detect", {"done": 0, "total": len(scenes)})
+    with timings.stage("detect"):
+        for i in range(0, len(scenes), step):
+            chunk = scenes[i:i+step]
+            hits_by_scene.update(detector.process_scenes(chunk, prior_state=prior_state, scene_cache=SCENE_CACHE))
+            progress("detect", {"done": i + len(chunk), "total": len(scenes)})
+
+    # Агрегация
+    progress("aggregate", {})
+    with timings.stage("aggregate"):
+        analysis = aggregate.build_analysis(file_id, upload, scenes, hits_by_scene)
+        analysis.rules_state = rules_state()
+        aggregate.apply_manual_adjustments(analysis)  # если были FP/FN/редакции
+        if draft is not None:
+            fp, manual = drafts.carry_decisions(analysis.episodes, draft)
+            timings.count("draft_carried_fp", fp)
+            timings.count("draft_carried_manual", manual)
+        state = aggregate.compute_summary_and_rating(analysis)  # финальные метрики и рейтинг
+    timings.count("episodes", len(analysis.episodes))
+
+    # Сохранение результатов и кеш
+    progress("persist", {})
+    with timings.stage("persist"):
+        written = cache.save_cache(CACHE, file_id, hits_by_scene, detector.scene_checksums(scenes))
+        timings.count("bytes_written", written)
+        STORE.save_analysis(analysis, state.to_dict())
+    return analysis
@@ -1,28 +1,136 @@
 import os
-from typing import Any
-from fastapi.templating import Jinja2Templates
-from weasyprint import HTML
+import glob
+import hashlib
+import functools
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, Optional
+from jinja2 import Environment, FileSystemLoader, select_autoescape
 from app.models.schemas import AnalysisResult
-from fastapi import Request
+from app.services.pipeline import STORE, REPORTS, PROFILES
+from app.utils import metrics
+from app.settings import settings
 
-TEMPLATES = Jinja2Templates(directory="app/templates")
+TEMPLATE_DIR = "app/templates"
+# шаблон компилируется один раз на процесс; auto_reload не дёргает stat файла на каждый рендер
+ENV = Environment(loader=FileSystemLoader(TEMPLATE_DIR), autoescape=select_autoescape(), auto_reload=False)
+with open(os.path.join(TEMPLATE_DIR, "report.html"), "rb") as _f:
+    TEMPLATE_VERSION = hashlib.sha256(_f.read()).hexdigest()[:8]
+
+# Артефакты отчёта: data/reports/{file_id}-r{revision}-{hash}.{html,pdf}. hash — от checksum
+# загрузки и версии шаблона; любая правка анализа меняет revision, и прежний файл больше не
+# подходит. Ключ артефакта — он же ETag ответа.
+
+def artifact_key(file_id: str, revision: int, checksum: str) -> str:
+    h = hashlib.sha256(f"{checksum}|{TEMPLATE_VERSION}".encode()).hexdigest()[:8]
+    return f"{file_id}-r{revision}-{h}"
+
+def current_key(file_id: str) -> Optional[str]:
+    head = STORE.head(file_id)
+    return artifact_key(file_id, head["revision"], head["checksum"]) if head else None
+
+def artifact_path(key: str, ext: str) -> str:
+    return os.path.join(REPORTS, f"{key}.{ext}")
+
+def _publish(tmp: str, path: str, file_id: str, ext: str):
+    # атомарная замена и уборка артефактов прежних ревизий этого анализа
+    os.replace(tmp, path)
+    for old in glob.glob(os.path.join(REPORTS, f"{glob.escape(file_id)}-r*.{ext}")):
+        if old != path:
+            try:
+                os.remove(old)
+            except OSError:
+                pass
 
 def render_html(analysis: AnalysisResult) -> str:
-    # Рендерим Jinja2 вручную через TemplateResponse альтернативой: используем шаблон report.html
-    from jinja2 import Environment, FileSystemLoader, select_autoescape
-    env = Environment(
-        loader=FileSystemLoader("app/templates"),
-        autoescape=select_autoescape()
-    )
-    tpl = env.get_template("report.html")
-    html = tpl.render(analysis=analysis)
-    out_path = os.path.join("data", "reports", f"{analysis.file_id}.html")
-    with open(out_path, "w", encoding="utf-8") as f:
+    key = artifact_key(analysis.file_id, analysis.revision, analysis.checksum)
+    out_path = artifact_path(key, "html")
+    if os.path.exists(out_path):
+        return out_path
+    html = ENV.get_template("report.html").render(analysis=analysis)
+    tmp = f"{out_path}.{threading.get_ident()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
         f.write(html)
+    _publish(tmp, out_path, analysis.file_id, "html")
     return out_path
 
 def render_pdf(analysis: AnalysisResult) -> str:
+    key = artifact_key(analysis.file_id, analysis.revision, analysis.checksum)
+    pdf_path = artifact_path(key, "pdf")
+    if os.path.exists(pdf_path):
+        return pdf_path
     html_path = render_html(analysis)
-    pdf_path = os.path.join("data", "reports", f"{analysis.file_id}.pdf")
-    HTML(html_path, encoding="utf-8").write_pdf(pdf_path)
+    from weasyprint import HTML  # тяжёлый импорт (pango/cairo) — только когда нужен PDF
+    tmp = f"{pdf_path}.{threading.get_ident()}.tmp"
+    HTML(html_path, encoding="utf-8").write_pdf(tmp)
+    _publish(tmp, pdf_path, analysis.file_id, "pdf")
     return pdf_path
+
+# --- PDF в фоне ------------------------------------------------------------
+# WeasyPrint — секунды на большой сценарий. Рендер идёт в отдельном исполнителе, один на
+# ключ артефакта: параллельные запросы одного отчёта ждут общий Future. Результат — ключ
+# отрендеренного артефакта (ревизия могла смениться между запросом и рендером).
+
+PDF_RENDERS = metrics.REGISTRY.counter("rating_report_pdf_renders_total",
+                                       "Background PDF report renders by result", ["result"])
+_EXECUTOR = ThreadPoolExecutor(max_workers=max(1, settings.report_pdf_workers), thread_name_prefix="report")
+_PENDING: Dict[str, Future] = {}
+_LOCK = threading.Lock()
+
+def submit_pdf(file_id: str, profile: Optional[str] = None) -> Optional[Future]:
+    # -> Future[ключ]; None — анализа нет. profile — имя профиля рендера (data/profiles)
+    key = current_key(file_id)
+    if key is None:
+        return None
+    with _LOCK:
+        fut = _PENDING.get(key)
+        if fut is not None:
+            return fut
+        fut = Future()
+        if os.path.exists(artifact_path(key, "pdf")):
+            fut.set_result(key)
+            return fut
+        _PENDING[key] = fut
+    _EXECUTOR.submit(_render_pdf_job, file_id, key, fut, profile)
+    return fut
+
+def _render_pdf_job(file_id: str, key: str, fut: Future, profile: Optional[str]):
+    try:
+        timings = metrics.Timings("report_pdf")
+        with metrics.profiled(profile is not None, PROFILES, profile or ""):
+            with timings.stage("load"):
+                analysis = STORE.load_analysis(file_id)
+            if analysis is None:
+                raise FileNotFoundError(file_id)
+            with timings.stage("render_pdf"):
+                pdf_path = render_pdf(analysis)
+        timings.count("bytes_written", os.path.getsize(pdf_path))
+        STORE.record_timings(file_id, "report_pdf", timings.to_dict())
+        PDF_RENDERS.inc(result="ok")
+        fut.set_result(os.path.splitext(os.path.basename(pdf_path))[0])
+    except BaseException as ex:  # ошибка (нет WeasyPrint и т.п.) уходит ждущим запросам
+        PDF_RENDERS.inc(result="error")
+        fut.set_exception(ex)
+    finally:
+        with _LOCK:
+            _PENDING.pop(key, None)
+
+@functools.lru_cache(maxsize=None)
+def pdf_available() -> bool:
+    # WeasyPrint требует системных pango/cairo
+    try:
+        import weasyprint  # noqa: F401
+    except (ImportError, OSError):
+        return False
+    return True
+
+def prerender_pdf(file_id: str):
+    # После анализа: PDF готовится заранее, первый запрос отчёта отдаёт файл сразу.
+    # Вызывается из event loop — проверка и постановка в очередь уходят в исполнитель.
+    # Ошибка здесь никому не отдаётся — запрос отчёта повторит рендер и получит её сам
+    if settings.report_prerender_pdf:
+        _EXECUTOR.submit(_prerender, file_id)
+
+def _prerender(file_id: str):
+    if pdf_available():
+        submit_pdf(file_id)
@@ -0,0 +1,296 @@
+import re
+import json
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Any, Optional, Set, Tuple
+import regex
+from app.utils.literals import LiteralScanner, required_literal, pattern_risks
+from app.utils.checksum import text_checksum
+
+# Компиляция config/rules.yaml: один раз при загрузке превращаем сырые строки
+# правил в предкомпилированные регэкспы и объединённые матчеры по категориям.
+
+SEVERITY_LEVELS = ["severe", "moderate", "mild"]  # порядок обхода, как в исходном движке
+FLAGS = re.IGNORECASE
+# рискованные паттерны (вложенные квантификаторы, несколько .*) исполняет пакет regex:
+# он умеет прерывать поиск по таймауту, а re — нет
+GUARDED_FLAGS = regex.IGNORECASE | regex.VERSION0
+
+# Версия формата результатов движка (смещения, rule_id) — входит в fingerprint, чтобы
+# кеш сцен и возобновляемые прогоны CLI не отдавали результаты прежнего формата
+ENGINE_VERSION = 3
+# обратные ссылки нельзя переносить в общую альтернативу — нумерация групп съедет
+BACKREF_RE = re.compile(r"\\[1-9]|\(\?P=")
+
+def _build_case_fold() -> Dict[int, str]:
+    # Строчные символы, которые IGNORECASE считает равными другим строчным (ᲃ ~ с, ſ ~ s),
+    # сводим к одному представителю. На таком тексте регистрозависимый поиск по строчным
+    # паттернам находит те же позиции, что и re.IGNORECASE по исходному строчному тексту.
+    try:
+        from re import _casefix
+    except ImportError:
+        return {}
+    table: Dict[int, str] = {}
+    for k, others in _casefix._EXTRA_CASES.items():
+        group = [c for c in (k, *others) if chr(c).lower() == chr(c)]
+        canon = min(group)
+        for c in group:
+            if c != canon:
+                table[c] = chr(canon)
+    return table
+
+CASE_FOLD = _build_case_fold()
+# такие символы в сценариях почти не встречаются — str.translate по всему тексту дороже поиска
+FOLD_RE = re.compile("[" + "".join(re.escape(chr(c)) for c in CASE_FOLD) + "]") if CASE_FOLD else None
+
+def fold_case(hay: str) -> str:
+    if FOLD_RE is None or not FOLD_RE.search(hay):
+        return hay
+    return FOLD_RE.sub(lambda m: CASE_FOLD[ord(m.group())], hay)
+
+@dataclass
+class CompiledRule:
+    category: str
+    level: str  # severe/moderate/mild — как в rules.yaml
+    severity: str  # Severe/Moderate/Mild — как в Episode
+    pattern: str
+    regex: Any  # re.Pattern; regex.Pattern для guarded
+    literal: Optional[str] = None  # обязательная подстрока — правило запускается, только если она встретилась
+    guarded: bool = False  # исполняется с таймаутом (см. pattern_risks)
+
+    @property
+    def key(self) -> str:
+        # rule_id эпизода и ключ учёта в RuleStats
+        return f"{self.category}:{self.level}:{self.pattern}"
+
+@dataclass
+class CompiledCategory:
+    name: str
+    rules: List[CompiledRule]
+    matcher: Optional[re.Pattern]  # регистрозависимая альтернатива правил без литерала (по fold_case)
+    combined: List[int]  # индексы правил, вошедших в matcher
+    gated: List[int]  # индексы правил с литералом — проверяются после префильтра
+    standalone: List[int]  # индексы правил, которые сканируются отдельно
+    boosters: List[Tuple[str, List[Any]]] = field(default_factory=list)
+    anti_fp: List[Any] = field(default_factory=list)
+
+@dataclass
+class CompiledRules:
+    raw: Dict[str, Any]
+    categories: List[CompiledCategory]
+    literals: LiteralScanner  # общий префильтр по литералам всех правил
+    fingerprint: str = ""  # версия правил детекции — часть ключей кеша сцен
+    # версия правил каждой категории: по ним переоценка (app.rerate) находит изменившиеся категории
+    category_fingerprints: Dict[str, str] = field(default_factory=dict)
+
+    def scan_literals(self, folded: str) -> Set[str]:
+        return self.literals.scan(folded)
+
+def is_combinable(pattern: str, regex: re.Pattern) -> bool:
+    # В общий матчер идут только строчные паттерны без обратных ссылок и пустых совпадений:
+    # он ищется без IGNORECASE (иначе sre не использует префиксный поиск по первым символам
+    # и альтернатива оказывается медленнее отдельных finditer).
+    if BACKREF_RE.search(pattern) or regex.search("") is not None:
+        return False
+    return bool(CASE_FOLD) and pattern == pattern.lower() and fold_case(pattern) == pattern
+
+def compile_pattern(pattern: str) -> Tuple[Any, bool]:
+    # -> (скомпилированный паттерн, guarded)
+    if pattern_risks(pattern, FLAGS):
+        return regex.compile(pattern, GUARDED_FLAGS), True
+    return re.compile(pattern, FLAGS), False
+
+def combine_patterns(patterns: List[str]) -> List[Any]:
+    # Объединяет паттерны в одну альтернативу для проверки «есть ли хоть одно совпадение»;
+    # рискованные остаются отдельными guarded-паттернами
+    guarded = [regex.compile(p, GUARDED_FLAGS) for p in patterns if pattern_risks(p, FLAGS)]
+    patterns = [p for p in patterns if not pattern_risks(p, FLAGS)]
+    compiled = [re.compile(p, FLAGS) for p in patterns]
+    joint = [p for p in patterns if not BACKREF_RE.search(p)]
+    if len(joint) > 1:
+        try:
+            alone = [r for p, r in zip(patterns, compiled) if BACKREF_RE.search(p)]
+            return [re.compile("|".join(f"(?:{p})" for p in joint), FLAGS)] + alone + guarded
+        except re.error:
+            pass
+    return compiled + guarded
+
+def compile_category(name: str, cfg: Dict[str, Any]) -> CompiledCategory:
+    rules: List[CompiledRule] = []
+    for level in SEVERITY_LEVELS:
+        for p in (cfg.get("patterns") or {}).get(level) or []:
+            compiled, guarded = compile_pattern(p)
+            # литерал ищется регистрозависимо, поэтому только для тех же «строчных» паттернов
+            literal = required_literal(p, FLAGS) if not guarded and is_combinable(p, compiled) else None
+            rules.append(CompiledRule(
+                category=name, level=level, severity=level.capitalize(),
+                pattern=p, regex=compiled, literal=literal, guarded=guarded
+            ))
+
+    gated = [i for i, r in enumerate(rules) if r.literal]
+    combined = [i for i, r in enumerate(rules)
+                if not r.literal and not r.guarded and is_combinable(r.pattern, r.regex)]
+    matcher = None
+    if combined:
+        try:
+            # группы без захвата: именованные группы тоже отключают префиксную оптимизацию sre,
+            # поэтому правило по позиции восстанавливаем якорным match каждого кандидата
+            matcher = re.compile("|".join(f"(?:{rules[i].pattern})" for i in combined))
+        except re.error:
+            combined = []  # например, inline-флаги в середине паттерна — сканируем по одному
+    standalone = [i for i in range(len(rules)) if i not in combined and i not in gated]
+
+    boosters = []
+    for bsev, pats in (cfg.get("boosters") or {}).items():
+        if pats:
+            boosters.append((bsev.capitalize(), combine_patterns(pats)))
+    anti_fp = combine_patterns(cfg.get("anti_fp") or [])
+    return CompiledCategory(name=name, rules=rules, matcher=matcher, combined=combined, gated=gated,
+                            standalone=standalone, boosters=boosters, anti_fp=anti_fp)
+
+def rules_fingerprint(rules: Dict[str, Any]) -> str:
+    # Только categories влияют на детекцию; recommendations и т.п. версию не меняют
+    canon = json.dumps(rules.get("categories") or {}, sort_keys=True, ensure_ascii=False)
+    return text_checksum(f"{ENGINE_VERSION}\n{canon}")[:16]
+
+def category_fingerprints(rules: Dict[str, Any]) -> Dict[str, str]:
+    return {name: text_checksum(f"{ENGINE_VERSION}\n{json.dumps(cfg or {}, sort_keys=True, ensure_ascii=False)}")[:16]
+            for name, cfg in (rules.get("categories") or {}).items()}
+
+def compile_rules(rules: Dict[str, Any]) -> CompiledRules:
+    categories = [compile_category(name, cfg or {}) for name, cfg in (rules.get("categories") or {}).items()]
+    literals = LiteralScanner(r.literal for c in categories for r in c.rules if r.literal)
+    return CompiledRules(raw=rules, categories=categories, literals=literals,
+                         fingerprint=rules_fingerprint(rules), category_fingerprints=category_fingerprints(rules))
+
+def subset_rules(rules: CompiledRules, names: Iterable[str]) -> CompiledRules:
+    # Только указанные категории, без перекомпиляции — детекция лишь по изменившимся правилам
+    names = set(names)
+    categories = [c for c in rules.categories if c.name in names]
+    raw = {**rules.raw, "categories": {k: v for k, v in (rules.raw.get("categories") or {}).items() if k in names}}
+    return CompiledRules(raw=raw, categories=categories,
+                         literals=LiteralScanner(r.literal for c in categories for r in c.rules if r.literal),
+                         fingerprint=rules_fingerprint(raw),
+                         category_fingerprints={k: v for k, v in rules.category_fingerprints.items() if k in names})
+
+class RuleStats:
+    # Учёт по правилам за прогон: время, совпадения, вызовы, таймауты. Ключ — CompiledRule.key;
+    # время объединённого матчера категории — под ключом "{категория}:*".
+
+    def __init__(self):
+        self.seconds: Counter = Counter()
+        self.matches: Counter = Counter()
+        self.calls: Counter = Counter()
+        self.timeouts: Counter = Counter()
+
+    def add(self, key: str, seconds: float, matches: int = 0):
+        self.seconds[key] += seconds
+        self.matches[key] += matches
+        self.calls[key] += 1
+
+    def merge(self, data: Dict[str, Dict[str, float]]):
+        for name in ("seconds", "matches", "calls", "timeouts"):
+            getattr(self, name).update(data.get(name) or {})
+
+    def to_dict(self) -> Dict[str, Dict[str, float]]:
+        return {"seconds": dict(self.seconds), "matches": dict(self.matches),
+                "calls": dict(self.calls), "timeouts": dict(self.timeouts)}
+
+    def top(self, n: int = 20) -> List[Tuple[str, float, int, int]]:
+        # -> [(ключ, секунды, совпадения, таймауты)] по убыванию времени
+        return [(k, t, self.matches[k], self.timeouts[k]) for k, t in self.seconds.most_common(n)]
+
+def _finditer(rule: CompiledRule, hay: str, timeout: Optional[float],
+              timeouts: Optional[List[str]]) -> List[Tuple[int, int]]:
+    if not rule.guarded:
+        return [m.span() for m in rule.regex.finditer(hay)]
+    try:
+        return [m.span() for m in rule.regex.finditer(hay, timeout=timeout)]
+    except TimeoutError:
+        # правило пропускаем целиком (частичный результат недетерминирован) и сообщаем
+        if timeouts is not None:
+            timeouts.append(rule.key)
+        return []
+
+def scan_category(cat: CompiledCategory, hay: str, folded: Optional[str] = None,
+                  seen: Optional[Set[str]] = None, timeout: Optional[float] = None,
+                  timeouts: Optional[List[str]] = None,
+                  stats: Optional[RuleStats] = None) -> List[List[Tuple[int, int]]]:
+    # Возвращает спаны совпадений для каждого правила категории — ровно те же,
+    # что дал бы re.finditer по каждому правилу отдельно. hay должен быть в нижнем
+    # регистре (normalize_text); folded = fold_case(hay) и seen = литералы, найденные
+    # CompiledRules.scan_literals(folded), считаются один раз на haystack.
+    # timeout — бюджет guarded-правила на haystack, сработавшие ключи — в timeouts.
+    if stats is not None:
+        return _scan_category_stats(cat, hay, folded, seen, timeout, timeouts, stats)
+    spans: List[List[Tuple[int, int]]] = [[] for _ in cat.rules]
+    for i in cat.gated:
+        if seen is None or cat.rules[i].literal in seen:
+            spans[i] = [m.span() for m in cat.rules[i].regex.finditer(hay)]
+    if cat.matcher is not None:
+        if folded is None:
+            folded = fold_case(hay)
+        next_pos = [0] * len(cat.rules)
+        m = cat.matcher.search(folded)
+        # объединённый матчер останавливается на каждой позиции, где совпадает хотя бы одно
+        # правило; на ней проверяем правила, чей finditer уже дошёл до этой позиции
+        while m:
+            p = m.start()
+            for i in cat.combined:
+                if next_pos[i] > p:
+                    continue
+                rm = cat.rules[i].regex.match(hay, p)
+                if rm:
+                    spans[i].append(rm.span())
+                    next_pos[i] = rm.end()
+            m = cat.matcher.search(folded, p + 1)
+    for i in cat.standalone:
+        spans[i] = _finditer(cat.rules[i], hay, timeout, timeouts)
+    return spans
+
+def _scan_category_stats(cat: CompiledCategory, hay: str, folded: Optional[str], seen: Optional[Set[str]],
+                         timeout: Optional[float], timeouts: Optional[List[str]],
+                         stats: RuleStats) -> List[List[Tuple[int, int]]]:
+    # Тот же результат, что у scan_category, но с замером каждого правила; объединённый
+    # матчер мерится целиком. Медленнее — только для учёта (CLI --rule-stats)
+    spans: List[List[Tuple[int, int]]] = [[] for _ in cat.rules]
+    combined = CompiledCategory(cat.name, cat.rules, cat.matcher, cat.combined, [], [])
+    t0 = time.perf_counter()
+    joint = scan_category(combined, hay, folded)
+    stats.add(f"{cat.name}:*", time.perf_counter() - t0)
+    for i in cat.combined:
+        spans[i] = joint[i]
+        stats.matches[cat.rules[i].key] += len(joint[i])
+    for i in cat.gated:
+        if seen is None or cat.rules[i].literal in seen:
+            t0 = time.perf_counter()
+            spans[i] = [m.span() for m in cat.rules[i].regex.finditer(hay)]
+            stats.add(cat.rules[i].key, time.perf_counter() - t0, len(spans[i]))
+    for i in cat.standalone:
+        t0 = time.perf_counter()
+        local: List[str] = []
+        spans[i] = _finditer(cat.rules[i], hay, timeout, local)
+        stats.add(cat.rules[i].key, time.perf_counter() - t0, len(spans[i]))
+        stats.timeouts.update(local)
+        if timeouts is not None:
+            timeouts.extend(local)
+    return spans
+
+def any_match(regexes: List[Any], *hays: str, timeout: Optional[float] = None,
+              timeouts: Optional[List[str]] = None, key: str = "") -> bool:
+    # key — "{категория}:{раздел}" (anti_fp, booster_severe...): в timeouts уходит
+    # "{key}:{паттерн}", в том же виде, что CompiledRule.key у правил
+    for r in regexes:
+        for h in hays:
+            if not isinstance(r, regex.Pattern):
+                if r.search(h):
+                    return True
+                continue
+            try:
+                if r.search(h, timeout=timeout):
+                    return True
+            except TimeoutError:
+                if timeouts is not None:
+                    timeouts.append(f"{key}:{r.pattern}")
+    return False
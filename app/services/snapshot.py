@@ -0,0 +1,113 @@
+import os
+import sys
+import glob
+import pickle
+import hashlib
+import functools
+from typing import Any, Dict, NamedTuple
+
+import regex
+
+from app.services import rules as rules_module
+from app.services.rules import CompiledRules, ENGINE_VERSION, compile_rules
+from app.utils import literals
+from app.utils.io import read_yaml
+
+# Снимок конфигурации детекции: проверенный и скомпилированный rules.yaml (CompiledRules:
+# разбор литералов, анализ рисков, сборка объединённых матчеров) и age_mapping.yaml.
+# Лежит pickle-файлом в data/cache; ключ — хеш содержимого обоих YAML, исходников модулей,
+# которые строят CompiledRules, ENGINE_VERSION и версий Python/regex, так что правка конфигов
+# или кода компиляции сама его инвалидирует. Воркеры uvicorn и дочерние процессы пула берут
+# готовый снимок вместо разбора YAML и компиляции.
+
+RULES_PATH = "config/rules.yaml"
+AGE_MAPPING_PATH = "config/age_mapping.yaml"
+SNAPSHOT_DIR = os.path.join("data", "cache")
+
+LEVELS = ["severe", "moderate", "mild"]
+SEVERITIES = ["None", "Mild", "Moderate", "Severe"]
+
+def _patterns_by_level() -> Dict[str, Any]:
+    return {"type": "object", "propertyNames": {"enum": LEVELS},
+            "additionalProperties": {"type": ["array", "null"], "items": {"type": "string", "minLength": 1}}}
+
+RULES_SCHEMA = {
+    "type": "object",
+    "required": ["categories"],
+    "properties": {
+        "categories": {
+            "type": "object",
+            "additionalProperties": {
+                "type": ["object", "null"],
+                "properties": {
+                    "patterns": _patterns_by_level(),
+                    "boosters": _patterns_by_level(),
+                    "anti_fp": {"type": ["array", "null"], "items": {"type": "string", "minLength": 1}},
+                },
+            },
+        },
+    },
+}
+
+AGE_MAPPING_SCHEMA = {
+    "type": "object",
+    "required": ["default"],
+    "properties": {
+        "default": {"type": "object", "propertyNames": {"enum": SEVERITIES},
+                    "additionalProperties": {"type": "string"}},
+        "overrides": {"type": "object", "additionalProperties": {
+            "type": "object", "propertyNames": {"enum": SEVERITIES}, "additionalProperties": {"type": "string"}}},
+    },
+}
+
+class Snapshot(NamedTuple):
+    rules: CompiledRules  # rules.raw — исходный словарь rules.yaml
+    age_map: Dict[str, Any]
+
+# модули, по коду которых собирается и распаковывается снимок
+CODE_MODULES = (rules_module, literals, sys.modules[__name__])
+
+def snapshot_key(rules_path: str, age_path: str) -> str:
+    h = hashlib.sha256(f"{ENGINE_VERSION}|{sys.version}|{regex.__version__}".encode())
+    for path in [m.__file__ for m in CODE_MODULES] + [rules_path, age_path]:
+        with open(path, "rb") as f:
+            h.update(hashlib.sha256(f.read()).digest())
+    return h.hexdigest()[:16]
+
+def build(rules_path: str = RULES_PATH, age_path: str = AGE_MAPPING_PATH) -> Snapshot:
+    # Полная сборка: разбор YAML, проверка схем (ValueError с путём до ошибки), компиляция
+    import jsonschema
+    rules, age_map = read_yaml(rules_path), read_yaml(age_path)
+    for data, schema, path in ((rules, RULES_SCHEMA, rules_path), (age_map, AGE_MAPPING_SCHEMA, age_path)):
+        try:
+            jsonschema.validate(data, schema)
+        except jsonschema.ValidationError as ex:
+            where = "/".join(str(p) for p in ex.absolute_path) or "<корень>"
+            raise ValueError(f"{path}: {where}: {ex.message}") from None
+    return Snapshot(compile_rules(rules), age_map)
+
+@functools.lru_cache(maxsize=None)
+def load(rules_path: str = RULES_PATH, age_path: str = AGE_MAPPING_PATH,
+         directory: str = SNAPSHOT_DIR) -> Snapshot:
+    key = snapshot_key(rules_path, age_path)
+    path = os.path.join(directory, f"config-{key}.pickle")
+    try:
+        with open(path, "rb") as f:
+            snap = pickle.load(f)
+        if isinstance(snap, Snapshot):
+            return snap
+    except Exception:  # нет снимка, битый или от несовместимой версии кода — пересобираем
+        pass
+    snap = build(rules_path, age_path)
+    try:
+        os.makedirs(directory, exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            pickle.dump(snap, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+        for old in glob.glob(os.path.join(directory, "config-*.pickle")):
+            if old != path:
+                os.remove(old)
+    except OSError:
+        pass  # каталог только для чтения — работаем без снимка
+    return snap
@@ -0,0 +1,661 @@
+import os
+import json
+import time
+import glob
+import uuid
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
+
+from app.models.schemas import AnalysisResult, Scene, Episode, Summary
+from app.services import aggregate
+from app.services.episodes import COLUMNS, EpisodeTable
+from app.utils.db import connect, init_db, ensure_column
+
+# Индексированное хранилище загрузок и анализов (SQLite) вместо перезаписи целого
+# data/analyses/{id}.json на каждую правку. Каждая правка увеличивает revision анализа;
+# клиент может передать ожидаемую ревизию — при расхождении RevisionConflict (HTTP 409).
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS uploads (
+    file_id TEXT PRIMARY KEY,
+    filename TEXT NOT NULL,
+    path TEXT NOT NULL,
+    sha256 TEXT NOT NULL UNIQUE,
+    size INTEGER NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS upload_aliases (
+    file_id TEXT PRIMARY KEY,
+    canonical TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS analyses (
+    file_id TEXT PRIMARY KEY,
+    filename TEXT NOT NULL,
+    checksum TEXT NOT NULL,
+    revision INTEGER NOT NULL DEFAULT 1,
+    summary TEXT,
+    summary_state TEXT,
+    timings TEXT,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS scenes (
+    file_id TEXT NOT NULL,
+    id TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    text TEXT NOT NULL,
+    offset_start INTEGER NOT NULL,
+    offset_end INTEGER NOT NULL,
+    page_start INTEGER,
+    page_end INTEGER,
+    dialogues TEXT NOT NULL,
+    PRIMARY KEY (file_id, id)
+);
+CREATE TABLE IF NOT EXISTS episodes (
+    file_id TEXT NOT NULL,
+    id TEXT NOT NULL,
+    scene_id TEXT NOT NULL,
+    category TEXT NOT NULL,
+    severity TEXT NOT NULL,
+    rule_id TEXT NOT NULL,
+    start INTEGER NOT NULL,
+    "end" INTEGER NOT NULL,
+    quote TEXT NOT NULL,
+    reason TEXT NOT NULL,
+    is_manual INTEGER NOT NULL DEFAULT 0,
+    is_fp INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (file_id, id)
+);
+CREATE TABLE IF NOT EXISTS versions (
+    file_id TEXT PRIMARY KEY,
+    previous_file_id TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS staging (
+    key TEXT PRIMARY KEY,
+    file_id TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS postings (
+    term TEXT NOT NULL,
+    file_id TEXT NOT NULL,
+    n INTEGER NOT NULL,
+    scene_ids TEXT,
+    PRIMARY KEY (term, file_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS postings_file ON postings(file_id);
+CREATE INDEX IF NOT EXISTS episodes_scene ON episodes(file_id, scene_id);
+-- ключ индекса заканчивается rowid: страницы эпизодов (ORDER BY rowid) идут по индексу без сортировки
+CREATE INDEX IF NOT EXISTS episodes_file ON episodes(file_id);
+CREATE INDEX IF NOT EXISTS scenes_order ON scenes(file_id, idx);
+"""
+
+EPISODE_COLS = COLUMNS
+# без OR REPLACE: совпадение id эпизода должно падать, а не подменять чужую строку
+EPISODE_INSERT = ('INSERT INTO episodes (file_id, id, scene_id, category, severity, rule_id, '
+                  'start, "end", quote, reason, is_manual, is_fp) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)')
+SCENE_INSERT = ('INSERT OR REPLACE INTO scenes (file_id, id, idx, text, offset_start, offset_end, '
+                'page_start, page_end, dialogues) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)')
+
+# Обратный индекс по каталогу: термин -> анализы (postings). Термины по учитываемым (не FP)
+# эпизодам — rule:<rule_id>, category:<категория>, severity:<категория>:<строгость>; по сводке —
+# age:<рейтинг> и driver:<категория> (категории, дающие итоговый рейтинг). n — число эпизодов
+# (для driver — эпизодов категории), scene_ids — сцены через запятую. Обновляется в тех же
+# транзакциях, что и эпизоды/сводка, так что запросы не читают сами анализы.
+# Поля ответов JSON API чтения -> колонки; проекция идёт в SQL, ненужный текст сцен не читается
+SCENE_FIELDS = {"id": "id", "index": "idx", "text": "text", "offset_start": "offset_start",
+                "offset_end": "offset_end", "page_start": "page_start", "page_end": "page_end",
+                "dialogues": "dialogues"}
+EPISODE_FIELDS = {c: f'"{c}"' for c in COLUMNS}
+
+STAGING_TTL_SEC = 24 * 3600  # брошенные (процесс упал) промежуточные записи потокового анализа
+INDEX_VERSION = 1  # PRAGMA user_version; меньше — индекс строится заново при открытии
+EPISODE_TERMS = "(term LIKE 'rule:%' OR term LIKE 'category:%' OR term LIKE 'severity:%')"
+SUMMARY_TERMS = "(term LIKE 'age:%' OR term LIKE 'driver:%')"
+_EPISODE_SOURCE = ("episodes e LEFT JOIN scenes s ON s.file_id = e.file_id AND s.id = e.scene_id "
+                   "WHERE e.is_fp = 0 {where}")
+# scene_ids — в порядке сцен документа: group_concat идёт по упорядоченному подзапросу
+_EPISODE_POSTINGS = f"""
+INSERT INTO postings (term, file_id, n, scene_ids)
+SELECT term, file_id, COUNT(*), group_concat(DISTINCT scene_id) FROM (
+    SELECT 'rule:' || e.rule_id AS term, e.file_id, e.scene_id, s.idx FROM {_EPISODE_SOURCE}
+    UNION ALL SELECT 'category:' || e.category, e.file_id, e.scene_id, s.idx FROM {_EPISODE_SOURCE}
+    UNION ALL SELECT 'severity:' || e.category || ':' || e.severity, e.file_id, e.scene_id, s.idx
+        FROM {_EPISODE_SOURCE}
+    ORDER BY 1, 2, 4
+) GROUP BY term, file_id
+"""
+
+def _index_episodes(con, file_id: str):
+    con.execute(f"DELETE FROM postings WHERE file_id = ? AND {EPISODE_TERMS}", (file_id,))
+    con.execute(_EPISODE_POSTINGS.format(where="AND e.file_id = ?"), (file_id,) * 3)
+
+def _summary_terms(summary: Optional[Summary]) -> List[Tuple[str, int]]:
+    if summary is None:
+        return []
+    terms = [(f"age:{summary.age_rating}", 1)]
+    for c in summary.categories:
+        if c.overall_severity != "None" and \
+                aggregate.map_age_rating(c.category, c.overall_severity) == summary.age_rating:
+            terms.append((f"driver:{c.category}", c.count_episodes))
+    return terms
+
+def _index_summary(con, file_id: str, summary: Optional[Summary]):
+    con.execute(f"DELETE FROM postings WHERE file_id = ? AND {SUMMARY_TERMS}", (file_id,))
+    con.executemany("INSERT INTO postings (term, file_id, n) VALUES (?, ?, ?)",
+                    [(term, file_id, n) for term, n in _summary_terms(summary)])
+    con.execute("UPDATE analyses SET age_rating = ? WHERE file_id = ?",
+                (summary.age_rating if summary else None, file_id))
+
+class RevisionConflict(Exception):
+    def __init__(self, current: int):
+        super().__init__(f"revision conflict, current revision {current}")
+        self.current = current
+
+class NotFound(Exception):
+    pass
+
+def _episode_row(file_id: str, e: Episode) -> tuple:
+    return (file_id, e.id, e.scene_id, e.category, e.severity, e.rule_id, e.start, e.end,
+            e.quote, e.reason, int(e.is_manual), int(e.is_fp))
+
+def _table_rows(file_id: str, table: EpisodeTable) -> Iterator[tuple]:
+    # строки в порядке EPISODE_COLS прямо из столбцов, без pydantic
+    for row in table.rows():
+        yield (file_id, *row[:-2], int(row[-2]), int(row[-1]))
+
+def _scene_row(file_id: str, s: Scene) -> tuple:
+    return (file_id, s.id, s.index, s.text, s.offset_start, s.offset_end, s.page_start, s.page_end,
+            json.dumps(s.dialogues, ensure_ascii=False))
+
+def _episode(row) -> Episode:
+    return Episode(**{c: row[c] for c in EPISODE_COLS})
+
+def _scene(row) -> Scene:
+    return Scene(id=row["id"], index=row["idx"], text=row["text"],
+                 offset_start=row["offset_start"], offset_end=row["offset_end"],
+                 page_start=row["page_start"], page_end=row["page_end"],
+                 dialogues=json.loads(row["dialogues"]))
+
+def _projected(row, fields: List[str]) -> Dict[str, Any]:
+    out = {f: row[f] for f in fields}
+    if "dialogues" in out:
+        out["dialogues"] = json.loads(out["dialogues"])
+    for f in ("is_manual", "is_fp"):
+        if f in out:
+            out[f] = bool(out[f])
+    return out
+
+def _in(column: str, values: List[str]) -> Tuple[str, List[str]]:
+    return (f" AND {column} IN ({','.join('?' * len(values))})", values) if values else ("", [])
+
+class Edit:
+    # Транзакция правки одного анализа (внутри Store.edit)
+
+    def __init__(self, con, file_id: str, revision: int):
+        self.con = con
+        self.file_id = file_id
+        self.revision = revision
+        self.episodes_changed = False  # -> postings пересобираются при завершении правки
+
+    def episode(self, episode_id: str) -> Optional[Episode]:
+        row = self.con.execute("SELECT * FROM episodes WHERE file_id = ? AND id = ?",
+                               (self.file_id, episode_id)).fetchone()
+        return _episode(row) if row else None
+
+    def episodes(self) -> List[Episode]:
+        rows = self.con.execute("SELECT * FROM episodes WHERE file_id = ? ORDER BY rowid", (self.file_id,))
+        return [_episode(r) for r in rows]
+
+    def scene_episodes(self, scene_id: str) -> List[Episode]:
+        rows = self.con.execute("SELECT * FROM episodes WHERE file_id = ? AND scene_id = ? ORDER BY rowid",
+                                (self.file_id, scene_id))
+        return [_episode(r) for r in rows]
+
+    def scene_count(self) -> int:
+        return self.con.execute("SELECT COUNT(*) FROM scenes WHERE file_id = ?", (self.file_id,)).fetchone()[0]
+
+    def scene_text(self, scene_id: str) -> Optional[str]:
+        row = self.con.execute("SELECT text FROM scenes WHERE file_id = ? AND id = ?",
+                               (self.file_id, scene_id)).fetchone()
+        return row["text"] if row else None
+
+    def set_fp(self, episode_id: str, is_fp: bool = True) -> bool:
+        cur = self.con.execute("UPDATE episodes SET is_fp = ? WHERE file_id = ? AND id = ?",
+                               (int(is_fp), self.file_id, episode_id))
+        self.episodes_changed = True
+        return cur.rowcount > 0
+
+    def add_episode(self, episode: Episode):
+        self.con.execute(EPISODE_INSERT, _episode_row(self.file_id, episode))
+        self.episodes_changed = True
+
+    def update_scene_text(self, scene_id: str, text: str):
+        self.con.execute("UPDATE scenes SET text = ? WHERE file_id = ? AND id = ?", (text, self.file_id, scene_id))
+
+    def replace_scene_episodes(self, scene_id: str, episodes: EpisodeTable):
+        self.con.execute("DELETE FROM episodes WHERE file_id = ? AND scene_id = ?", (self.file_id, scene_id))
+        self.con.executemany(EPISODE_INSERT, _table_rows(self.file_id, episodes))
+        self.episodes_changed = True
+
+    def replace_detected(self, categories: Optional[Set[str]], table: EpisodeTable):
+        # Находки детектора указанных категорий (None — всех) -> table; ручные эпизоды остаются
+        if categories is None:
+            self.con.execute("DELETE FROM episodes WHERE file_id = ? AND is_manual = 0", (self.file_id,))
+        else:
+            self.con.executemany("DELETE FROM episodes WHERE file_id = ? AND is_manual = 0 AND category = ?",
+                                 [(self.file_id, c) for c in categories])
+        self.con.executemany(EPISODE_INSERT, _table_rows(self.file_id, table))
+        self.episodes_changed = True
+
+    def set_rules_state(self, state: Dict[str, Any]):
+        self.con.execute("UPDATE analyses SET rules_state = ? WHERE file_id = ?",
+                         (json.dumps(state, ensure_ascii=False), self.file_id))
+
+    def summary_state(self) -> Optional[Dict[str, Any]]:
+        row = self.con.execute("SELECT summary_state FROM analyses WHERE file_id = ?", (self.file_id,)).fetchone()
+        return json.loads(row["summary_state"]) if row["summary_state"] else None
+
+    def set_summary(self, summary: Optional[Summary], state: Optional[Dict[str, Any]] = None):
+        # state — счётчики aggregate.SummaryState; без них следующая правка пересоберёт их по эпизодам
+        self.con.execute("UPDATE analyses SET summary = ?, summary_state = ? WHERE file_id = ?",
+                         (summary.model_dump_json() if summary else None,
+                          json.dumps(state, ensure_ascii=False) if state else None, self.file_id))
+        _index_summary(self.con, self.file_id, summary)
+
+def _replace_head(con, analysis: "aggregate.Analysis", state: Optional[Dict[str, Any]]) -> int:
+    # Строка analyses для полной записи анализа; прежние сцены и эпизоды удаляются. -> ревизия
+    row = con.execute("SELECT revision FROM analyses WHERE file_id = ?", (analysis.file_id,)).fetchone()
+    revision = (row["revision"] + 1) if row else 1
+    con.execute("DELETE FROM scenes WHERE file_id = ?", (analysis.file_id,))
+    con.execute("DELETE FROM episodes WHERE file_id = ?", (analysis.file_id,))
+    con.execute(
+        "INSERT OR REPLACE INTO analyses (file_id, filename, checksum, revision, summary, summary_state, "
+        "rules_state, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        (analysis.file_id, analysis.filename, analysis.checksum, revision,
+         analysis.summary.model_dump_json() if analysis.summary else None,
+         json.dumps(state, ensure_ascii=False) if state else None,
+         json.dumps(analysis.rules_state, ensure_ascii=False) if analysis.rules_state else None,
+         time.time()))
+    return revision
+
+def _drop_staging(con, key: str):
+    con.execute("DELETE FROM scenes WHERE file_id = ?", (key,))
+    con.execute("DELETE FROM episodes WHERE file_id = ?", (key,))
+    con.execute("DELETE FROM staging WHERE key = ?", (key,))
+
+class Staged:
+    # Промежуточная запись потокового анализа (Store.stage)
+
+    def __init__(self, path: str, file_id: str, key: str):
+        self.path = path
+        self.file_id = file_id
+        self.key = key
+        self.committed = False
+
+    def add(self, scenes: List[Scene], episodes: EpisodeTable):
+        with connect(self.path) as con:
+            con.executemany(SCENE_INSERT, [_scene_row(self.key, s) for s in scenes])
+            con.executemany(EPISODE_INSERT, _table_rows(self.key, episodes))
+
+    def commit(self, analysis: "aggregate.Analysis", state: Optional[Dict[str, Any]] = None) -> int:
+        # analysis — без сцен и эпизодов (они уже записаны окнами): заголовок и сводка
+        with connect(self.path, immediate=True) as con:
+            revision = _replace_head(con, analysis, state)
+            con.execute("UPDATE scenes SET file_id = ? WHERE file_id = ?", (self.file_id, self.key))
+            con.execute("UPDATE episodes SET file_id = ? WHERE file_id = ?", (self.file_id, self.key))
+            con.execute("DELETE FROM staging WHERE key = ?", (self.key,))
+            _index_episodes(con, self.file_id)
+            _index_summary(con, self.file_id, analysis.summary)
+        self.committed = True
+        analysis.revision = revision
+        return revision
+
+class Store:
+    def __init__(self, path: str):
+        self.path = path
+        init_db(path, SCHEMA)
+        ensure_column(path, "analyses", "summary_state", "TEXT")
+        ensure_column(path, "analyses", "timings", "TEXT")
+        ensure_column(path, "analyses", "age_rating", "TEXT")
+        ensure_column(path, "analyses", "rules_state", "TEXT")
+        self._drop_stale_staging()
+        self._build_index()
+
+    def _drop_stale_staging(self):
+        with connect(self.path) as con:
+            for row in con.execute("SELECT key FROM staging WHERE created_at < ?",
+                                   (time.time() - STAGING_TTL_SEC,)).fetchall():
+                _drop_staging(con, row["key"])
+
+    def _build_index(self):
+        # Индекс по данным, сохранённым до его появления (или при смене INDEX_VERSION)
+        with connect(self.path, immediate=True) as con:
+            if con.execute("PRAGMA user_version").fetchone()[0] >= INDEX_VERSION:
+                return
+            con.execute("DELETE FROM postings")
+            con.execute(_EPISODE_POSTINGS.format(where=""))
+            for row in con.execute("SELECT file_id, summary FROM analyses").fetchall():
+                _index_summary(con, row["file_id"],
+                               Summary.model_validate_json(row["summary"]) if row["summary"] else None)
+            con.execute(f"PRAGMA user_version = {INDEX_VERSION}")
+
+    # --- загрузки ---------------------------------------------------------
+
+    def add_upload(self, file_id: str, filename: str, path: str, sha256: str, size: int) -> str:
+        # -> file_id; при совпадении sha256 — file_id уже сохранённой загрузки
+        with connect(self.path, immediate=True) as con:
+            row = con.execute("SELECT file_id FROM uploads WHERE sha256 = ?", (sha256,)).fetchone()
+            if row:
+                return row["file_id"]
+            con.execute("INSERT INTO uploads (file_id, filename, path, sha256, size, created_at) "
+                        "VALUES (?, ?, ?, ?, ?, ?)", (file_id, filename, path, sha256, size, time.time()))
+            return file_id
+
+    def upload_by_sha(self, sha256: str) -> Optional[Dict[str, Any]]:
+        with connect(self.path) as con:
+            row = con.execute("SELECT * FROM uploads WHERE sha256 = ?", (sha256,)).fetchone()
+        return dict(row) if row else None
+
+    def get_upload(self, file_id: str) -> Optional[Dict[str, Any]]:
+        # file_id старой загрузки-дубликата разрешается в загрузку с тем же содержимым
+        with connect(self.path) as con:
+            row = con.execute("SELECT * FROM uploads WHERE file_id = ?", (file_id,)).fetchone()
+            if row is None:
+                row = con.execute("SELECT u.* FROM upload_aliases a JOIN uploads u ON u.file_id = a.canonical "
+                                  "WHERE a.file_id = ?", (file_id,)).fetchone()
+        return dict(row) if row else None
+
+    def remove_upload(self, file_id: str):
+        with connect(self.path) as con:
+            con.execute("DELETE FROM uploads WHERE file_id = ?", (file_id,))
+            con.execute("DELETE FROM upload_aliases WHERE canonical = ?", (file_id,))
+
+    # --- версии (черновики одного сценария) -------------------------------
+
+    def link_version(self, file_id: str, previous_file_id: str):
+        with connect(self.path) as con:
+            con.execute("INSERT OR REPLACE INTO versions (file_id, previous_file_id, created_at) VALUES (?, ?, ?)",
+                        (file_id, previous_file_id, time.time()))
+
+    def previous_version(self, file_id: str) -> Optional[str]:
+        with connect(self.path) as con:
+            row = con.execute("SELECT previous_file_id FROM versions WHERE file_id = ?", (file_id,)).fetchone()
+        return row["previous_file_id"] if row else None
+
+    # --- анализы ----------------------------------------------------------
+
+    def has_analysis(self, file_id: str) -> bool:
+        return self.revision(file_id) is not None
+
+    def revision(self, file_id: str) -> Optional[int]:
+        with connect(self.path) as con:
+            row = con.execute("SELECT revision FROM analyses WHERE file_id = ?", (file_id,)).fetchone()
+        return row["revision"] if row else None
+
+    def head(self, file_id: str) -> Optional[Dict[str, Any]]:
+        # revision и checksum без чтения сцен и эпизодов — ключ артефактов отчёта
+        with connect(self.path) as con:
+            row = con.execute("SELECT revision, checksum FROM analyses WHERE file_id = ?", (file_id,)).fetchone()
+        return dict(row) if row else None
+
+    def save_analysis(self, analysis: "aggregate.Analysis", state: Optional[Dict[str, Any]] = None) -> int:
+        # Полная запись результата анализа; ревизия продолжает прежнюю, если анализ уже был
+        with connect(self.path, immediate=True) as con:
+            revision = _replace_head(con, analysis, state)
+            con.executemany(SCENE_INSERT, [_scene_row(analysis.file_id, s) for s in analysis.scenes])
+            con.executemany(EPISODE_INSERT, _table_rows(analysis.file_id, analysis.episodes))
+            _index_episodes(con, analysis.file_id)
+            _index_summary(con, analysis.file_id, analysis.summary)
+        analysis.revision = revision
+        return revision
+
+    @contextmanager
+    def stage(self, file_id: str) -> Iterator["Staged"]:
+        # Потоковая запись анализа: сцены и эпизоды пишутся окнами под временным ключом,
+        # Staged.commit подменяет ими прежний анализ одной короткой транзакцией. Читатели до
+        # commit видят прежний анализ; сбой — промежуточные строки удаляются
+        staged = Staged(self.path, file_id, f"~{uuid.uuid4().hex[:12]}")
+        with connect(self.path) as con:
+            con.execute("INSERT INTO staging (key, file_id, created_at) VALUES (?, ?, ?)",
+                        (staged.key, file_id, time.time()))
+        try:
+            yield staged
+        finally:
+            if not staged.committed:
+                with connect(self.path) as con:
+                    _drop_staging(con, staged.key)
+
+    def load_analysis(self, file_id: str) -> Optional[AnalysisResult]:
+        with connect(self.path) as con:
+            head = con.execute("SELECT * FROM analyses WHERE file_id = ?", (file_id,)).fetchone()
+            if head is None:
+                return None
+            scenes = [_scene(r) for r in con.execute(
+                "SELECT * FROM scenes WHERE file_id = ? ORDER BY idx", (file_id,))]
+            episodes = [_episode(r) for r in con.execute(
+                "SELECT * FROM episodes WHERE file_id = ? ORDER BY rowid", (file_id,))]
+        return AnalysisResult(
+            file_id=file_id, filename=head["filename"], checksum=head["checksum"],
+            scenes=scenes, episodes=episodes,
+            summary=Summary.model_validate_json(head["summary"]) if head["summary"] else None,
+            revision=head["revision"],
+            timings=json.loads(head["timings"]) if head["timings"] else {}
+        )
+
+    def load_analysis_page(self, file_id: str, offset: int, limit: int) -> Tuple[Optional[AnalysisResult], int]:
+        # -> (анализ только со сценами [offset, offset+limit) и их эпизодами, всего сцен)
+        with connect(self.path) as con:
+            head = con.execute("SELECT * FROM analyses WHERE file_id = ?", (file_id,)).fetchone()
+            if head is None:
+                return None, 0
+            total = con.execute("SELECT COUNT(*) FROM scenes WHERE file_id = ?", (file_id,)).fetchone()[0]
+            scenes = [_scene(r) for r in con.execute(
+                "SELECT * FROM scenes WHERE file_id = ? AND idx >= ? AND idx < ? ORDER BY idx",
+                (file_id, offset, offset + limit))]
+            episodes = [_episode(r) for r in con.execute(
+                "SELECT e.* FROM episodes e JOIN scenes s ON s.file_id = e.file_id AND s.id = e.scene_id "
+                "WHERE e.file_id = ? AND s.idx >= ? AND s.idx < ? ORDER BY e.rowid",
+                (file_id, offset, offset + limit))]
+        return AnalysisResult(
+            file_id=file_id, filename=head["filename"], checksum=head["checksum"],
+            scenes=scenes, episodes=episodes,
+            summary=Summary.model_validate_json(head["summary"]) if head["summary"] else None,
+            revision=head["revision"]
+        ), total
+
+    def load_scenes(self, file_id: str, scene_ids: List[str]) -> Tuple[Optional[int], List[Scene]]:
+        # -> (ревизия, сцены в порядке документа); только запрошенные сцены
+        with connect(self.path) as con:
+            head = con.execute("SELECT revision FROM analyses WHERE file_id = ?", (file_id,)).fetchone()
+            if head is None:
+                return None, []
+            scenes = []
+            for i in range(0, len(scene_ids), 500):  # лимит параметров SQLite
+                chunk = scene_ids[i:i+500]
+                marks = ",".join("?" * len(chunk))
+                scenes += [_scene(r) for r in con.execute(
+                    f"SELECT * FROM scenes WHERE file_id = ? AND id IN ({marks})", [file_id, *chunk])]
+        scenes.sort(key=lambda s: s.index)
+        return head["revision"], scenes
+
+    def rating_heads(self) -> List[Dict[str, Any]]:
+        # Все анализы: версии правил, с которыми они получены (rules_state), и текущий рейтинг
+        with connect(self.path) as con:
+            rows = con.execute("SELECT file_id, filename, revision, age_rating, rules_state FROM analyses "
+                               "ORDER BY file_id").fetchall()
+        return [{**dict(r), "rules_state": json.loads(r["rules_state"]) if r["rules_state"] else None}
+                for r in rows]
+
+    def scene_texts(self, file_id: str) -> Tuple[Optional[int], List[Tuple[str, str]]]:
+        # -> (ревизия, [(id сцены, текст)] в порядке документа) — для повторной детекции без разбора файла
+        with connect(self.path) as con:
+            head = con.execute("SELECT revision FROM analyses WHERE file_id = ?", (file_id,)).fetchone()
+            if head is None:
+                return None, []
+            rows = con.execute("SELECT id, text FROM scenes WHERE file_id = ? ORDER BY idx", (file_id,)).fetchall()
+        return head["revision"], [(r["id"], r["text"]) for r in rows]
+
+    def record_timings(self, file_id: str, op: str, timings: Dict[str, Any]):
+        # Последние замеры операции (analyze, patch, report_html...) — ревизию не меняют
+        with connect(self.path) as con:
+            con.execute("UPDATE analyses SET timings = json_set(COALESCE(timings, '{}'), ?, json(?)) "
+                        "WHERE file_id = ?", (f"$.{op}", json.dumps(timings), file_id))
+
+    def load_summary(self, file_id: str) -> Optional[Summary]:
+        with connect(self.path) as con:
+            row = con.execute("SELECT summary FROM analyses WHERE file_id = ?", (file_id,)).fetchone()
+        return Summary.model_validate_json(row["summary"]) if row and row["summary"] else None
+
+    @contextmanager
+    def edit(self, file_id: str, expected_revision: Optional[int] = None) -> Iterator[Edit]:
+        # Точечная правка под блокировкой записи; по выходу revision += 1
+        with connect(self.path, immediate=True) as con:
+            row = con.execute("SELECT revision FROM analyses WHERE file_id = ?", (file_id,)).fetchone()
+            if row is None:
+                raise NotFound(file_id)
+            if expected_revision is not None and row["revision"] != expected_revision:
+                raise RevisionConflict(row["revision"])
+            tx = Edit(con, file_id, row["revision"] + 1)
+            yield tx
+            if tx.episodes_changed:
+                _index_episodes(con, file_id)
+            con.execute("UPDATE analyses SET revision = ?, updated_at = ? WHERE file_id = ?",
+                        (tx.revision, time.time(), file_id))
+
+    # --- JSON API чтения ------------------------------------------------
+    # Страницы по ключу (keyset): сцены — по idx, эпизоды — по rowid; вместе со страницей
+    # отдаётся ревизия, курсор клиента к ней привязан
+
+    def list_analyses(self, after: Optional[str] = None, limit: int = 50) -> List[Dict[str, Any]]:
+        with connect(self.path) as con:
+            rows = con.execute("SELECT file_id, filename, revision, age_rating, updated_at FROM analyses "
+                               "WHERE file_id > ? ORDER BY file_id LIMIT ?", (after or "", limit)).fetchall()
+        return [dict(r) for r in rows]
+
+    def analysis_head(self, file_id: str) -> Optional[Dict[str, Any]]:
+        # заголовок анализа без сцен и эпизодов: сводка, замеры, их количество
+        with connect(self.path) as con:
+            row = con.execute("SELECT file_id, filename, checksum, revision, summary, timings, updated_at "
+                              "FROM analyses WHERE file_id = ?", (file_id,)).fetchone()
+            if row is None:
+                return None
+            scenes = con.execute("SELECT COUNT(*) FROM scenes WHERE file_id = ?", (file_id,)).fetchone()[0]
+            episodes = con.execute("SELECT COUNT(*) FROM episodes WHERE file_id = ?", (file_id,)).fetchone()[0]
+        head = dict(row)
+        head["summary"] = json.loads(row["summary"]) if row["summary"] else None
+        head["timings"] = json.loads(row["timings"]) if row["timings"] else {}
+        head["scene_count"], head["episode_count"] = scenes, episodes
+        return head
+
+    def page_scenes(self, file_id: str, fields: List[str], after: int = -1,
+                    limit: int = 100) -> Tuple[Optional[int], List[Tuple[int, Dict[str, Any]]]]:
+        # -> (ревизия, [(idx, сцена)]); after — idx последней полученной сцены
+        cols = ", ".join(f'{SCENE_FIELDS[f]} AS "{f}"' for f in fields)
+        # ревизия и строки — в одной транзакции чтения (connect открывает BEGIN): под WAL
+        # правка между ними не попадёт в страницу, помеченную прежней ревизией
+        with connect(self.path) as con:
+            head = con.execute("SELECT revision FROM analyses WHERE file_id = ?", (file_id,)).fetchone()
+            if head is None:
+                return None, []
+            rows = con.execute(f"SELECT idx AS _pos{', ' + cols if cols else ''} FROM scenes "
+                               "WHERE file_id = ? AND idx > ? ORDER BY idx LIMIT ?",
+                               (file_id, after, limit)).fetchall()
+        return head["revision"], [(r["_pos"], _projected(r, fields)) for r in rows]
+
+    def page_episodes(self, file_id: str, fields: List[str], after: int = 0, limit: int = 100,
+                      categories: Optional[List[str]] = None, severities: Optional[List[str]] = None,
+                      scene_ids: Optional[List[str]] = None, is_fp: Optional[bool] = None
+                      ) -> Tuple[Optional[int], List[Tuple[int, Dict[str, Any]]]]:
+        # -> (ревизия, [(rowid, эпизод)]) по фильтрам; порядок — как в load_analysis
+        cols = ", ".join(f'{EPISODE_FIELDS[f]} AS "{f}"' for f in fields)
+        where, params = "file_id = ? AND rowid > ?", [file_id, after]
+        for column, values in (("category", categories), ("severity", severities), ("scene_id", scene_ids)):
+            sql, vals = _in(column, values or [])
+            where += sql
+            params += vals
+        if is_fp is not None:
+            where += " AND is_fp = ?"
+            params.append(int(is_fp))
+        with connect(self.path) as con:  # одна транзакция чтения, как в page_scenes
+            head = con.execute("SELECT revision FROM analyses WHERE file_id = ?", (file_id,)).fetchone()
+            if head is None:
+                return None, []
+            rows = con.execute(f"SELECT rowid AS _pos{', ' + cols if cols else ''} FROM episodes "
+                               f"WHERE {where} ORDER BY rowid LIMIT ?", [*params, limit]).fetchall()
+        return head["revision"], [(r["_pos"], _projected(r, fields)) for r in rows]
+
+    # --- поиск по каталогу -------------------------------------------------
+
+    def search(self, terms: List[str], after: Optional[str] = None, limit: int = 50,
+               with_scenes: bool = False) -> Tuple[int, List[Dict[str, Any]]]:
+        # Анализы, в которых есть все термины; -> (всего, страница по file_id после after).
+        # Пересечение идёт от самого редкого термина, остальные проверяются по ключу (term, file_id)
+        terms = list(dict.fromkeys(terms))
+        with connect(self.path) as con:
+            sizes = {t: con.execute("SELECT COUNT(*) FROM postings WHERE term = ?", (t,)).fetchone()[0]
+                     for t in terms}
+            terms.sort(key=sizes.get)
+            joins = "".join(f" JOIN postings p{i} ON p{i}.term = ? AND p{i}.file_id = p0.file_id"
+                            for i in range(1, len(terms)))
+            matched = f"FROM postings p0{joins} WHERE p0.term = ?"
+            params = [*terms[1:], terms[0]]
+            if len(terms) == 1:
+                total = sizes[terms[0]]
+            else:
+                (total,) = con.execute(f"SELECT COUNT(*) {matched}", params).fetchone()
+            ids = [r[0] for r in con.execute(
+                f"SELECT p0.file_id {matched} AND p0.file_id > ? ORDER BY p0.file_id LIMIT ?",
+                [*params, after or "", limit])]
+            marks = ",".join("?" * len(terms))
+            items: Dict[str, Dict[str, Any]] = {}
+            if ids:
+                id_marks = ",".join("?" * len(ids))
+                for r in con.execute(f"SELECT file_id, filename, age_rating FROM analyses "
+                                     f"WHERE file_id IN ({id_marks})", ids):
+                    items[r["file_id"]] = {"file_id": r["file_id"], "filename": r["filename"],
+                                           "age_rating": r["age_rating"], "hits": {}}
+                for r in con.execute(f"SELECT term, file_id, n, scene_ids FROM postings "
+                                     f"WHERE file_id IN ({id_marks}) AND term IN ({marks})", [*ids, *terms]):
+                    hit: Dict[str, Any] = {"episodes": r["n"]}
+                    scenes = r["scene_ids"].split(",") if r["scene_ids"] else []
+                    if r["scene_ids"] is not None:
+                        hit["scenes"] = scenes if with_scenes else len(scenes)
+                    items[r["file_id"]]["hits"][r["term"]] = hit
+        return total, [items[i] for i in ids if i in items]
+
+    # --- миграция ---------------------------------------------------------
+
+    def migrate_json(self, analyses_dir: str) -> int:
+        # Переносит data/analyses/*.json, которых ещё нет в хранилище; файлы не удаляются
+        moved = 0
+        for path in sorted(glob.glob(os.path.join(analyses_dir, "*.json"))):
+            file_id = os.path.splitext(os.path.basename(path))[0]
+            if self.has_analysis(file_id):
+                continue
+            with open(path, "r", encoding="utf-8") as f:
+                analysis = AnalysisResult.model_validate_json(f.read())
+            self.save_analysis(aggregate.Analysis.from_result(analysis))
+            moved += 1
+        return moved
+
+    def migrate_uploads(self, uploads_dir: str, checksum) -> int:
+        # Регистрирует файлы из data/uploads, загруженные до появления хранилища
+        moved = 0
+        for name in sorted(os.listdir(uploads_dir)):
+            path = os.path.join(uploads_dir, name)
+            file_id, ext = os.path.splitext(name)
+            if not os.path.isfile(path) or ext.lower() not in (".pdf", ".docx") or self._known_upload(file_id):
+                continue
+            owner = self.add_upload(file_id, name, path, checksum(path), os.path.getsize(path))
+            if owner != file_id:
+                # то же содержимое уже зарегистрировано под другим file_id — прежний id остаётся рабочим
+                with connect(self.path) as con:
+                    con.execute("INSERT OR REPLACE INTO upload_aliases (file_id, canonical) VALUES (?, ?)",
+                                (file_id, owner))
+            moved += 1
+        return moved
+
+    def _known_upload(self, file_id: str) -> bool:
+        with connect(self.path) as con:
+            return con.execute("SELECT 1 FROM uploads WHERE file_id = ? UNION ALL "
+                               "SELECT 1 FROM upload_aliases WHERE file_id = ?", (file_id, file_id)).fetchone() is not None
@@ -0,0 +1,127 @@
+import os
+import uuid
+import zipfile
+from typing import List, Tuple
+
+from fastapi import UploadFile
+from starlette.concurrency import run_in_threadpool
+
+from app.services.pipeline import UPLOADS, STORE
+from app.utils.checksum import new_hasher, CHUNK_SIZE
+from app.utils.io import ensure_dirs
+
+# Загрузки пишутся на диск потоком с подсчётом sha256 на лету; одинаковое содержимое
+# хранится один раз (индекс sha256 -> file_id — таблица uploads в хранилище).
+INCOMING = os.path.join(UPLOADS, ".incoming")
+ensure_dirs([INCOMING])
+
+ALLOWED = (".pdf", ".docx")
+
+class UploadTooLarge(Exception):
+    pass
+
+class BadArchive(Exception):
+    pass
+
+class TooManyFiles(Exception):
+    pass
+
+async def receive(file: UploadFile, max_bytes: int) -> Tuple[str, str, int]:
+    # -> (временный путь, sha256, размер)
+    tmp = os.path.join(INCOMING, f"{uuid.uuid4().hex}.part")
+    h = new_hasher()
+    size = 0
+    try:
+        with open(tmp, "wb") as f:
+            while True:
+                chunk = await file.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_bytes:
+                    raise UploadTooLarge()
+                h.update(chunk)
+                f.write(chunk)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    return tmp, h.hexdigest(), size
+
+async def receive_batch(files: List[UploadFile], max_bytes: int, max_files: int) -> List[Tuple[str, str, str, int]]:
+    # -> [(исходное имя, временный путь, sha256, размер)]; ZIP распаковываются.
+    # Лимит размера — на каждый файл (и на архив целиком), лимит числа — на документы пакета.
+    out: List[Tuple[str, str, str, int]] = []
+    try:
+        for f in files:
+            tmp, sha, size = await receive(f, max_bytes)
+            if os.path.splitext(f.filename)[1].lower() == ".zip":
+                out += await run_in_threadpool(extract_zip, tmp, max_bytes, max_files - len(out))
+            else:
+                out.append((f.filename, tmp, sha, size))
+            if len(out) > max_files:
+                raise TooManyFiles()
+    except BaseException:
+        for _, tmp, _, _ in out:
+            os.remove(tmp)
+        raise
+    return out
+
+def commit(tmp: str, sha: str, size: int, ext: str) -> Tuple[str, bool]:
+    # -> (file_id, is_duplicate); уникальность sha256 обеспечивает хранилище
+    existing = STORE.upload_by_sha(sha)
+    if existing and os.path.exists(existing["path"]):
+        os.remove(tmp)
+        return existing["file_id"], True
+    if existing:  # файл пропал с диска — запись устарела
+        STORE.remove_upload(existing["file_id"])
+    file_id = str(uuid.uuid4())
+    name = f"{file_id}{ext}"
+    path = os.path.join(UPLOADS, name)
+    os.replace(tmp, path)
+    owner = STORE.add_upload(file_id, name, path, sha, size)
+    if owner != file_id:  # параллельная загрузка того же файла успела раньше
+        os.remove(path)
+        return owner, True
+    return file_id, False
+
+def extract_zip(archive: str, max_bytes: int, max_files: int) -> List[Tuple[str, str, str, int]]:
+    # -> [(имя в архиве, временный путь, sha256, размер)] для .pdf/.docx; прочее пропускаем.
+    # Размер считаем по распакованным байтам, а не по заголовку архива (zip-бомбы).
+    out: List[Tuple[str, str, str, int]] = []
+    try:
+        with zipfile.ZipFile(archive) as zf:
+            members = [m for m in zf.infolist() if not m.is_dir()
+                       and os.path.splitext(m.filename)[1].lower() in ALLOWED
+                       and not os.path.basename(m.filename).startswith(("._", "~$"))
+                       and not m.filename.startswith("__MACOSX/")]
+            if len(members) > max_files:
+                raise TooManyFiles()
+            for m in members:
+                tmp = os.path.join(INCOMING, f"{uuid.uuid4().hex}.part")
+                h = new_hasher()
+                size = 0
+                try:
+                    with zf.open(m) as src, open(tmp, "wb") as f:
+                        while True:
+                            chunk = src.read(CHUNK_SIZE)
+                            if not chunk:
+                                break
+                            size += len(chunk)
+                            if size > max_bytes:
+                                raise UploadTooLarge()
+                            h.update(chunk)
+                            f.write(chunk)
+                except BaseException:
+                    os.remove(tmp)
+                    raise
+                out.append((m.filename, tmp, h.hexdigest(), size))
+    except BaseException as ex:
+        for _, tmp, _, _ in out:
+            os.remove(tmp)
+        if isinstance(ex, zipfile.BadZipFile):
+            raise BadArchive()
+        raise
+    finally:
+        os.remove(archive)
+    return out
@@ -0,0 +1,64 @@
+from pydantic_settings import BaseSettings, SettingsConfigDict
+
+class Settings(BaseSettings):
+    # Значения переопределяются переменными окружения с префиксом RATING_ (см. docker-compose.yml)
+    model_config = SettingsConfigDict(env_prefix="RATING_")
+
+    # Детекция по сценам: process — пул процессов, inline — в текущем процессе
+    detect_mode: str = "process"
+    detect_workers: int = 0  # 0 — по числу ядер
+    detect_chunk_size: int = 16  # сцен в одной пачке для воркера
+    detect_min_pool_scenes: int = 64  # меньше сцен — пул не окупается, считаем в процессе
+    detect_start_method: str = "spawn"  # fork небезопасен в процессе uvicorn с потоками
+    # бюджет рискованного (guarded) правила на сцену; не уложилось — правило пропускается. 0 — без лимита
+    detect_rule_timeout_ms: int = 250
+
+    # Загрузки: лимит размера файла
+    upload_max_mb: int = 50
+
+    # Фоновые задачи анализа: одновременно выполняемые и ожидающие в очереди
+    job_workers: int = 2
+    job_queue_depth: int = 16
+    job_progress_scenes: int = 256  # шаг отчёта о прогрессе детекции, сцен
+
+    # Пакетный анализ: лимит документов и сколько документов разбирать наперёд
+    batch_max_files: int = 60
+    batch_prefetch: int = 2
+
+    # Потоковый анализ: сцены идут в детекцию и в хранилище окнами по stream_window_scenes;
+    # текст без заголовков сцен длиннее stream_window_chars делится по абзацам по мере чтения
+    stream_window_scenes: int = 256
+    stream_window_chars: int = 2_000_000
+
+    # Страница результатов: сцен на странице
+    results_page_scenes: int = 100
+
+    # gzip ответов JSON API чтения: не меньше min_bytes; уровень 1-9 (выше — медленнее)
+    gzip_min_bytes: int = 1024
+    gzip_level: int = 5
+
+    # Общий кеш результатов детекции по сценам (SQLite в data/cache)
+    scene_cache_enabled: bool = True
+    scene_cache_max_entries: int = 200_000
+
+    # Черновики: изменённой считается сцена прежней версии с долей общих слов не ниже порога
+    draft_match_threshold: float = 0.5
+
+    # Сводка ведётся инкрементально; verify — сверять с полным пересчётом после каждой правки
+    summary_verify: bool = False
+
+    # Профилирование по запросу: заголовок X-Profile: 1 (analyze — поле profile=1) -> data/profiles/*.prof
+    profiling_enabled: bool = False
+
+    # PDF: layout-анализ страниц по процессам (1 — в текущем процессе)
+    pdf_workers: int = 1
+    pdf_chunk_pages: int = 8
+    pdf_parallel_min_pages: int = 40
+
+    # PDF-отчёт: рендер в фоне; prerender — сразу после анализа. Запрос отчёта ждёт готовый
+    # файл не дольше wait_sec, дальше — 202 и Retry-After
+    report_pdf_workers: int = 1
+    report_prerender_pdf: bool = True
+    report_pdf_wait_sec: float = 20.0
+
+settings = Settings()
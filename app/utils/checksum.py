@@ -1,9 +1,15 @@
 import hashlib
 
+CHUNK_SIZE = 1 << 20  # 1 МБ
+
+def new_hasher():
+    # инкрементальный sha256 — тот же дайджест, что file_checksum по готовому файлу
+    return hashlib.sha256()
+
 def file_checksum(path: str) -> str:
-    h = hashlib.sha256()
+    h = new_hasher()
     with open(path, "rb") as f:
-        for chunk in iter(lambda: f.read(8192), b""):
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
             h.update(chunk)
     return h.hexdigest()
 
@@ -0,0 +1,39 @@
+import sqlite3
+from contextlib import contextmanager
+
+@contextmanager
+def connect(path: str, immediate: bool = False):
+    # Соединение на операцию: SQLite-файлы разделяются воркерами uvicorn и пулом потоков.
+    # immediate — сразу берём блокировку записи (BEGIN IMMEDIATE), чтобы
+    # прочитать-проверить-записать было атомарно между процессами.
+    con = sqlite3.connect(path, timeout=30, isolation_level=None)
+    con.row_factory = sqlite3.Row
+    try:
+        con.execute("BEGIN IMMEDIATE" if immediate else "BEGIN")
+        try:
+            yield con
+        except BaseException:
+            con.execute("ROLLBACK")
+            raise
+        con.execute("COMMIT")
+    finally:
+        con.close()
+
+def init_db(path: str, schema: str):
+    con = sqlite3.connect(path, timeout=30)
+    try:
+        con.execute("PRAGMA journal_mode=WAL")
+        con.executescript(schema)
+    finally:
+        con.close()
+
+def ensure_column(path: str, table: str, column: str, decl: str):
+    # CREATE TABLE IF NOT EXISTS не добавляет колонки в уже созданную таблицу
+    con = sqlite3.connect(path, timeout=30)
+    try:
+        cols = [r[1] for r in con.execute(f"PRAGMA table_info({table})")]
+        if column not in cols:
+            con.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+            con.commit()
+    finally:
+        con.close()
@@ -1,10 +1,11 @@
 import os
 import io
-import yaml
-from typing import List, Tuple
-from docx import Document as DocxDocument
-from pdfminer.high_level import extract_text
-from charset_normalizer import from_bytes
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Tuple, Iterable, Iterator, Optional
+
+# charset_normalizer и yaml импортируются в функциях: модуль нужен и воркерам детекции,
+# которым они не требуются
 
 def ensure_dirs(paths: List[str]):
     for p in paths:
@@ -15,17 +16,104 @@ def read_file_bytes(path: str) -> bytes:
         return f.read()
 
 def detect_encoding(data: bytes) -> str:
+    from charset_normalizer import from_bytes
     result = from_bytes(data).best()
     return result.encoding if result else "utf-8"
 
+# WordprocessingML: теги, из которых собирается текст абзаца
+W = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+MC_FALLBACK = "{http://schemas.openxmlformats.org/markup-compatibility/2006}Fallback"
+DOCX_CHUNK_CHARS = 1 << 16
+
 def read_text_from_docx(path: str) -> str:
-    doc = DocxDocument(path)
-    lines = []
-    for p in doc.paragraphs:
-        lines.append(p.text)
-    text = "\n".join(lines)
-    # Нормализация переносов/колонтитулов — можно расширять
-    return normalize_whitespace(text)
+    return "".join(iter_docx_text(path))
+
+def iter_docx_paragraphs(path: str) -> Iterator[str]:
+    # Абзацы word/document.xml потоком — iterparse прямо из zip, без объектной модели
+    # python-docx; разобранные элементы тела сразу освобождаются. Порядок документа: тело,
+    # ячейки таблиц, надписи (абзац надписи отдаётся раньше абзаца, в который она вложена).
+    # Текст абзаца — как Paragraph.text в python-docx: w:t, табуляции, разрывы строк
+    import zipfile
+    from xml.etree.ElementTree import iterparse
+    with zipfile.ZipFile(path) as zf, zf.open("word/document.xml") as f:
+        stack: List[List[str]] = []  # абзацы, открытые на текущем пути (надпись внутри абзаца)
+        skip = 0  # внутри mc:Fallback — копия надписи для старых версий Word
+        depth = 0
+        body = None
+        for event, el in iterparse(f, events=("start", "end")):
+            tag = el.tag
+            if event == "start":
+                depth += 1
+                if tag == MC_FALLBACK:
+                    skip += 1
+                elif skip:
+                    continue
+                elif tag == W + "p":
+                    stack.append([])
+                elif tag == W + "body":
+                    body = el
+                continue
+            depth -= 1
+            if tag == MC_FALLBACK:
+                skip -= 1
+            elif not skip and stack:
+                if tag == W + "t":
+                    stack[-1].append(el.text or "")
+                elif tag == W + "tab" or tag == W + "ptab":
+                    stack[-1].append("\t")
+                elif tag == W + "br":
+                    # разрыв страницы или колонки текста не даёт
+                    if el.get(W + "type", "textWrapping") == "textWrapping":
+                        stack[-1].append("\n")
+                elif tag == W + "cr":
+                    stack[-1].append("\n")
+                elif tag == W + "noBreakHyphen":
+                    stack[-1].append("-")
+                elif tag == W + "p":
+                    yield "".join(stack.pop())
+            if depth == 2 and body is not None:
+                body.clear()  # элемент тела разобран — дерево не копим
+
+def iter_docx_text(path: str, chunk_chars: int = DOCX_CHUNK_CHARS) -> Iterator[str]:
+    # Нормализованный текст DOCX кусками от chunk_chars; склейка кусков — то же, что
+    # normalize_whitespace("\n".join(абзацы))
+    yield from normalized_chunks(iter_docx_paragraphs(path), chunk_chars)
+
+def normalized_chunks(lines: Iterable[str], chunk_chars: int = DOCX_CHUNK_CHARS) -> Iterator[str]:
+    import re
+    spaces, newlines = re.compile(r"[ \t]+"), re.compile(r"\n{3,}")
+    pending = None  # пробельный хвост: отдаётся, только если дальше будет текст (strip в конце)
+    started = False
+    out: List[str] = []
+    size = 0
+    for line in lines:
+        s = spaces.sub(" ", line) if pending is None else f"{pending}\n{spaces.sub(' ', line)}"
+        text = s.rstrip()
+        if not text:
+            pending = newlines.sub("\n\n", s)
+            continue
+        pending = s[len(text):]
+        if not started:
+            text, started = text.lstrip(), True
+        text = newlines.sub("\n\n", text)
+        out.append(text)
+        size += len(text)
+        if size >= chunk_chars:
+            yield "".join(out)
+            out, size = [], 0
+    if out:
+        yield "".join(out)
+
+def docx_page_count(path: str) -> Optional[int]:
+    # Число страниц, которое Word записал в docProps/app.xml при последнем сохранении
+    import re
+    import zipfile
+    try:
+        with zipfile.ZipFile(path) as zf:
+            m = re.search(rb"<Pages>(\d+)</Pages>", zf.read("docProps/app.xml"))
+    except (KeyError, zipfile.BadZipFile):
+        return None
+    return int(m.group(1)) if m else None
 
 def normalize_whitespace(text: str) -> str:
     import re
@@ -33,33 +121,62 @@ def normalize_whitespace(text: str) -> str:
     text = re.sub(r"\n{3,}", "\n\n", text)
     return text.strip()
 
-def read_text_from_pdf(path: str, return_spans: bool = False):
-    # Быстрый путь: получить весь текст и позиции страниц
-    # extract_text даёт склейку текстов; для приблизительных страниц
-    text = extract_text(path)
-    text = normalize_whitespace(text)
-    if not return_spans:
-        return text
-    # Грубая оценка page_spans: извлекаем ещё раз постранично
-    page_spans = []
+PAGE_SEPARATOR = "\n\n"
+
+def pdf_page_count(path: str) -> int:
+    from pdfminer.pdfpage import PDFPage
+    with open(path, "rb") as f:
+        return sum(1 for _ in PDFPage.get_pages(f))
+
+def _pdf_pages_chunk(path: str, page_numbers: List[int]) -> List[str]:
+    return list(_iter_pdf_pages_serial(path, page_numbers))
+
+def _iter_pdf_pages_serial(path: str, page_numbers: Optional[List[int]] = None) -> Iterator[str]:
+    from pdfminer.high_level import extract_pages
+    from pdfminer.layout import LTTextContainer
+    # extract_pages — генератор: LTPage разбирается и отпускается по одной странице
+    for page in extract_pages(path, page_numbers=page_numbers):
+        buf = [el.get_text() for el in page if isinstance(el, LTTextContainer)]
+        yield normalize_whitespace("\n".join(buf))
+
+def iter_pdf_pages(path: str, workers: int = 1, chunk_pages: int = 8, min_pages: int = 40) -> Iterator[str]:
+    # Нормализованный текст страниц по порядку. Для длинных PDF layout-анализ
+    # (самая дорогая часть pdfminer) можно раскидать по процессам кусками страниц.
+    total = pdf_page_count(path) if workers > 1 else 0
+    if workers <= 1 or total < min_pages:
+        yield from _iter_pdf_pages_serial(path)
+        return
+    chunks = [list(range(i, min(i + chunk_pages, total))) for i in range(0, total, chunk_pages)]
+    ctx = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=ctx) as pool:
+        for pages in pool.map(_pdf_pages_chunk, [path] * len(chunks), chunks):
+            yield from pages
+
+def join_pages(pages: Iterable[str]) -> Tuple[str, List[Tuple[int, int, int]]]:
+    # Склеивает страницы и сразу считает точные спаны (pidx, start, end) в итоговом тексте
+    parts: List[str] = []
+    page_spans: List[Tuple[int, int, int]] = []
     offset = 0
-    try:
-        from pdfminer.high_level import extract_pages
-        from pdfminer.layout import LTTextContainer
-        pages = list(extract_pages(path))
-        for pidx, page in enumerate(pages):
-            start = offset
-            buf = []
-            for element in page:
-                if isinstance(element, LTTextContainer):
-                    buf.append(element.get_text())
-            page_text = normalize_whitespace("\n".join(buf))
+    for pidx, page_text in enumerate(pages):
+        if page_text and parts:
+            parts.append(PAGE_SEPARATOR)
+            offset += len(PAGE_SEPARATOR)
+        start = offset
+        if page_text:
+            parts.append(page_text)
             offset += len(page_text)
-            page_spans.append((pidx, start, offset))
-    except Exception:
-        pass
+        page_spans.append((pidx, start, offset))
+    return "".join(parts), page_spans
+
+def read_text_from_pdf(path: str, return_spans: bool = False, workers: int = 1,
+                       chunk_pages: int = 8, min_pages: int = 40):
+    # Один проход pdfminer: текст страниц и их точные смещения получаем вместе
+    text, page_spans = join_pages(iter_pdf_pages(path, workers, chunk_pages, min_pages))
+    if not return_spans:
+        return text
     return text, page_spans
 
 def read_yaml(path: str):
+    import yaml
     with open(path, "r", encoding="utf-8") as f:
         return yaml.safe_load(f)
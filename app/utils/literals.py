@@ -0,0 +1,135 @@
+import re
+from typing import Dict, Iterable, List, Optional, Set
+
+try:
+    from re import _parser as sre_parse
+except ImportError:  # python < 3.11
+    import sre_parse
+
+MIN_LITERAL = 2  # односимвольные «литералы» ничего не отсекают
+
+def required_literal(pattern: str, flags: int = 0) -> Optional[str]:
+    # Самая длинная подстрока, которая обязана присутствовать в любом совпадении паттерна
+    try:
+        parsed = sre_parse.parse(pattern, flags)
+    except re.error:
+        return None
+    runs: List[str] = []
+    buf: List[str] = []
+
+    def walk(items):
+        for op, av in items:
+            if op is sre_parse.LITERAL:
+                buf.append(chr(av))
+            elif op is sre_parse.AT:
+                continue  # \b, ^ и т.п. нулевой ширины — не разрывают подстроку
+            elif op is sre_parse.SUBPATTERN and not av[1] and not av[2]:
+                walk(av[-1])  # обычная группа без квантификатора и флагов
+            else:
+                runs.append("".join(buf))
+                buf.clear()
+
+    walk(parsed)
+    runs.append("".join(buf))
+    best = max(runs, key=len)
+    return best if len(best) >= MIN_LITERAL else None
+
+_REPEATS = {sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT, getattr(sre_parse, "POSSESSIVE_REPEAT", None)}
+def _is_wide(item) -> bool:
+    # «.», [^x], [^...] — класс, под который попадает почти любой текст
+    op, av = item
+    return op in (sre_parse.ANY, sre_parse.NOT_LITERAL) or (
+        op is sre_parse.IN and bool(av) and av[0][0] is sre_parse.NEGATE)
+
+def _children(op, av) -> List[list]:
+    if op in _REPEATS:
+        return [av[2]]
+    if op is sre_parse.SUBPATTERN:
+        return [av[-1]]
+    if op is sre_parse.BRANCH:
+        return list(av[1])
+    if op in (sre_parse.ASSERT, sre_parse.ASSERT_NOT):
+        return [av[1]]
+    if op is sre_parse.GROUPREF_EXISTS:
+        return [x for x in av[1:] if x is not None]
+    if op is getattr(sre_parse, "ATOMIC_GROUP", None):
+        return [av]
+    return []
+
+def pattern_risks(pattern: str, flags: int = 0) -> List[str]:
+    # Конструкции, на которых бэктрекинг может стать экспоненциальным или квадратичным.
+    # Пустой список — паттерн безопасен для re без таймаута.
+    try:
+        parsed = sre_parse.parse(pattern, flags)
+    except re.error:
+        return []
+    risks: List[str] = []
+    wide = 0
+
+    def walk(items, in_repeat: bool):
+        nonlocal wide
+        for op, av in items:
+            if op in _REPEATS:
+                unbounded = av[1] is sre_parse.MAXREPEAT
+                body = list(av[2])
+                if unbounded and in_repeat:
+                    risks.append("вложенные квантификаторы")
+                if unbounded and any(o is sre_parse.BRANCH or (o is sre_parse.SUBPATTERN and any(
+                        x is sre_parse.BRANCH for x, _ in a[-1])) for o, a in body):
+                    risks.append("альтернатива под неограниченным квантификатором")
+                if unbounded and len(body) == 1 and _is_wide(body[0]):
+                    wide += 1
+                walk(body, in_repeat or av[1] is sre_parse.MAXREPEAT or av[1] > 1)
+            else:
+                for child in _children(op, av):
+                    walk(child, in_repeat)
+
+    walk(list(parsed), False)
+    if wide > 1:
+        risks.append("несколько неограниченных .* / [...]*")
+    first = list(parsed)[:1]
+    if first and first[0][0] in _REPEATS and first[0][1][1] is sre_parse.MAXREPEAT \
+            and len(first[0][1][2]) == 1 and first[0][1][2][0][0] is sre_parse.ANY:
+        risks.append("ведущий .*")
+    return list(dict.fromkeys(risks))
+
+def trie_pattern(words: Iterable[str]) -> str:
+    # Префиксное дерево, свёрнутое в регэксп: на каждой позиции sre проходит по дереву
+    # и отдаёт самое длинное слово, так что стоимость почти не зависит от числа слов
+    trie: Dict[str, dict] = {}
+    for w in words:
+        node = trie
+        for ch in w:
+            node = node.setdefault(ch, {})
+        node[""] = {}
+
+    def build(node: Dict[str, dict]) -> str:
+        alts = [re.escape(ch) + build(child) for ch, child in sorted(node.items()) if ch]
+        if not alts:
+            return ""
+        body = alts[0] if len(alts) == 1 else "(?:" + "|".join(alts) + ")"
+        if "" in node:
+            body = f"(?:{body})?"
+        return body
+
+    return build(trie)
+
+class LiteralScanner:
+    # Один проход по тексту находит все вхождения набора литералов (аналог Aho–Corasick)
+
+    def __init__(self, words: Iterable[str]):
+        self.words = sorted(set(words))
+        self.regex = re.compile(trie_pattern(self.words)) if self.words else None
+        # найденное самое длинное слово подразумевает все слова-префиксы, начинающиеся там же
+        wordset = set(self.words)
+        self.implied = {w: [w[:k] for k in range(1, len(w) + 1) if w[:k] in wordset] for w in self.words}
+
+    def scan(self, text: str) -> Set[str]:
+        seen: Set[str] = set()
+        if self.regex is None:
+            return seen
+        m = self.regex.search(text)
+        while m:
+            seen.update(self.implied[m.group()])
+            m = self.regex.search(text, m.start() + 1)
+        return seen
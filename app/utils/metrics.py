@@ -0,0 +1,161 @@
+import os
+import time
+import cProfile
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+# Метрики в текстовом формате Prometheus без внешних зависимостей. Значения живут
+# в памяти процесса: при нескольких воркерах uvicorn каждый отдаёт свои.
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+def _escape(value: str) -> str:
+    # экранирование значения метки по текстовому формату Prometheus
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _labels(names: Sequence[str], values: Tuple[str, ...], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+def _num(v: float) -> str:
+    return repr(float(v)) if v != int(v) else str(int(v))
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self.values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, value: float = 1, **labels: str):
+        key = tuple(str(labels[n]) for n in self.label_names)
+        with self._lock:
+            self.values[key] = self.values.get(key, 0) + value
+
+    def render(self) -> List[str]:
+        out = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, v in sorted(self.values.items()):
+                out.append(f"{self.name}{_labels(self.label_names, key)} {_num(v)}")
+        return out
+
+class Histogram:
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        # key -> [счётчики по корзинам..., count, sum]
+        self.values: Dict[Tuple[str, ...], List[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: str):
+        key = tuple(str(labels[n]) for n in self.label_names)
+        with self._lock:
+            row = self.values.get(key)
+            if row is None:
+                row = self.values[key] = [0] * (len(self.buckets) + 2)
+            for i, b in enumerate(self.buckets):
+                if value <= b:
+                    row[i] += 1
+            row[-2] += 1
+            row[-1] += value
+
+    def render(self) -> List[str]:
+        out = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, row in sorted(self.values.items()):
+                for b, n in zip(self.buckets, row):
+                    le = 'le="%s"' % _num(b)
+                    out.append(f"{self.name}_bucket{_labels(self.label_names, key, le)} {n}")
+                le = 'le="+Inf"'
+                out.append(f"{self.name}_bucket{_labels(self.label_names, key, le)} {row[-2]}")
+                out.append(f"{self.name}_count{_labels(self.label_names, key)} {row[-2]}")
+                out.append(f"{self.name}_sum{_labels(self.label_names, key)} {_num(row[-1])}")
+        return out
+
+class Registry:
+    def __init__(self):
+        self.metrics: List[Any] = []
+        self.collectors: List[Any] = []  # колбэки -> строки (значения, снимаемые в момент запроса)
+
+    def counter(self, name: str, help: str, labels: Sequence[str] = ()) -> Counter:
+        m = Counter(name, help, labels)
+        self.metrics.append(m)
+        return m
+
+    def histogram(self, name: str, help: str, labels: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        m = Histogram(name, help, labels, buckets)
+        self.metrics.append(m)
+        return m
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for m in self.metrics:
+            lines += m.render()
+        for collect in self.collectors:
+            lines += collect()
+        return "\n".join(lines) + "\n"
+
+REGISTRY = Registry()
+STAGE_SECONDS = REGISTRY.histogram("rating_stage_seconds", "Wall time of a processing stage", ["op", "stage"])
+STAGE_CPU_SECONDS = REGISTRY.histogram("rating_stage_cpu_seconds",
+                                       "CPU time of the calling thread in a stage (detector pool workers excluded)",
+                                       ["op", "stage"])
+PROCESSED = REGISTRY.counter("rating_processed_total", "Scenes, episodes and bytes written by operation",
+                             ["op", "kind"])
+
+class Timings:
+    # Замеры одной операции (analyze, patch, report_html...): время по стадиям и счётчики.
+    # В Prometheus уходят сразу; to_dict() сохраняется вместе с анализом.
+
+    def __init__(self, op: str):
+        self.op = op
+        self.stages: Dict[str, Dict[str, float]] = {}
+        self.counts: Dict[str, int] = {}
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        wall0, cpu0 = time.perf_counter(), time.thread_time()
+        try:
+            yield
+        finally:
+            wall, cpu = time.perf_counter() - wall0, time.thread_time() - cpu0
+            s = self.stages.setdefault(name, {"wall": 0.0, "cpu": 0.0})
+            s["wall"] += wall
+            s["cpu"] += cpu
+            STAGE_SECONDS.observe(wall, op=self.op, stage=name)
+            STAGE_CPU_SECONDS.observe(cpu, op=self.op, stage=name)
+
+    def count(self, kind: str, n: int):
+        self.counts[kind] = self.counts.get(kind, 0) + n
+        PROCESSED.inc(n, op=self.op, kind=kind)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "stages": {k: {"wall": round(v["wall"], 6), "cpu": round(v["cpu"], 6)} for k, v in self.stages.items()},
+            "wall": round(sum(v["wall"] for v in self.stages.values()), 6),
+            **self.counts,
+            "at": time.time(),
+        }
+
+@contextmanager
+def profiled(enabled: bool, directory: str, name: str) -> Iterator[Optional[str]]:
+    # cProfile текущего потока -> {directory}/{name}.prof (pstats: snakeviz, python -m pstats)
+    if not enabled:
+        yield None
+        return
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{name}.prof")
+    prof = cProfile.Profile()
+    prof.enable()
+    try:
+        yield path
+    finally:
+        prof.disable()
+        prof.dump_stats(path)
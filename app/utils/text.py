@@ -1,9 +1,18 @@
+import os
 import re
 import json
+from array import array
+from bisect import bisect_right
+from typing import Optional, Tuple
+
+WS_RE = re.compile(r"\s+")
+LONG_WS_RE = re.compile(r"\s{2,}")
+# что deobfuscate_obscene выкидывает: разделители внутри слова и цифры
+OBFUSCATION_RE = re.compile(r"[\*\-\_\.\,\/\\\|\(\)\[\]\{\}\+\=\~\^\`\'\"\:\d]+")
 
 def normalize_text(s: str) -> str:
     s = s.replace("\r", "\n")
-    s = re.sub(r"\s+", " ", s)
+    s = WS_RE.sub(" ", s)
     s = s.lower()
     s = s.replace("ё", "е")
     return s
@@ -17,10 +26,98 @@ def latin_to_cyr(s: str) -> str:
 
 def deobfuscate_obscene(s: str) -> str:
     # Убираем пробелы/символы между буквами, звёздочки/цифры в неприличных словах
-    s = re.sub(r"[\*\-\_\.\,\/\\\|\(\)\[\]\{\}\+\=\~\^\`\'\"\:]+", "", s)
-    s = re.sub(r"\d", "", s)
-    return s
+    return OBFUSCATION_RE.sub("", s)
+
+class OffsetMap:
+    # Позиция в производной строке -> позиция в исходной. Сдвиг кусочно-постоянный: с позиции
+    # starts[i] он равен shifts[i]; хранятся только точки смены, поиск — bisect.
+    __slots__ = ("starts", "shifts")
+
+    def __init__(self):
+        self.starts = array("l")
+        self.shifts = array("l")
+
+    def add(self, pos: int, shift: int):
+        if self.starts and self.starts[-1] == pos:
+            self.shifts[-1] = shift
+        else:
+            self.starts.append(pos)
+            self.shifts.append(shift)
+
+    def __call__(self, pos: int) -> int:
+        i = bisect_right(self.starts, pos)
+        return pos + self.shifts[i - 1] if i else pos
+
+class NormalizedText:
+    # Нормализованные представления текста сцены (как их видит детектор) и перевод позиций
+    # в них обратно в исходный текст. Строки считаются сразу, карты — лениво, при первом
+    # совпадении: у большинства сцен совпадений нет.
+    __slots__ = ("source", "norm", "deobf", "_norm_map", "_deobf_map")
+
+    def __init__(self, source: str):
+        self.source = source
+        self.norm = normalize_text(source)
+        self.deobf = deobfuscate_obscene(latin_to_cyr(self.norm))
+        self._norm_map: Optional[OffsetMap] = None
+        self._deobf_map: Optional[OffsetMap] = None
+
+    def norm_map(self) -> OffsetMap:
+        if self._norm_map is None:
+            self._norm_map = _normalize_map(self.source, self.norm)
+        return self._norm_map
+
+    def deobf_map(self) -> OffsetMap:
+        # deobf -> norm; latin_to_cyr заменяет символ на символ, так что сдвигают только удаления
+        if self._deobf_map is None:
+            m, shift = OffsetMap(), 0
+            for r in OBFUSCATION_RE.finditer(self.norm):
+                m.add(r.start() - shift, shift + r.end() - r.start())
+                shift += r.end() - r.start()
+            self._deobf_map = m
+        return self._deobf_map
+
+    def original_span(self, view: str, start: int, end: int) -> Tuple[int, int]:
+        # [start, end) в представлении view ("norm" / "deobf") -> [start, end) в исходном тексте
+        if view == "deobf":
+            to_norm, norm_map = self.deobf_map(), self.norm_map()
+            to_source = lambda pos: norm_map(to_norm(pos))
+        else:
+            to_source = self.norm_map()
+        if end <= start:  # пустое совпадение
+            pos = to_source(start)
+            return pos, pos
+        return to_source(start), to_source(end - 1) + 1
+
+def _normalize_map(s: str, norm: str) -> OffsetMap:
+    # Сдвиг даёт только схлопывание пробельных пробегов длиннее одного символа
+    m, shift = OffsetMap(), 0
+    for r in LONG_WS_RE.finditer(s):
+        shift += r.end() - r.start() - 1
+        m.add(r.end() - shift, shift)
+    if len(s) - shift == len(norm):
+        return m
+    # lower() удлинил какие-то символы (İ -> i̇) — полный проход по пробегам и символам
+    m, shift, pos = OffsetMap(), 0, 0
+    for r in list(WS_RE.finditer(s)) + [None]:
+        chunk_end = r.start() if r else len(s)
+        chunk = s[pos:chunk_end]
+        if len(chunk.lower()) != len(chunk):
+            for i, ch in enumerate(chunk, pos):
+                extra = len(ch.lower()) - 1
+                if extra:
+                    # лишние символы нормализованной строки указывают на тот же исходный
+                    m.add(i - shift + 1, shift - extra)
+                    shift -= extra
+        if r is None:
+            break
+        shift += r.end() - r.start() - 1
+        m.add(r.end() - shift, shift)
+        pos = r.end()
+    return m
 
 def safe_json_dump(obj, path: str):
-    with open(path, "w", encoding="utf-8") as f:
+    # через временный файл: читатели из других воркеров не увидят полузаписанный JSON
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
         json.dump(obj, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, path)
@@ -0,0 +1,111 @@
+"""Микробенчмарк движка правил: исходный цикл re.finditer по каждому паттерну
+против предкомпилированных объединённых матчеров (app.services.rules).
+
+Запуск из корня репозитория:  python -m bench.bench_rules [--scenes 400] [--repeat 3] [--extra-rules 2000]
+"""
+import argparse
+import copy
+import random
+import re
+import time
+from typing import Any, Dict, List, Tuple
+
+from app.models.schemas import Scene
+from app.services import detector
+from app.services.rules import CompiledRules, compile_rules
+from app.utils.text import NormalizedText
+
+FILLER = ("он она сказал пошёл дом улица ночь свет окно дверь стол тихо громко "
+          "быстро медленно глаза руки коридор машина телефон").split()
+HITS = ["ударил сильно", "кровь", "х*уй", "с у к а", "блин", "героин", "поцелуй",
+        "в кадре", "подробно", "без мата", "жуткий", "расстрел", "пить пиво", "избил"]
+
+def make_scenes(n: int, seed: int = 7, density: float = 0.02) -> List[Scene]:
+    rnd = random.Random(seed)
+    scenes = []
+    for i in range(n):
+        words = [rnd.choice(HITS) if rnd.random() < density else rnd.choice(FILLER)
+                 for _ in range(rnd.randint(80, 600))]
+        text = " ".join(words)
+        scenes.append(Scene(id=f"S{i+1}", index=i, text=text, offset_start=0, offset_end=len(text)))
+    return scenes
+
+def with_extra_rules(rules: Dict[str, Any], n: int, seed: int = 11) -> Dict[str, Any]:
+    # Синтетические литеральные правила — проверяем, как время растёт с размером rules.yaml
+    rnd = random.Random(seed)
+    letters = "абвгдежзийклмнопрстуфхцчшщыэюя"
+    extra = copy.deepcopy(rules)
+    pats = {"severe": [], "moderate": [], "mild": []}
+    for i in range(n):
+        word = "".join(rnd.choice(letters) for _ in range(rnd.randint(5, 10)))
+        pats[["severe", "moderate", "mild"][i % 3]].append(word + ("(а)?" if i % 4 == 0 else ""))
+    extra["categories"]["synthetic"] = {"patterns": pats}
+    return extra
+
+def legacy_detect(scene: Scene, rules: Dict[str, Any]) -> List[Tuple]:
+    # Исходный движок: отдельный re.finditer на каждый паттерн и haystack
+    text = scene.text
+    view = NormalizedText(text)
+    norm, norm_deobf = view.norm, view.deobf
+    out = []
+    for cat, cfg in rules["categories"].items():
+        hits = []
+        for sev in ["severe", "moderate", "mild"]:
+            for p in cfg.get("patterns", {}).get(sev, []):
+                spans = [view.original_span(tag, *m.span())
+                         for hay, tag in [(norm, "norm"), (norm_deobf, "deobf")]
+                         for m in re.finditer(p, hay, flags=re.IGNORECASE)]
+                for s, e in detector.merge_spans(spans):
+                    hits.append([cat, sev.capitalize(), f"{cat}:{sev}:{p}", s, e,
+                                 text[max(0, s-30):min(len(text), e+30)]])
+        for bsev, pats in cfg.get("boosters", {}).items():
+            for p in pats:
+                if re.search(p, norm, flags=re.IGNORECASE) or re.search(p, norm_deobf, flags=re.IGNORECASE):
+                    for h in hits:
+                        h[1] = detector.max_severity(h[1], bsev.capitalize())
+        for anti in cfg.get("anti_fp", []) or []:
+            if re.search(anti, norm, flags=re.IGNORECASE):
+                for h in hits:
+                    h[1] = "None"
+        out.extend(tuple(h) for h in hits)
+    return out
+
+def compiled_detect(scene: Scene, compiled: CompiledRules) -> List[Tuple]:
+    return [(e.category, e.severity, e.rule_id, e.start, e.end, e.quote)
+            for e in detector.detect_in_scene(scene, compiled)]
+
+def best_of(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--scenes", type=int, default=400)
+    ap.add_argument("--repeat", type=int, default=3)
+    ap.add_argument("--extra-rules", type=int, default=0)
+    args = ap.parse_args()
+
+    rules = with_extra_rules(detector.RULES, args.extra_rules) if args.extra_rules else detector.RULES
+    t0 = time.perf_counter()
+    compiled = compile_rules(rules)
+    t_compile = time.perf_counter() - t0
+
+    scenes = make_scenes(args.scenes)
+    for sc in scenes:
+        if legacy_detect(sc, rules) != compiled_detect(sc, compiled):
+            raise SystemExit(f"Расхождение результатов в сцене {sc.id}")
+
+    t_legacy = best_of(lambda: [legacy_detect(sc, rules) for sc in scenes], args.repeat)
+    t_compiled = best_of(lambda: [compiled_detect(sc, compiled) for sc in scenes], args.repeat)
+    chars = sum(len(sc.text) for sc in scenes)
+    n_rules = sum(len(c.rules) for c in compiled.categories)
+    print(f"scenes={len(scenes)} chars={chars} rules={n_rules} compile={t_compile*1000:.1f} ms")
+    print(f"legacy:   {t_legacy*1000:8.1f} ms")
+    print(f"compiled: {t_compiled*1000:8.1f} ms  (x{t_legacy / max(t_compiled, 1e-9):.1f})")
+
+if __name__ == "__main__":
+    main()
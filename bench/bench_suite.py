@@ -0,0 +1,186 @@
+"""Бенчмарки этапов анализа на синтетических сценариях (bench/screenplay.py).
+
+Этапы: parser.load_document и segment_scenes (DOCX/PDF; DOCX — и прежним путём через
+python-docx, parse/docx_python_docx), detector.process_scenes,
+aggregate.compute_summary_and_rating, report.render_html/render_pdf и полный цикл
+/api/upload → /api/analyze → готовый результат. Время каждого случая — лучшее из
+--repeat прогонов (полный цикл API — один прогон: повтор попал бы в кеши).
+
+Старт: startup/* — импорт app.main (воркер uvicorn) и app.services.detector (процесс
+пула детекции) в чистом интерпретаторе, со снимком правил в data/cache.
+
+Сравнение с bench/baselines.json: случай медленнее базы больше чем на --threshold
+считается регрессией, код выхода 1. --update перезаписывает базу текущими замерами.
+База снята на одной машине — на другой сначала снимите свою (--update).
+
+Запуск из корня репозитория:
+    python -m bench.bench_suite [--pages 10 120 300 500] [--repeat 3] [--threshold 0.25] [--update]
+
+Потоковое чтение DOCX против python-docx на 300 страницах — parse/docx/300p и
+parse/docx_python_docx/300p: python -m bench.bench_suite --pages 300
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+# кеш сцен превратил бы повторные прогоны в чтение из SQLite
+os.environ.setdefault("RATING_SCENE_CACHE_ENABLED", "0")
+
+from bench import screenplay
+
+BASELINES = os.path.join(os.path.dirname(__file__), "baselines.json")
+FIXTURES = os.path.join(tempfile.gettempdir(), "rating-bench-fixtures")
+NOISE_FLOOR = 0.002  # с; разница меньше — шум таймера, а не регрессия
+
+def best_of(fn: Callable[[], Any], repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+def has_weasyprint() -> bool:
+    # WeasyPrint требует системных pango/cairo; без них PDF-отчёт пропускаем
+    try:
+        import weasyprint  # noqa: F401
+    except (ImportError, OSError) as ex:
+        print(f"пропуск report_pdf: {type(ex).__name__}: {ex}", file=sys.stderr)
+        return False
+    return True
+
+def render_uncached(render: Callable[[Any], str], analysis: Any, ext: str) -> str:
+    # report кеширует артефакты по ревизии — для замера рендера убираем готовый файл
+    from app.services import report
+    key = report.artifact_key(analysis.file_id, analysis.revision, analysis.checksum)
+    for path in (report.artifact_path(key, ext), report.artifact_path(key, "html")):
+        if os.path.exists(path):
+            os.remove(path)
+    return render(analysis)
+
+def python_docx_text(path: str) -> str:
+    from docx import Document
+    from app.utils.io import normalize_whitespace
+    return normalize_whitespace("\n".join(p.text for p in Document(path).paragraphs))
+
+def import_in_subprocess(module: str):
+    subprocess.run([sys.executable, "-c", f"import {module}"], check=True)
+
+def api_analyze(client, path: str, timeout: float = 600.0):
+    with open(path, "rb") as f:
+        r = client.post("/api/upload", files={"file": (os.path.basename(path), f.read())})
+    r.raise_for_status()
+    file_id = r.text.split('name="file_id" value="', 1)[1].split('"', 1)[0]
+    job = client.post("/api/analyze", data={"file_id": file_id}).json()
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        state = client.get(job["status_url"]).json()
+        if state["status"] == "done":
+            return
+        if state["status"] == "error":
+            raise RuntimeError(state["error"])
+        time.sleep(0.02)
+    raise TimeoutError(path)
+
+def run_cases(pages_list: List[int], repeat: int) -> Dict[str, float]:
+    from app.services import parser, detector, aggregate, pipeline, report
+
+    pdf = has_weasyprint()
+    results: Dict[str, float] = {}
+
+    def case(name: str, fn: Callable[[], Any], n: int = repeat):
+        results[name] = best_of(fn, n)
+        print(f"{name:32s} {results[name] * 1000:10.1f} ms", file=sys.stderr)
+
+    # снимок правил уже собран импортом detector выше — меряем тёплый старт
+    for module in ("app.main", "app.services.detector"):
+        case(f"startup/{module.rsplit('.', 1)[-1]}", lambda: import_in_subprocess(module))
+
+    for pages in pages_list:
+        docs = {}
+        for ext in (".docx", ".pdf"):
+            path = screenplay.fixture(FIXTURES, pages, ext)
+            fmt = ext[1:]
+            case(f"parse/{fmt}/{pages}p", lambda: parser.load_document(path))
+            if ext == ".docx":
+                # прежний путь через объектную модель python-docx — для сравнения с потоковым
+                case(f"parse/docx_python_docx/{pages}p", lambda: python_docx_text(path))
+            docs[fmt] = doc = parser.load_document(path)
+            case(f"segment/{fmt}/{pages}p", lambda: parser.segment_scenes(doc))
+
+        scenes = parser.segment_scenes(docs["docx"])
+        case(f"detect/{pages}p", lambda: detector.process_scenes(scenes))
+        hits_by_scene = detector.process_scenes(scenes)
+        path = screenplay.fixture(FIXTURES, pages, ".docx")
+        analysis = aggregate.build_analysis(f"bench-{pages}p", path, scenes, hits_by_scene)
+        case(f"aggregate/{pages}p", lambda: aggregate.compute_summary_and_rating(analysis))
+
+        result = analysis.to_result()  # отчёты, как и API, работают с AnalysisResult из хранилища
+        case(f"report_html/{pages}p", lambda: render_uncached(report.render_html, result, "html"))
+        if pdf:
+            case(f"report_pdf/{pages}p", lambda: render_uncached(report.render_pdf, result, "pdf"))
+
+    from fastapi.testclient import TestClient
+    from app.main import app
+    with TestClient(app) as client:
+        for pages in pages_list:
+            for ext in (".docx", ".pdf"):
+                # отдельный seed на прогон: другая загрузка, без дедупликации и кеша файла
+                path = screenplay.fixture(FIXTURES, pages, ext, seed=int(time.time()))
+                case(f"api_analyze/{ext[1:]}/{pages}p", lambda: api_analyze(client, path), n=1)
+                os.remove(path)
+    detector.shutdown_pool()
+    return results
+
+def compare(results: Dict[str, float], baselines: Dict[str, float], threshold: float) -> List[str]:
+    regressions = []
+    print(f"{'случай':32s} {'сейчас, ms':>12s} {'база, ms':>12s} {'x':>6s}")
+    for name, t in results.items():
+        base = baselines.get(name)
+        if base is None:
+            print(f"{name:32s} {t * 1000:12.1f} {'—':>12s}")
+            continue
+        ratio = t / max(base, 1e-9)
+        bad = t > base * (1 + threshold) and t - base > NOISE_FLOOR
+        print(f"{name:32s} {t * 1000:12.1f} {base * 1000:12.1f} {ratio:6.2f}" + ("  РЕГРЕССИЯ" if bad else ""))
+        if bad:
+            regressions.append(name)
+    return regressions
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--pages", type=int, nargs="+", default=[10, 120, 300, 500])
+    ap.add_argument("--repeat", type=int, default=3)
+    ap.add_argument("--threshold", type=float, default=0.25, help="допустимое замедление, доля")
+    ap.add_argument("--update", action="store_true", help="записать замеры в bench/baselines.json")
+    args = ap.parse_args()
+
+    results = run_cases(args.pages, args.repeat)
+    stored: Dict[str, Any] = {"machine": {}, "results": {}}
+    if os.path.exists(BASELINES):
+        with open(BASELINES, "r", encoding="utf-8") as f:
+            stored = json.load(f)
+
+    if args.update:
+        stored["machine"] = {"python": platform.python_version(), "platform": platform.platform(),
+                             "cpus": os.cpu_count()}
+        stored["results"].update({k: round(v, 6) for k, v in results.items()})
+        with open(BASELINES, "w", encoding="utf-8") as f:
+            json.dump(stored, f, ensure_ascii=False, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"база обновлена: {BASELINES}")
+        return
+
+    regressions = compare(results, stored["results"], args.threshold)
+    if regressions:
+        print(f"регрессии (> +{args.threshold:.0%}): {', '.join(regressions)}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
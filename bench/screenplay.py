@@ -0,0 +1,190 @@
+"""Детерминированный генератор синтетических русских сценариев для бенчмарков.
+
+Сценарий — страницы по ~50 строк: заголовки сцен (СЦЕНА N / ИНТ. / НАТ.), ремарки,
+диалоговые блоки (ИМЯ, ремарка в скобках, реплика). Доля строк с нарушениями из
+rules.yaml и доля обфусцированного мата задаются параметрами; при одинаковом seed
+результат побайтно одинаков. Выход — DOCX (python-docx) и PDF (собственный минимальный
+писатель: Type1-шрифт с кодировкой cp1251, без внешних зависимостей).
+
+Запуск из корня репозитория:  python -m bench.screenplay OUT_DIR [--pages 10 120 500]
+"""
+import argparse
+import os
+import random
+import textwrap
+from typing import List
+
+LINES_PER_PAGE = 50
+LINE_WIDTH = 60
+
+PLACES = ["КВАРТИРА ИВАНА", "КУХНЯ", "ПОДЪЕЗД", "ОФИС", "БАР «ЯКОРЬ»", "БОЛЬНИЧНЫЙ КОРИДОР",
+          "МАШИНА", "ШКОЛЬНЫЙ ДВОР", "ЛЕС", "ВОКЗАЛ", "ПОДВАЛ", "КРЫША"]
+TIMES = ["ДЕНЬ", "НОЧЬ", "УТРО", "ВЕЧЕР"]
+CHARACTERS = ["ИВАН", "МАРИНА", "СЕРГЕЙ ПЕТРОВИЧ", "ОЛЯ", "ДЕД", "СЛЕДОВАТЕЛЬ", "ВОДИТЕЛЬ"]
+PARENTHETICALS = ["(тихо)", "(зло)", "(смеётся)", "(в сторону)", "(по телефону)"]
+SUBJECTS = ["Иван", "Марина", "Сергей Петрович", "Оля", "Дед", "Водитель", "Кто-то"]
+VERBS = ["смотрит в окно", "медленно идёт к двери", "садится за стол", "молчит",
+         "закуривает у подъезда", "листает бумаги", "выключает свет", "прислушивается"]
+ADVERBS = ["Тихо.", "За стеной шумит телевизор.", "Дождь стучит по стеклу.",
+           "Где-то лает собака.", "Пауза.", "Часы показывают полночь."]
+REPLICAS = ["Ты где был всю ночь?", "Я не знаю, о чём ты.", "Давай поговорим потом.",
+            "Он обещал вернуться к утру.", "Не трогай это.", "Поехали, времени нет."]
+
+# строки с нарушениями по категориям rules.yaml
+HITS = ["Он ударил его сильно, крупным планом.", "На полу кровь.", "Иван избил охранника.",
+        "В кадре расстрел у стены.", "Они пьют пиво у ларька.", "Марина колет героин.",
+        "Страстный секс за кадром.", "Долгий поцелуй.", "Жуткий крик в темноте.",
+        "Дед курит сигарету.", "Ну ты и урод.", "Чёрт, опять опоздали.", "Блин, забыл ключи."]
+PROFANITY = ["сука", "хуй", "блять", "пизда", "мудак"]
+
+def obfuscate(word: str, rnd: random.Random) -> str:
+    # приёмы, которые снимает deobfuscate_obscene / latin_to_cyr
+    kind = rnd.randrange(4)
+    if kind == 0:
+        return word[0] + "*" + word[2:]
+    if kind == 1:
+        return " ".join(word)
+    if kind == 2:
+        return word.translate(str.maketrans("аеорсух", "aeopcyx"))
+    return "-".join(word)
+
+class Generator:
+    def __init__(self, seed: int = 1, hit_density: float = 0.04, obfuscated: float = 0.5):
+        self.rnd = random.Random(seed)
+        self.hit_density = hit_density
+        self.obfuscated = obfuscated
+        self.scene_no = 0
+
+    def action(self) -> str:
+        rnd = self.rnd
+        if rnd.random() < self.hit_density:
+            return rnd.choice(HITS)
+        return f"{rnd.choice(SUBJECTS)} {rnd.choice(VERBS)}. {rnd.choice(ADVERBS)}"
+
+    def replica(self) -> str:
+        rnd = self.rnd
+        if rnd.random() < self.hit_density:
+            word = rnd.choice(PROFANITY)
+            if rnd.random() < self.obfuscated:
+                word = obfuscate(word, rnd)
+            return f"Да пошёл ты, {word}!"
+        return rnd.choice(REPLICAS)
+
+    def header(self) -> str:
+        rnd = self.rnd
+        self.scene_no += 1
+        place = f"{rnd.choice(['ИНТ.', 'НАТ.'])} {rnd.choice(PLACES)} — {rnd.choice(TIMES)}"
+        return f"СЦЕНА {self.scene_no}. {place}" if rnd.random() < 0.5 else place
+
+    def scene(self) -> List[str]:
+        rnd = self.rnd
+        lines = [self.header(), ""]
+        for _ in range(rnd.randint(3, 12)):
+            if rnd.random() < 0.45:
+                lines += textwrap.wrap(self.action(), LINE_WIDTH)
+            else:
+                lines.append(rnd.choice(CHARACTERS))
+                if rnd.random() < 0.2:
+                    lines.append(rnd.choice(PARENTHETICALS))
+                lines += textwrap.wrap(self.replica(), LINE_WIDTH)
+            lines.append("")
+        return lines
+
+    def pages(self, n: int) -> List[List[str]]:
+        lines: List[str] = []
+        while len(lines) < n * LINES_PER_PAGE:
+            lines += self.scene()
+        return [lines[i:i + LINES_PER_PAGE] for i in range(0, n * LINES_PER_PAGE, LINES_PER_PAGE)]
+
+def generate(pages: int, seed: int = 1, hit_density: float = 0.04, obfuscated: float = 0.5) -> List[List[str]]:
+    return Generator(seed, hit_density, obfuscated).pages(pages)
+
+def write_docx(pages: List[List[str]], path: str):
+    from docx import Document
+    doc = Document()
+    for pidx, lines in enumerate(pages):
+        for line in lines:
+            doc.add_paragraph(line)
+        if pidx < len(pages) - 1:
+            doc.add_page_break()
+    doc.save(path)
+
+def _glyph_names() -> List[str]:
+    # коды 128..255 cp1251 -> имена глифов; по ним pdfminer восстанавливает Unicode
+    from pdfminer.glyphlist import glyphname2unicode
+    by_char = {}
+    for name, ch in glyphname2unicode.items():
+        if ch not in by_char or name.startswith("afii"):
+            by_char[ch] = name
+    names = []
+    for code in range(128, 256):
+        try:
+            ch = bytes([code]).decode("cp1251")
+        except UnicodeDecodeError:
+            ch = None
+        names.append(by_char.get(ch, ".notdef"))
+    return names
+
+def _pdf_string(line: str) -> bytes:
+    raw = line.encode("cp1251", errors="replace")
+    return b"(" + raw.replace(b"\\", b"\\\\").replace(b"(", b"\\(").replace(b")", b"\\)") + b")"
+
+def write_pdf(pages: List[List[str]], path: str):
+    # Минимальный PDF 1.4: по потоку контента на страницу, один шрифт с Differences на cp1251.
+    # BaseFont нестандартный — иначе pdfminer возьмёт метрики Helvetica без кириллицы.
+    objs: List[bytes] = []
+
+    def add(body: bytes) -> int:
+        objs.append(body)
+        return len(objs)
+
+    diffs = b" ".join(b"/" + n.encode() for n in _glyph_names())
+    font = add(b"<< /Type /Font /Subtype /Type1 /BaseFont /BenchSans /FirstChar 32 /LastChar 255 "
+               b"/Widths [" + b" ".join([b"500"] * 224) + b"] "
+               b"/Encoding << /Type /Encoding /BaseEncoding /WinAnsiEncoding /Differences [128 " + diffs + b"] >> >>")
+    pages_id = add(b"")
+    kids = []
+    for lines in pages:
+        content = b"BT /F1 10 Tf 50 760 Td 14 TL " + b" ".join(_pdf_string(l) + b" '" for l in lines) + b" ET"
+        stream = add(b"<< /Length %d >>\nstream\n" % len(content) + content + b"\nendstream")
+        kids.append(add(b"<< /Type /Page /Parent %d 0 R /MediaBox [0 0 612 792] "
+                        b"/Resources << /Font << /F1 %d 0 R >> >> /Contents %d 0 R >>" % (pages_id, font, stream)))
+    objs[pages_id - 1] = (b"<< /Type /Pages /Kids [" + b" ".join(b"%d 0 R" % k for k in kids) +
+                          b"] /Count %d >>" % len(kids))
+    catalog = add(b"<< /Type /Catalog /Pages %d 0 R >>" % pages_id)
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for i, body in enumerate(objs):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % (i + 1) + body + b"\nendobj\n"
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objs) + 1)
+    out += b"".join(b"%010d 00000 n \n" % o for o in offsets)
+    out += b"trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objs) + 1, catalog, xref)
+    with open(path, "wb") as f:
+        f.write(out)
+
+def fixture(out_dir: str, pages: int, ext: str, seed: int = 1) -> str:
+    # Путь к сгенерированному файлу; уже существующий не пересоздаётся
+    os.makedirs(out_dir, exist_ok=True)
+    path = os.path.join(out_dir, f"screenplay_{pages}p_s{seed}{ext}")
+    if not os.path.exists(path):
+        content = generate(pages, seed)
+        tmp = path + ".tmp"
+        (write_docx if ext == ".docx" else write_pdf)(content, tmp)
+        os.replace(tmp, path)
+    return path
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("out_dir")
+    ap.add_argument("--pages", type=int, nargs="+", default=[10, 120, 500])
+    ap.add_argument("--seed", type=int, default=1)
+    args = ap.parse_args()
+    for n in args.pages:
+        for ext in (".docx", ".pdf"):
+            print(fixture(args.out_dir, n, ext, args.seed))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,38 @@
+import random
+
+import pytest
+
+from app.services import parser
+from app.utils.io import join_pages
+
+def streamed(pieces, path="x.pdf", window_chars=10**9):
+    stream = parser.SceneStream(path, window_chars=window_chars)
+    return [sc for piece in pieces for sc in stream.feed(piece)] + list(stream.close())
+
+def segmented_pdf(pages):
+    text, spans = join_pages(pages)
+    return parser.segment_scenes({"type": "pdf", "text": text, "page_spans": spans})
+
+def dump(scenes):
+    return [sc.model_dump() for sc in scenes]
+
+@pytest.mark.parametrize("pages", [
+    ["Вводная часть", "\nСЦЕНА\n", "1НАТ. Двор"],  # номер заголовка — на следующей странице
+    ["СЦЕНА 1\nтекст\nсцена", "", "  \n", "2\nещё текст"],
+    ["СЦЕНА 1\nтекст\nСЦЕНА", "без номера\nINT. дом"],
+])
+def test_header_split_across_pages(pages):
+    assert dump(streamed(pages)) == dump(segmented_pdf(pages))
+
+def test_header_split_across_docx_pieces():
+    pieces = ["Вводная\nСЦ", "ЕНА", "\n\n", "12 ИНТ. Дом\nИВАН\nПривет"]
+    text = "".join(pieces)
+    expected = parser.segment_scenes({"type": "docx", "text": text, "page_spans": []})
+    assert dump(streamed(pieces, "x.docx")) == dump(expected)
+
+def test_random_page_streams_match_segment_scenes():
+    rnd = random.Random(7)
+    atoms = ["СЦЕНА", "сцена", " ", "\n", "\t", "1", "2", "НАТ.", "INT.", "x", "ИВАН", "\n\n"]
+    for _ in range(2000):
+        pages = ["".join(rnd.choice(atoms) for _ in range(rnd.randint(0, 6))) for _ in range(rnd.randint(1, 6))]
+        assert dump(streamed(pages)) == dump(segmented_pdf(pages)), pages